@@ -0,0 +1,106 @@
+import argparse
+import contextlib
+import os
+import time
+
+import cv2
+
+import AprilTagTest14 as localizer
+from tagRoiTracker import TagRoiTracker
+
+# Compares the per-frame cost of the rendered localizer loop (detect + per-tag print + drawing
+# [+ imshow]) with headless mode (detect + send only) on recorded footage.
+# Frames are decoded up front so only the per-frame processing is timed.
+# --track adds headless mode with the ROI tracker (tagRoiTracker.py) to the comparison.
+# Run: python AprilTagHeadlessBenchmark.py ../vids/3WheelsBothNoSoda.mp4 [--frames 300] [--show] [--track]
+
+DEFAULT_VIDEO = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "vids", "3WheelsBothNoSoda.mp4")
+DEFAULT_FRAMES = 300
+
+
+def load_frames(path, max_frames):
+    capture = cv2.VideoCapture(path)
+    if not capture.isOpened():
+        raise IOError(f"Could not open {path}")
+    frames = []
+    while len(frames) < max_frames:
+        ret, frame = capture.read()
+        if not ret:
+            break
+        frames.append(frame)
+    capture.release()
+    return frames
+
+
+def rendered_frame(frame, show):
+    """What the original loop does per frame, minus the fixed 50 ms sleep."""
+    poses = localizer.estimate_tag_poses(frame)
+    for pose in poses:
+        print(pose["text"])
+    localizer.send_tag_poses(poses)
+    localizer.draw_tag_poses(frame, poses)
+    if show:
+        cv2.imshow("AprilTag Detection", frame)
+        cv2.waitKey(1)
+    return poses
+
+
+def headless_frame(frame, show):
+    poses = localizer.estimate_tag_poses(frame)
+    localizer.send_tag_poses(poses)
+    return poses
+
+
+def time_mode(frames, process, show):
+    detections = 0
+    # Per-tag printing goes to /dev/null so the terminal speed doesn't decide the result (a real terminal is slower)
+    with open(os.devnull, "w") as sink, contextlib.redirect_stdout(sink):
+        start = time.perf_counter()
+        for frame in frames:
+            detections += len(process(frame.copy(), show)) # Copy in both modes: drawing writes into the frame
+        elapsed = time.perf_counter() - start
+    return len(frames) / elapsed, elapsed / len(frames) * 1000.0, detections
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rendered vs headless AprilTag localizer throughput.")
+    parser.add_argument("video", nargs="?", default=DEFAULT_VIDEO)
+    parser.add_argument("--frames", type=int, default=DEFAULT_FRAMES)
+    parser.add_argument("--show", action="store_true", help="Include imshow/waitKey in the rendered mode")
+    parser.add_argument("--track", action="store_true", help="Also time headless mode with the ROI tracker")
+    args = parser.parse_args()
+
+    if os.path.exists(localizer.CALIBRATION_FILE):
+        localizer.load_camera_calibration(localizer.CALIBRATION_FILE)
+    else:
+        print("No calibration file, using the pixel fallback.")
+    localizer.initialize_apriltag_detector()
+
+    frames = load_frames(args.video, args.frames)
+    if not frames:
+        print(f"No frames read from {args.video}")
+        return
+    print(f"{len(frames)} frames of {frames[0].shape[1]}x{frames[0].shape[0]} from {args.video}")
+
+    time_mode(frames[:10], headless_frame, False) # Warm-up
+    rendered_fps, rendered_ms, rendered_tags = time_mode(frames, rendered_frame, args.show)
+    headless_fps, headless_ms, headless_tags = time_mode(frames, headless_frame, False)
+    if args.show:
+        cv2.destroyAllWindows()
+
+    print(f"Rendered: {rendered_fps:7.1f} FPS ({rendered_ms:6.2f} ms/frame), {rendered_tags} tag detections")
+    print(f"Headless: {headless_fps:7.1f} FPS ({headless_ms:6.2f} ms/frame), {headless_tags} tag detections")
+    print(f"Headless gain: {headless_fps / rendered_fps:.2f}x "
+          f"(the original loop is also capped below 20 FPS by its 50 ms sleep)")
+
+    if args.track:
+        localizer.tag_tracker = TagRoiTracker(localizer.tag_detector)
+        tracked_fps, tracked_ms, tracked_tags = time_mode(frames, headless_frame, False)
+        print(f"Tracked:  {tracked_fps:7.1f} FPS ({tracked_ms:6.2f} ms/frame), {tracked_tags} tag detections, "
+              f"{tracked_fps / headless_fps:.2f}x over full-frame headless")
+        print(localizer.tag_tracker.stats_line())
+        localizer.tag_tracker = None
+
+
+if __name__ == "__main__":
+    main()
@@ -3,8 +3,14 @@ import apriltag
 import time
 import numpy as np
 import pickle
-import socket
 import math # Import the math module for trigonometric functions
+import threading
+import argparse
+from collections import deque
+from tagRoiTracker import TagRoiTracker
+from calibrationCache import CalibrationCache
+from frameRecorder import FORMATS as RECORD_FORMATS, FrameRecorder
+from poseStream import POSE_HOST, POSE_PORT, PoseStreamServer
 
 # --- Configuration ---
 CAMERA_INDEX = 0
@@ -21,24 +27,34 @@ TAG_TO_ROBOT_CENTER_X_MM = 0.0  # Offset in mm along the AprilTag's local X-axis
 TAG_TO_ROBOT_CENTER_Y_MM = 0.0  # Offset in mm along the AprilTag's local Y-axis to the robot's center
 TAG_TO_ROBOT_CENTER_YAW_DEG = 0.0 # Offset in degrees from AprilTag's yaw to the robot's actual yaw
 
+# Pipelined mode (--pipeline): capture, detection and display run as separate stages
+STATS_INTERVAL_S = 5.0   # How often the per-stage FPS/latency line is printed
+PREVIEW_HZ = 5.0         # Preview window rate in --headless mode (0 = no window at all)
+LATENCY_WINDOW = 200     # Latency samples kept per stage
+
 # --- Global Variables ---
 tag_detector = None
+tag_tracker = None # TagRoiTracker when --track is on
 camera_capture = None
 camera_matrix = None
 dist_coeffs = None
-server_socket = None
-client_connection = None
+calibration_cache = None # CalibrationCache built from camera_matrix/dist_coeffs by load_camera_calibration
+undistort_preview = False # --undistort-preview: remap the preview through the cached undistortion tables
+pose_server = None # PoseStreamServer, started by setup_socket_server
+frame_recorder = None # FrameRecorder when --record is on
 
-def initialize_camera():
-    """Initializes the camera capture."""
+def initialize_camera(source=CAMERA_INDEX):
+    """Initializes the camera capture. source is a camera index or a video file path."""
     global camera_capture
-    camera_capture = cv2.VideoCapture(CAMERA_INDEX)
+    if isinstance(source, str) and source.isdigit():
+        source = int(source) # "0" from the command line means camera 0, not a file
+    camera_capture = cv2.VideoCapture(source)
     if not camera_capture.isOpened():
         raise IOError("Could not open camera.")
     return camera_capture
 
-def initialize_apriltag_detector():
-    """Initializes the AprilTag detector."""
+def initialize_apriltag_detector(nthreads=4, quad_decimate=1.0, refine_edges=1):
+    """Initializes the AprilTag detector. Worker processes of the multi-camera localizer pass nthreads=1."""
     global tag_detector
 
     # 1. Initialize the Detector without arguments
@@ -47,9 +63,9 @@ def initialize_apriltag_detector():
     # 2. Create an options object and set parameters
     options = apriltag.DetectorOptions(
         families=APRILTAG_FAMILY,
-        nthreads=4,
-        quad_decimate=1.0,
-        refine_edges=1,
+        nthreads=nthreads,
+        quad_decimate=quad_decimate,
+        refine_edges=refine_edges,
         debug=0
     )
 
@@ -61,12 +77,13 @@ def initialize_apriltag_detector():
 
 def load_camera_calibration(filepath):
     """Loads camera calibration data from a pickle file."""
-    global camera_matrix, dist_coeffs
+    global camera_matrix, dist_coeffs, calibration_cache
     try:
         with open(filepath, 'rb') as f:
             calibration_data = pickle.load(f)
             camera_matrix = calibration_data['camera_matrix']
             dist_coeffs = calibration_data['dist_coeffs']
+        calibration_cache = CalibrationCache(camera_matrix, dist_coeffs)
         print("Camera calibration data loaded successfully.")
     except FileNotFoundError:
         print(f"Error: Calibration file not found at {filepath}")
@@ -78,76 +95,76 @@ def load_camera_calibration(filepath):
         print(f"Error loading calibration data: {e}")
         exit()
 
-def setup_socket_server(host='127.0.0.1', port=65432):
-    """Sets up a TCP socket server to send AprilTag data."""
-    global server_socket, client_connection
-    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+def setup_socket_server(host=POSE_HOST, port=POSE_PORT):
+    """
+    Starts the pose stream server (poseStream.py). It accepts any number of clients in the
+    background, so detection starts right away instead of waiting for the first connection.
+    """
+    global pose_server
     try:
-        server_socket.bind((host, port))
-        server_socket.listen(1)
-        print(f"Listening for connections on {host}:{port}")
-        # Accept a connection (this will block until a client connects)
-        client_connection, client_address = server_socket.accept()
-        print(f"Accepted connection from {client_address}")
+        pose_server = PoseStreamServer(host, port)
+        pose_server.start()
     except Exception as e:
         print(f"Error setting up socket server: {e}")
-        server_socket = None
-        client_connection = None
+        pose_server = None
 
 
-def process_apriltag_data(frame):
+def estimate_tag_poses(frame, timing=None):
     """
-    Detects AprilTags in the given frame, performs pose estimation,
-    displays the camera feed, and sends data over socket.
+    Detects AprilTags in the frame and estimates the robot pose for each one.
+    Returns a list of pose dictionaries; no drawing, printing or sending happens here.
     Applies configurable offsets from AprilTag center to robot's center.
+    If a timing dictionary is given, the monotonic "detect_start", "detect_end" and "pnp_end" stamps go into it.
     """
+    if timing is not None:
+        timing["detect_start"] = time.monotonic()
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    results = detect_tags(gray)
+    if timing is not None:
+        timing["detect_end"] = time.monotonic()
+    poses = poses_from_detections(results, frame)
+    if timing is not None:
+        timing["pnp_end"] = time.monotonic()
+    return poses
+
+
+def detect_tags(gray):
+    """Runs the detector (or the ROI tracker when it is on) on a grayscale frame."""
     if tag_detector is None:
         raise ValueError("AprilTag detector not initialized.")
-    if camera_matrix is None or dist_coeffs is None:
-        print("Warning: Camera calibration data not loaded. Distances will not be accurate.")
+    if tag_tracker is not None:
+        return tag_tracker.detect(gray) # Searches around the last known tags instead of the whole frame
+    return tag_detector.detect(gray)
 
-    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-    results = tag_detector.detect(gray)
-
-    # Add the 'Press Q to quit' reminder
-    cv2.putText(frame, "Press 'Q' to quit", (10, 30),
-                cv2.FONT_HERSHEY_SIMPLEX, 0.7,
-                (0, 0, 255), 2)
 
+def poses_from_detections(results, frame):
+    """Pose estimation part of estimate_tag_poses (visionBenchmark.py times the stages separately)."""
     if not results:
-        cv2.imshow("AprilTag Detection", frame)
-        return
+        return []
 
-    half_size = TAG_SIZE_MM / 2.0
-    object_points = np.array([
-        [-half_size, half_size, 0],
-        [half_size, half_size, 0],
-        [half_size, -half_size, 0],
-        [-half_size, -half_size, 0]
-    ], dtype=np.float32)
+    # Corners and centers of every tag, corrected for lens distortion in one small call
+    ideal_points = calibration_cache.undistort_detections(results) if calibration_cache is not None else None
 
-    for r in results:
+    poses = []
+    for i, r in enumerate(results):
         tag_id = r.tag_id
+        pose = {"tag_id": tag_id, "corners": r.corners, "center": r.center, "sent": False}
 
-        if camera_matrix is not None and dist_coeffs is not None:
-            image_points = r.corners.astype(np.float32)
-
-            success, rvec, tvec = cv2.solvePnP(object_points, image_points, camera_matrix, dist_coeffs, flags=cv2.SOLVEPNP_IPPE)
+        if ideal_points is not None:
+            success, tvec, rotation_matrix = calibration_cache.solve_tag_pose(ideal_points[i, :4], TAG_SIZE_MM)
 
             if success:
                 # --- Get Tag's Pose (raw from solvePnP) ---
-                tag_x_mm = tvec[0][0]
-                tag_y_mm = tvec[1][0]
-                tag_z_mm = tvec[2][0]
+                tag_x_mm = float(tvec[0][0])
+                tag_y_mm = float(tvec[1][0])
+                tag_z_mm = float(tvec[2][0])
 
-                rotation_matrix, _ = cv2.Rodrigues(rvec)
-                sy = np.sqrt(rotation_matrix[0,0] * rotation_matrix[0,0] +  rotation_matrix[1,0] * rotation_matrix[1,0])
+                sy = math.sqrt(rotation_matrix[0,0] * rotation_matrix[0,0] +  rotation_matrix[1,0] * rotation_matrix[1,0])
 
                 if sy < 1e-6: # Check for singular
-                    tag_yaw_deg = np.degrees(np.arctan2(-rotation_matrix[1,2], rotation_matrix[1,1]))
+                    tag_yaw_deg = math.degrees(math.atan2(-rotation_matrix[1,2], rotation_matrix[1,1]))
                 else:
-                    tag_yaw_deg = np.degrees(np.arctan2(rotation_matrix[1,0], rotation_matrix[0,0]))
+                    tag_yaw_deg = math.degrees(math.atan2(rotation_matrix[1,0], rotation_matrix[0,0]))
 
                 # Normalize tag yaw to be between 0 and 360
                 tag_yaw_deg = (tag_yaw_deg + 360) % 360
@@ -168,71 +185,300 @@ def process_apriltag_data(frame):
                 # Add the yaw offset directly
                 robot_yaw_deg = (tag_yaw_deg + TAG_TO_ROBOT_CENTER_YAW_DEG) % 360
 
-                text = f"ID:{tag_id} RX:{robot_x_mm:.2f} RY:{robot_y_mm:.2f} RZ:{tag_z_mm:.2f} RYaw:{robot_yaw_deg:.2f} deg"
-                print(text)
-
-                global server_socket, client_connection
-
-                if client_connection:
-                    try:
-                        # Send the robot's estimated pose
-                        data_to_send = f"{tag_id},{robot_x_mm:.2f},{robot_y_mm:.2f},{tag_z_mm:.2f},{robot_yaw_deg:.2f}\n"
-                        client_connection.sendall(data_to_send.encode('utf-8'))
-                    except Exception as e:
-                        print(f"Error sending data: {e}")
-                        if server_socket:
-                            server_socket.close()
-                        server_socket = None
-                        client_connection = None
-                        print("Attempting to re-establish socket connection...")
-
+                pose.update(x=robot_x_mm, y=robot_y_mm, z=tag_z_mm, yaw=robot_yaw_deg, sent=True)
+                pose["text"] = f"ID:{tag_id} RX:{robot_x_mm:.2f} RY:{robot_y_mm:.2f} RZ:{tag_z_mm:.2f} RYaw:{robot_yaw_deg:.2f} deg"
             else:
-                robot_x_mm, robot_y_mm, tag_z_mm, robot_yaw_deg = 0, 0, 0, 0
-                text = f"ID:{tag_id} Pose estimation failed."
-                print(text)
+                # Pixel position for the display only (not sent), at least corrected for lens distortion
+                pixel_fallback_pose(pose, ideal_points[i, 4], ideal_points[i, 0], ideal_points[i, 1], frame)
+                pose["text"] = f"ID:{tag_id} Pose estimation failed. " + pose["text"]
         else:
             # Fallback to pixel coordinates if calibration data is missing (not ideal for robot control)
-            translation = r.center - np.array([frame.shape[1] / 2, frame.shape[0] / 2])
-            robot_x_mm = translation[0] # These are still pixel values, not real distances
-            robot_y_mm = translation[1]
+            pixel_fallback_pose(pose, r.center, r.corners[0], r.corners[1], frame)
+            pose["text"] += " (No calibration)"
+        poses.append(pose)
+    return poses
 
-            corner0 = r.corners[0].ravel()
-            corner1 = r.corners[1].ravel()
-            angle_rad = np.arctan2(corner1[1] - corner0[1], corner1[0] - corner0[0])
-            robot_yaw_deg = np.degrees(angle_rad)
-            robot_yaw_deg = (robot_yaw_deg + 360) % 360
 
-            text = f"ID:{tag_id} RX_px:{robot_x_mm:.2f} RY_px:{robot_y_mm:.2f} RYaw_approx:{robot_yaw_deg:.2f} deg (No calibration)"
-            print(text)
+def pixel_fallback_pose(pose, center, corner0, corner1, frame):
+    """Fills in a pixel-coordinate pose (offset from the image center, approximate yaw from the first edge)."""
+    robot_x_mm = float(center[0]) - frame.shape[1] / 2 # These are still pixel values, not real distances
+    robot_y_mm = float(center[1]) - frame.shape[0] / 2
+
+    angle_rad = math.atan2(corner1[1] - corner0[1], corner1[0] - corner0[0])
+    robot_yaw_deg = math.degrees(angle_rad)
+    robot_yaw_deg = (robot_yaw_deg + 360) % 360
+
+    pose.update(x=robot_x_mm, y=robot_y_mm, z=0, yaw=robot_yaw_deg)
+    pose["text"] = f"ID:{pose['tag_id']} RX_px:{robot_x_mm:.2f} RY_px:{robot_y_mm:.2f} RYaw_approx:{robot_yaw_deg:.2f} deg"
+
+
+def send_tag_poses(poses, capture_ts=None, timing=None):
+    """
+    Publishes the calibrated robot poses of one frame to every connected client.
+    capture_ts is the wall-clock time the frame was captured (defaults to now); timing holds the
+    frame's monotonic stage stamps, which travel with the poses so clients can tell how old they are.
+    """
+    if pose_server is None:
+        return
+    calibrated = [pose for pose in poses if pose["sent"]]
+    if calibrated:
+        pose_server.publish(calibrated, capture_ts, timing) # Never blocks: slow clients just get the newest poses later
 
+
+def draw_tag_poses(frame, poses):
+    """Draws the tag outlines, the pose text and the quit reminder onto the frame."""
+    # Add the 'Press Q to quit' reminder
+    cv2.putText(frame, "Press 'Q' to quit", (10, 30),
+                cv2.FONT_HERSHEY_SIMPLEX, 0.7,
+                (0, 0, 255), 2)
+
+    for pose in poses:
         try:
-            corners = np.array(r.corners, dtype=np.int32).reshape((-1, 1, 2))
+            corners = np.array(pose["corners"], dtype=np.int32).reshape((-1, 1, 2))
             cv2.polylines(frame, [corners], isClosed=True, color=(0, 255, 0), thickness=2)
         except Exception as e:
             print(f"Error drawing outline: {e}")
-            print(f"Corners: {r.corners}")
+            print(f"Corners: {pose['corners']}")
             continue
 
-        center_x, center_y = int(r.center[0]), int(r.center[1])
-        cv2.putText(frame, text, (10, frame.shape[0] - 10),
+        cv2.putText(frame, pose["text"], (10, frame.shape[0] - 10),
                     cv2.FONT_HERSHEY_SIMPLEX, 0.7,
                     (255, 255, 255), 2)
 
 
+def process_apriltag_data(frame, capture_ts=None, grab_mono=None):
+    """
+    Detects AprilTags in the given frame, performs pose estimation,
+    displays the camera feed, and sends data over socket.
+    grab_mono is the time.monotonic() stamp taken when the frame was read.
+    """
+    if camera_matrix is None or dist_coeffs is None:
+        print("Warning: Camera calibration data not loaded. Distances will not be accurate.")
+
+    timing = {"grab": grab_mono} if grab_mono is not None else None
+    poses = estimate_tag_poses(frame, timing)
+    for pose in poses:
+        print(pose["text"])
+    send_tag_poses(poses, capture_ts, timing)
+    if frame_recorder is not None:
+        frame_recorder.record(frame, poses, capture_ts) # Copied before the overlay is drawn
+    draw_tag_poses(frame, poses)
     cv2.imshow("AprilTag Detection", frame)
 
 
+# --- Pipelined Mode ---
+# Grab thread -> latest-frame slot -> detection worker -> latest-result slot -> display (main thread).
+# Each slot holds only the newest item: a stage that falls behind skips to the newest frame
+# instead of working through a backlog, so pose latency stays at about one detection time.
+
+class LatestSlot:
+    """Holds the newest item from a producer thread; older items that were never taken are dropped."""
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.item = None
+        self.item_id = 0 # Increments with every put()
+        self.dropped = 0 # Items replaced before anyone took them
+        self.taken_id = 0
+        self.closed = False
+
+    def put(self, item):
+        with self.condition:
+            if self.item is not None and self.taken_id != self.item_id:
+                self.dropped += 1
+            self.item = item
+            self.item_id += 1
+            self.condition.notify_all()
+
+    def get(self, last_id, timeout=0.5):
+        """Waits for an item newer than last_id. Returns (item_id, item) or (last_id, None) on timeout/close."""
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.item_id != last_id or self.closed, timeout):
+                return last_id, None
+            if self.closed:
+                return last_id, None
+            self.taken_id = self.item_id
+            return self.item_id, self.item
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+
+class StageStats:
+    """Frame rate and capture-to-output latency of one pipeline stage."""
+    def __init__(self, name, window=LATENCY_WINDOW):
+        self.name = name
+        self.count = 0
+        self.latencies_ms = deque(maxlen=window)
+        self.lock = threading.Lock()
+        self.window_start = time.perf_counter()
+
+    def record(self, capture_time):
+        with self.lock:
+            self.count += 1
+            if capture_time is not None:
+                self.latencies_ms.append((time.perf_counter() - capture_time) * 1000.0)
+
+    def report(self):
+        """Returns a one-line summary since the last report and starts a new measuring window."""
+        with self.lock:
+            now = time.perf_counter()
+            fps = self.count / (now - self.window_start)
+            samples = sorted(self.latencies_ms)
+            self.count = 0
+            self.window_start = now
+        line = f"{self.name}: {fps:5.1f} FPS"
+        if samples:
+            line += (f", latency avg {sum(samples) / len(samples):6.1f} ms"
+                     f" p95 {samples[int(0.95 * (len(samples) - 1))]:6.1f} ms")
+        return line
+
+
+def grab_thread_target(frame_slot, stats, running):
+    """Reads frames as fast as the camera delivers them and keeps only the newest."""
+    frame_id = 0
+    while running.is_set():
+        ret, frame = camera_capture.read()
+        if not ret:
+            print("Error: Could not read frame. Stopping capture.")
+            running.clear()
+            break
+        capture_time = time.perf_counter() # Stamped when the frame is in hand; read() returns at about the exposure end
+        capture_ts = time.time() # Wall clock for the pose stream
+        timing = {"grab": time.monotonic()} # Stage stamps, filled in by the detect thread and sent with the poses
+        frame_id += 1
+        frame_slot.put((frame_id, capture_time, capture_ts, timing, frame))
+        stats.record(None)
+    frame_slot.close()
+
+
+def detect_thread_target(frame_slot, result_slot, stats, running):
+    """Runs detection and pose estimation on the newest frame only and sends the poses out."""
+    last_id = 0
+    while running.is_set():
+        last_id, item = frame_slot.get(last_id)
+        if item is None:
+            continue
+        frame_id, capture_time, capture_ts, timing, frame = item
+        try:
+            poses = estimate_tag_poses(frame, timing)
+        except (ValueError, cv2.error) as e:
+            print(f"Detection error: {e}")
+            continue
+        send_tag_poses(poses, capture_ts, timing)
+        if frame_recorder is not None:
+            frame_recorder.record(frame, poses, capture_ts, frame_id) # Drops rather than waits if the disk falls behind
+        stats.record(capture_time)
+        result_slot.put((frame_id, capture_time, frame, poses))
+    result_slot.close()
+
+
+def run_pipelined(display=True, preview_hz=None):
+    """
+    Runs capture, detection and (optionally) display as separate stages and prints per-stage stats.
+    preview_hz limits the display stage to a low-rate preview (headless mode); None shows every result.
+    """
+    running = threading.Event()
+    running.set()
+    frame_slot = LatestSlot()
+    result_slot = LatestSlot()
+    grab_stats = StageStats("Capture")
+    detect_stats = StageStats("Detect+pose")
+    display_stats = StageStats("Preview" if preview_hz else "Display")
+    preview_interval = 1.0 / preview_hz if preview_hz else 0.0
+    last_preview = 0.0
+
+    grab_thread = threading.Thread(target=grab_thread_target, args=(frame_slot, grab_stats, running), daemon=True)
+    detect_thread = threading.Thread(target=detect_thread_target, args=(frame_slot, result_slot, detect_stats, running), daemon=True)
+    grab_thread.start()
+    detect_thread.start()
+
+    last_id = 0
+    last_report = time.perf_counter()
+    try:
+        while running.is_set():
+            if display:
+                # HighGUI must stay on the main thread, so this is where the display stage runs
+                last_id, item = result_slot.get(last_id, timeout=0.05)
+                if item is not None and time.perf_counter() - last_preview >= preview_interval:
+                    last_preview = time.perf_counter()
+                    frame_id, capture_time, frame, poses = item
+                    draw_tag_poses(frame, poses)
+                    if undistort_preview and calibration_cache is not None:
+                        frame = calibration_cache.undistort_frame(frame) # Overlay is drawn first, so it stays aligned
+                    cv2.imshow("AprilTag Detection", frame)
+                    display_stats.record(capture_time)
+                if cv2.waitKey(1) & 0xFF == ord('q'):
+                    break
+            else:
+                time.sleep(0.05)
+
+            if time.perf_counter() - last_report >= STATS_INTERVAL_S:
+                last_report = time.perf_counter()
+                stages = [grab_stats, detect_stats] + ([display_stats] if display else [])
+                print(" | ".join(stage.report() for stage in stages) +
+                      f" | dropped: {frame_slot.dropped} frames, {result_slot.dropped} results")
+                if tag_tracker is not None:
+                    print(tag_tracker.stats_line())
+                if frame_recorder is not None:
+                    print(frame_recorder.stats_line())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        running.clear()
+        frame_slot.close()
+        result_slot.close()
+        grab_thread.join(timeout=1.0)
+        detect_thread.join(timeout=1.0)
+
+
 def main():
     """
     Main function to initialize components and run the AprilTag detection loop.
     """
-    global camera_capture
+    global camera_capture, tag_tracker, undistort_preview, frame_recorder
+    parser = argparse.ArgumentParser(description="AprilTag robot localizer.")
+    parser.add_argument("--pipeline", action="store_true", help="Run capture, detection and display in parallel stages")
+    parser.add_argument("--no-display", action="store_true", help="Pipelined mode without the display stage")
+    parser.add_argument("--headless", action="store_true",
+                        help="Production mode: pipelined, no per-tag printing or drawing except a low-rate preview")
+    parser.add_argument("--preview-hz", type=float, default=PREVIEW_HZ,
+                        help="Preview rate in headless mode (0 = no window)")
+    parser.add_argument("--source", default=CAMERA_INDEX, help="Camera index or video file")
+    parser.add_argument("--serve", action="store_true", help="Publish poses to robotDirector and other clients")
+    parser.add_argument("--port", type=int, default=POSE_PORT, help="Pose stream port")
+    parser.add_argument("--track", action="store_true",
+                        help="Search only around the last known tag positions, with adaptive decimation")
+    parser.add_argument("--undistort-preview", action="store_true",
+                        help="Show the pipelined preview corrected for lens distortion (preview only)")
+    parser.add_argument("--record", metavar="DIR", default=None,
+                        help="Record frames and poses to DIR in the background (replay with visionBenchmark.py)")
+    parser.add_argument("--record-format", choices=RECORD_FORMATS, default="video",
+                        help="video: MJPG .avi; npy: raw frames in chunked .npy memmaps")
+    args = parser.parse_args()
+    undistort_preview = args.undistort_preview
+
     try:
         load_camera_calibration(CALIBRATION_FILE)
-        camera_capture = initialize_camera()
+        camera_capture = initialize_camera(args.source)
         tag_detector = initialize_apriltag_detector()
-        # Uncomment the line below to enable the socket server for sending data
-        # setup_socket_server()
+        if args.track:
+            tag_tracker = TagRoiTracker(tag_detector)
+        if args.serve:
+            setup_socket_server(port=args.port)
+        if args.record:
+            frame_recorder = FrameRecorder(args.record, args.record_format).start()
+
+        if args.headless:
+            # Detection never draws or prints; the preview is rendered from the result slot on the main thread
+            if camera_matrix is None or dist_coeffs is None:
+                print("Warning: Camera calibration data not loaded. Distances will not be accurate.")
+            run_pipelined(display=args.preview_hz > 0, preview_hz=args.preview_hz)
+            return
+        if args.pipeline:
+            run_pipelined(display=not args.no_display)
+            return
 
         while True:
             ret, frame = camera_capture.read()
@@ -240,7 +486,7 @@ def main():
                 print("Error: Could not read frame. Exiting.")
                 break
 
-            process_apriltag_data(frame)
+            process_apriltag_data(frame, time.time(), time.monotonic())
 
             if cv2.waitKey(1) & 0xFF == ord('q'):
                 break
@@ -252,12 +498,11 @@ def main():
         if camera_capture:
             camera_capture.release()
             print("Camera released")
-        if client_connection:
-            client_connection.close()
-            print("Client connection closed")
-        if server_socket:
-            server_socket.close()
-            print("Server socket closed")
+        if pose_server:
+            pose_server.stop()
+            print("Pose server stopped")
+        if frame_recorder:
+            frame_recorder.stop()
         cv2.destroyAllWindows()
         print("All windows destroyed")
 
@@ -0,0 +1,99 @@
+import cv2
+import numpy as np
+
+# Per-camera cache of everything the localizer derives from the calibration (camera_matrix,
+# dist_coeffs from camCalibration2.py), so the per-frame pose work only touches a few small
+# preallocated arrays:
+#   - tag object points, built once per tag size instead of every frame
+#   - corner undistortion with cv2.undistortPoints for all tags of a frame in one call; solvePnP
+#     then runs on ideal pinhole points with zero distortion, and the pixel fallback gets
+#     distortion-corrected coordinates too
+#   - optional initUndistortRectifyMap tables for an undistorted preview (never used for detection:
+#     full frames are not undistorted just to estimate poses)
+
+MAX_TAGS = 32           # Tags per frame the preallocated buffers hold (grown if a frame ever has more)
+POINTS_PER_TAG = 5      # 4 corners + the center
+
+
+def tag_object_points(tag_size_mm):
+    """Corner coordinates of a square tag in its own frame, in the corner order the detector reports."""
+    half_size = tag_size_mm / 2.0
+    return np.array([
+        [-half_size, half_size, 0],
+        [half_size, half_size, 0],
+        [half_size, -half_size, 0],
+        [-half_size, -half_size, 0]
+    ], dtype=np.float32)
+
+
+class CalibrationCache:
+    def __init__(self, camera_matrix, dist_coeffs, max_tags=MAX_TAGS):
+        self.camera_matrix = np.ascontiguousarray(camera_matrix, dtype=np.float64)
+        if dist_coeffs is None:
+            dist_coeffs = np.zeros(5)
+        self.dist_coeffs = np.ascontiguousarray(dist_coeffs, dtype=np.float64).reshape(-1, 1)
+        self.zero_dist = np.zeros((4, 1)) # undistorted points go to solvePnP with no distortion
+        self.max_tags = max_tags
+        self._object_points = {} # tag size -> (4, 3) float32
+
+        # Reused per-frame buffers
+        self._raw_points = np.zeros((max_tags * POINTS_PER_TAG, 1, 2), dtype=np.float32)
+        self._ideal_points = np.zeros((max_tags * POINTS_PER_TAG, 1, 2), dtype=np.float32)
+        self._rvec = np.zeros((3, 1))
+        self._tvec = np.zeros((3, 1))
+        self._rotation = np.zeros((3, 3))
+
+        # Preview remap tables, built on the first frame of a given size
+        self._map_size = None
+        self._map1 = None
+        self._map2 = None
+        self._preview = None
+
+    def object_points(self, tag_size_mm):
+        points = self._object_points.get(tag_size_mm)
+        if points is None:
+            points = self._object_points[tag_size_mm] = tag_object_points(tag_size_mm)
+        return points
+
+    def undistort_detections(self, results):
+        """
+        Undistorts the corners and center of every detection in one cv2.undistortPoints call.
+        Returns a (len(results), 5, 2) view of ideal pixel coordinates (same camera matrix, no lens
+        distortion): rows 0-3 are the corners, row 4 the center. The view is reused by the next call.
+        """
+        count = len(results)
+        if count > self.max_tags:
+            self.max_tags = count
+            self._raw_points = np.zeros((count * POINTS_PER_TAG, 1, 2), dtype=np.float32)
+            self._ideal_points = np.zeros((count * POINTS_PER_TAG, 1, 2), dtype=np.float32)
+        raw = self._raw_points
+        for i in range(count):
+            base = i * POINTS_PER_TAG
+            raw[base:base + 4, 0, :] = results[i].corners
+            raw[base + 4, 0, :] = results[i].center
+        points = count * POINTS_PER_TAG
+        cv2.undistortPoints(raw[:points], self.camera_matrix, self.dist_coeffs,
+                            dst=self._ideal_points[:points], P=self.camera_matrix)
+        return self._ideal_points[:points].reshape(count, POINTS_PER_TAG, 2)
+
+    def solve_tag_pose(self, ideal_points, tag_size_mm):
+        """
+        solvePnP (IPPE) on one tag's undistorted corners, a (4, 2) array from undistort_detections.
+        Returns (success, tvec (3, 1), rotation matrix (3, 3)); the arrays are reused by the next call.
+        """
+        success, rvec, tvec = cv2.solvePnP(self.object_points(tag_size_mm), ideal_points, self.camera_matrix,
+                                           self.zero_dist, rvec=self._rvec, tvec=self._tvec, flags=cv2.SOLVEPNP_IPPE)
+        if not success:
+            return False, tvec, self._rotation
+        cv2.Rodrigues(rvec, dst=self._rotation)
+        return True, tvec, self._rotation
+
+    def undistort_frame(self, frame):
+        """Undistorted copy of a frame for the preview, through cached remap tables (output buffer reused)."""
+        size = (frame.shape[1], frame.shape[0])
+        if self._map_size != size:
+            self._map1, self._map2 = cv2.initUndistortRectifyMap(self.camera_matrix, self.dist_coeffs, None,
+                                                                 self.camera_matrix, size, cv2.CV_16SC2)
+            self._preview = np.empty_like(frame)
+            self._map_size = size
+        return cv2.remap(frame, self._map1, self._map2, cv2.INTER_LINEAR, dst=self._preview)
@@ -0,0 +1,346 @@
+import argparse
+import math
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+from gcodePath import compile_file
+from pathTracker import PurePursuitTracker
+
+# Closed-loop G-code execution: a control thread running at a fixed rate reads the filtered robot
+# pose, finds where the robot is along the compiled path (pathTracker, a windowed search over the
+# cumulative arc length with a grid index behind it) and steers pure-pursuit style: full programmed
+# feed toward a look-ahead point on the path, so the cross-track error closes while the robot keeps
+# moving. Heading is held with a PID. The commands are robot-frame velocities, rotated by the
+# measured yaw, so the robot can drift in heading and still draw straight lines.
+#
+# This replaces the AprilTagRobotCorrectorThoughtsOn.py sketch, which re-scheduled itself through
+# master.after(50, lambda ...) on the Tk thread: its rate depended on how busy the GUI was.
+#
+# Units: poses in mm / degrees, commands in mm/s / deg/s; robotDirector converts to its serial units.
+
+CONTROL_RATE_HZ = 20.0      # Loop rate; faster than this just queues up behind the serial throttle
+HEADING_GAINS = (2.0, 0.1, 0.0)     # kp (1/s), ki (1/s^2), kd for the heading error (deg -> deg/s)
+MAX_SPEED_MM_PER_SEC = 150.0
+MAX_TURN_DEG_PER_SEC = 45.0
+INTEGRAL_LIMIT = 50.0               # Anti-windup clamp on the integral term's output (deg/s)
+ARRIVAL_GAIN = 2.0          # 1/s: speed = this * distance left once the look-ahead reaches the end of the path
+CORNER_SPEED_MM_PER_SEC = 20.0  # Speed through a corner or laser on/off change...
+CORNER_GAIN = 5.0           # ...plus this (1/s) times the arc length still to go to it
+LASER_CELL_MM = 1.0         # Resolution of the record of which cut length was lasered
+LASER_MAX_STEP_MM = 20.0    # Progress jumps larger than this between ticks were not drawn
+LASER_MAX_ERROR_MM = 5.0    # Laser held off while the measured pose is further than this off the path
+ARRIVAL_TOLERANCE_MM = 2.0
+POSE_TIMEOUT_S = 0.5        # No pose for this long: stop and wait
+HEADING_OFFSET_DEG = 0.0    # Localizer yaw of a robot whose +Y axis points along world +Y
+STATS_WINDOW = 200          # Loop iterations kept for the rate/jitter/error statistics
+
+
+def wrap_degrees(angle):
+    return (angle + 180.0) % 360.0 - 180.0
+
+
+class PID:
+    """PID with output and integral limits; the derivative is taken on the error and low-pass filtered."""
+    def __init__(self, kp, ki, kd, output_limit, integral_limit=INTEGRAL_LIMIT, derivative_filter=0.5):
+        self.kp, self.ki, self.kd = kp, ki, kd
+        self.output_limit = output_limit
+        self.integral_limit = integral_limit
+        self.derivative_filter = derivative_filter
+        self.reset()
+
+    def reset(self):
+        self.integral = 0.0
+        self.derivative = 0.0
+        self.last_error = None
+
+    def update(self, error, dt, feedforward=0.0):
+        if self.last_error is not None and dt > 0:
+            raw = (error - self.last_error) / dt
+            self.derivative += self.derivative_filter * (raw - self.derivative)
+        self.last_error = error
+        proportional = self.kp * error + feedforward
+        candidate = self.integral + self.ki * error * dt
+        limit = self.integral_limit
+        # Only integrate while the output isn't saturated the same way (anti-windup)
+        if abs(proportional + candidate) < self.output_limit or abs(candidate) < abs(self.integral):
+            self.integral = max(-limit, min(limit, candidate))
+        output = proportional + self.integral + self.kd * self.derivative
+        return max(-self.output_limit, min(self.output_limit, output))
+
+
+class ClosedLoopFollower:
+    """
+    Runs a GcodePath in its own thread.
+    get_pose() -> (x, y, yaw) predicted for now, or None; send(vx, vy, omega, laser_on, laser_power)
+    takes robot-frame mm/s and deg/s. Both are called from the control thread.
+    """
+    def __init__(self, path, get_pose, send, rate_hz=CONTROL_RATE_HZ, max_speed=MAX_SPEED_MM_PER_SEC,
+                 speed_factor=1.0, heading_gains=HEADING_GAINS, target_heading=None, anchor=False):
+        self.path = path
+        self.tracker = PurePursuitTracker(path) # Builds the grid index once, before the loop starts
+        self.anchor = anchor # Run the path relative to where the robot is on the first pose
+        self.origin = (0.0, 0.0) # Pose -> path coordinates offset set by the anchor
+        self.get_pose = get_pose
+        self.send = send
+        self.period = 1.0 / rate_hz
+        self.max_speed = max_speed
+        self.speed_factor = speed_factor
+        self.pid_heading = PID(*heading_gains, output_limit=MAX_TURN_DEG_PER_SEC)
+        self.target_heading = target_heading # None: hold the heading the robot starts with
+
+        self.segment = 0 # Segment of the robot's nearest path point
+        # Which cut length the laser was on over, in LASER_CELL_MM cells of arc length
+        cells = np.arange(0.0, path.length, LASER_CELL_MM) + LASER_CELL_MM * 0.5
+        segments = np.clip(np.searchsorted(path.cumulative, cells, side='right') - 1, 0, max(path.segment_count - 1, 0))
+        self.cut_cells = path.laser_on[segments] if path.segment_count else np.zeros(len(cells), dtype=bool)
+        self.lasered = np.zeros(len(cells), dtype=bool)
+        self.last_s = None
+        self.running = False
+        self.finished = False
+        self.abort_reason = None
+        self.thread = None
+        self.lock = threading.Lock()
+
+        # Statistics (appended by the control thread, read by stats())
+        self.periods_ms = deque(maxlen=STATS_WINDOW)
+        self.compute_ms = deque(maxlen=STATS_WINDOW)
+        self.cross_track_mm = deque(maxlen=STATS_WINDOW)  # Distance to the nearest path point
+        self.heading_errors = deque(maxlen=STATS_WINDOW)
+        self.iterations = 0
+        self.overruns = 0
+        self.pose_misses = 0
+        self.started_at = None
+        self.last_pose_time = None
+
+    def start(self):
+        self.running = True
+        self.started_at = time.perf_counter()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join(timeout=1.0)
+        self.thread = None
+
+    def progress(self):
+        return self.tracker.s / self.path.length if self.path.length else 1.0
+
+    def unlasered_mm(self):
+        """Cut length the laser has not been on over yet."""
+        return float(np.count_nonzero(self.cut_cells & ~self.lasered)) * LASER_CELL_MM
+
+    def result_line(self):
+        """How the run ended, with the cut length left unlasered."""
+        state = "finished" if self.finished else f"stopped at {self.progress() * 100:.1f}%"
+        cut_mm = float(np.count_nonzero(self.cut_cells)) * LASER_CELL_MM
+        return f"{state}, {self.unlasered_mm():.0f} of {cut_mm:.0f} mm of cuts not lasered"
+
+    def path_position(self, x, y):
+        """Pose coordinates -> path coordinates (they differ once an anchored run has started)."""
+        return x - self.origin[0], y - self.origin[1]
+
+    def _run(self):
+        next_tick = time.perf_counter()
+        last_tick = None
+        self.last_pose_time = time.perf_counter()
+        try:
+            while self.running:
+                now = time.perf_counter()
+                dt = self.period if last_tick is None else now - last_tick
+                if last_tick is not None:
+                    with self.lock:
+                        self.periods_ms.append(dt * 1000.0)
+                last_tick = now
+
+                if self.tick(self.get_pose(), dt, now):
+                    break
+                with self.lock:
+                    self.compute_ms.append((time.perf_counter() - now) * 1000.0)
+                self.iterations += 1
+
+                # Absolute deadlines: a slow iteration doesn't shift every later one
+                next_tick += self.period
+                delay = next_tick - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                elif delay < -self.period:
+                    self.overruns += 1
+                    next_tick = time.perf_counter() # Too far behind to catch up; start counting again
+        except Exception as e:
+            self.abort_reason = str(e)
+            print(f"Closed-loop follower stopped: {e}")
+        finally:
+            self.send(0.0, 0.0, 0.0, False, 0)
+            self.running = False
+
+    def tick(self, pose, dt, now):
+        """
+        One loop iteration with the pose for now (None: no pose). Returns True once the end of the
+        path is reached. _run() calls it at the loop rate; kinematicSimulator calls it on a virtual clock.
+        """
+        if pose is None:
+            self.pose_misses += 1
+            self.send(0.0, 0.0, 0.0, False, 0)
+            if self.last_pose_time is not None and now - self.last_pose_time > POSE_TIMEOUT_S:
+                self._reset_controllers() # Don't wind up while blind
+            return False
+        self.last_pose_time = now
+        if self._step(pose, dt):
+            self.finished = True
+        return self.finished
+
+    def _reset_controllers(self):
+        self.pid_heading.reset()
+
+    def _step(self, pose, dt):
+        """One control iteration. Returns True once the end of the path is reached."""
+        x, y, yaw = pose
+        if self.anchor:
+            self.origin = (x - self.path.points[0, 0], y - self.path.points[0, 1])
+            self.anchor = False
+        x, y = self.path_position(x, y)
+        path = self.path
+        if self.target_heading is None:
+            self.target_heading = yaw
+
+        # Nearest path point and the look-ahead point, at the feed of the segment the robot is on
+        feed = min(path.feed[self.segment], self.max_speed) * self.speed_factor
+        track = self.tracker.update(x, y, feed)
+        self.segment = track.segment
+        error_x = track.target_x - x
+        error_y = track.target_y - y
+        distance = math.hypot(error_x, error_y)
+        at_end = track.s + track.lookahead >= path.length # The look-ahead point is the path's end point
+        if at_end and distance < ARRIVAL_TOLERANCE_MM:
+            return True
+
+        # Pure pursuit: head for the look-ahead point at the feed, slowing into the end point and into
+        # the next corner or laser change (the look-ahead stops there)
+        if at_end:
+            speed = min(feed, ARRIVAL_GAIN * distance)
+        else:
+            speed = min(feed, CORNER_SPEED_MM_PER_SEC + CORNER_GAIN * track.to_break)
+        vx = error_x / distance * speed if distance > 1e-9 else 0.0
+        vy = error_y / distance * speed if distance > 1e-9 else 0.0
+        heading_error = wrap_degrees(self.target_heading - yaw)
+        omega = self.pid_heading.update(heading_error, dt)
+
+        # World -> robot frame through the measured heading
+        angle = math.radians(yaw - HEADING_OFFSET_DEG)
+        cos_a, sin_a = math.cos(angle), math.sin(angle)
+        robot_vx = cos_a * vx + sin_a * vy
+        robot_vy = -sin_a * vx + cos_a * vy
+
+        laser_on = bool(path.laser_on[self.segment]) and track.distance < LASER_MAX_ERROR_MM
+        self.send(robot_vx, robot_vy, omega, laser_on, int(path.laser_power[self.segment]) if laser_on else 0)
+        if laser_on and self.last_s is not None and abs(track.s - self.last_s) <= LASER_MAX_STEP_MM:
+            first, last = sorted((self.last_s, track.s))
+            self.lasered[int(first / LASER_CELL_MM):int(last / LASER_CELL_MM) + 1] = True
+        self.last_s = track.s
+
+        with self.lock:
+            self.cross_track_mm.append(track.distance)
+            self.heading_errors.append(abs(heading_error))
+        return False
+
+    def stats(self):
+        """Loop rate, period jitter, compute time and tracking error over the last STATS_WINDOW iterations."""
+        with self.lock:
+            periods = sorted(self.periods_ms)
+            compute = sorted(self.compute_ms)
+            cross = sorted(self.cross_track_mm)
+            heading = sorted(self.heading_errors)
+        result = {"iterations": self.iterations, "overruns": self.overruns, "pose_misses": self.pose_misses,
+                  "progress": self.progress(), "segment": self.segment}
+        if periods:
+            mean = sum(periods) / len(periods)
+            result["rate_hz"] = 1000.0 / mean
+            result["jitter_ms"] = math.sqrt(sum((p - mean) ** 2 for p in periods) / len(periods))
+            result["period_p99_ms"] = periods[min(int(0.99 * len(periods)), len(periods) - 1)]
+        if compute:
+            result["compute_p95_ms"] = compute[int(0.95 * (len(compute) - 1))]
+        if cross:
+            result["cross_track_p50_mm"] = cross[len(cross) // 2]
+            result["cross_track_p95_mm"] = cross[int(0.95 * (len(cross) - 1))]
+            result["heading_p95_deg"] = heading[int(0.95 * (len(heading) - 1))]
+        return result
+
+    def stats_line(self):
+        s = self.stats()
+        if "rate_hz" not in s:
+            return f"Follower: starting ({s['pose_misses']} pose misses)"
+        line = (f"Follower: {s['rate_hz']:.1f} Hz, jitter {s['jitter_ms']:.2f} ms, {s['progress'] * 100:.1f}% done")
+        if "cross_track_p50_mm" in s:
+            line += (f", cross-track p50/p95 {s['cross_track_p50_mm']:.1f}/{s['cross_track_p95_mm']:.1f} mm, "
+                     f"heading p95 {s['heading_p95_deg']:.1f} deg")
+        return line + f", {s['overruns']} overruns, {s['pose_misses']} pose misses"
+
+
+def main():
+    # Runs a G-code file against the simulated robot, the way robotDirector does with "Simulated robot" ticked
+    from poseFilter import PoseFilterBank
+    from robotSimulator import SimulatedRobot
+    parser = argparse.ArgumentParser(description="Closed-loop G-code follower against the simulated robot.")
+    parser.add_argument("gcode")
+    parser.add_argument("--rate", type=float, default=CONTROL_RATE_HZ)
+    parser.add_argument("--seconds", type=float, default=20.0, help="Stop after this long")
+    parser.add_argument("--speed", type=float, default=MAX_SPEED_MM_PER_SEC, help="Speed limit (mm/s)")
+    parser.add_argument("--deviation-log", default=None, help="Log the robot's poses here and report the path deviation at the end")
+    args = parser.parse_args()
+
+    path = compile_file(args.gcode)
+    robot = SimulatedRobot(x=path.points[0, 0], y=path.points[0, 1])
+    bank = PoseFilterBank()
+    lock = threading.Lock()
+    deviation_log = None
+    if args.deviation_log:
+        from pathDeviation import DeviationLogger
+        deviation_log = DeviationLogger(args.deviation_log, args.gcode, max_speed=args.speed)
+
+    def on_pose(message):
+        with lock:
+            for pose in message["poses"]:
+                bank.update(pose["tag_id"], message["capture_ts"], pose["x"], pose["y"], pose["yaw"])
+                if deviation_log and pose["tag_id"] == robot.tag_id:
+                    deviation_log.add(message["capture_ts"], pose["x"], pose["y"], pose["yaw"])
+
+    def get_pose():
+        with lock:
+            last_seen = bank.last_seen(robot.tag_id)
+            if last_seen is None or time.time() - last_seen > POSE_TIMEOUT_S:
+                return None
+            return bank.predict(robot.tag_id)
+
+    robot.on_pose = on_pose
+    robot.start()
+    follower = ClosedLoopFollower(path, get_pose, robot.command, rate_hz=args.rate, max_speed=args.speed).start()
+    from pathTracker import segment_distances
+    truth_errors = []
+    start = time.perf_counter()
+    try:
+        while follower.running and time.perf_counter() - start < args.seconds:
+            time.sleep(1.0)
+            x, y = follower.path_position(*robot.truth()[:2])
+            truth_errors.append(float(segment_distances(path, 0, path.segment_count, x, y)[0].min()))
+            print(follower.stats_line())
+    except KeyboardInterrupt:
+        pass
+    follower.stop()
+    robot.stop()
+    print(f"Closed loop {follower.result_line()} after {time.perf_counter() - start:.1f} s "
+          f"({path.length:.0f} mm path); true distance off the path "
+          f"max {max(truth_errors, default=0.0):.1f} mm")
+    if deviation_log:
+        from pathDeviation import analyze_log
+        deviation_log.close(follower.origin)
+        print(analyze_log(args.gcode, args.deviation_log, args.deviation_log.rsplit(".", 1)[0] + "_heatmap.png"))
+
+
+if __name__ == "__main__":
+    main()
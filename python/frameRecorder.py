@@ -0,0 +1,289 @@
+import argparse
+import json
+import os
+import queue
+import threading
+import time
+from collections import deque
+
+import cv2
+import numpy as np
+
+# Background recorder for what the localizer saw: frames plus the poses found in them, written
+# by a writer thread so the detection loop never touches the disk.
+#
+# record() copies the frame into one of a fixed number of preallocated buffers and queues it; when
+# every buffer is still waiting for the writer the frame is dropped and counted instead of
+# blocking the detector. The writer encodes with cv2.VideoWriter (MJPG .avi, default) or stores raw
+# frames in chunked .npy memmaps (lossless, bigger), and appends one JSON line per frame to the
+# poses sidecar. visionBenchmark.py plays a recording directory back like a video file.
+#
+#   recording/
+#     recording.json   format, frame size, fps, chunks, counters (rewritten on close)
+#     frames.avi       or frames_00000.npy, frames_00001.npy, ...
+#     poses.jsonl      {"frame", "frame_id", "capture_ts", "dropped", "poses": [{tag_id, x, y, z, yaw}, ...]}
+
+RECORDING_INDEX = "recording.json"
+POSES_FILE = "poses.jsonl"
+VIDEO_FILE = "frames.avi"
+CHUNK_FILE = "frames_{:05d}.npy"
+FORMATS = ("video", "npy")
+QUEUE_FRAMES = 64         # Frame buffers; the most frames that can wait for the writer
+VIDEO_FPS = 30.0          # Frame rate written into the video header (playback speed only)
+VIDEO_FOURCC = "MJPG"
+CHUNK_FRAMES = 300        # Frames per .npy chunk
+POSE_FIELDS = ("tag_id", "x", "y", "z", "yaw")
+
+
+class FrameRecorder:
+    def __init__(self, output_dir, fmt="video", queue_frames=QUEUE_FRAMES, fps=VIDEO_FPS, chunk_frames=CHUNK_FRAMES):
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown recording format {fmt}, expected one of {FORMATS}")
+        os.makedirs(output_dir, exist_ok=True)
+        self.output_dir = output_dir
+        self.fmt = fmt
+        self.fps = fps
+        self.chunk_frames = chunk_frames
+        self.queue_frames = queue_frames
+
+        self.free_buffers = deque()   # Buffers the writer is done with
+        self.allocated = 0
+        self.pending = queue.Queue()  # (buffer, frame_id, capture_ts, poses, dropped so far); None stops the writer
+        self.thread = None
+
+        # Counters
+        self.recorded = 0   # Accepted by record()
+        self.written = 0    # On disk
+        self.dropped = 0    # No free buffer: writer behind
+        self.errors = 0
+
+        # Writer state (writer thread only)
+        self.frame_size = None
+        self.video_writer = None
+        self.chunk = None
+        self.chunk_index = 0
+        self.chunk_fill = 0
+        self.chunks = []    # [{"file", "frames"}] of finished .npy chunks
+        self.poses_file = None
+
+    def start(self):
+        self.poses_file = open(os.path.join(self.output_dir, POSES_FILE), 'w')
+        self._write_index()
+        self.thread = threading.Thread(target=self._writer_loop, daemon=True)
+        self.thread.start()
+        print(f"Recording {self.fmt} to {self.output_dir}")
+        return self
+
+    def record(self, frame, poses=(), capture_ts=None, frame_id=None):
+        """
+        Queues a copy of the frame and its poses. Never blocks: returns False (and counts a drop)
+        when the writer has fallen QUEUE_FRAMES frames behind.
+        """
+        try:
+            buffer = self.free_buffers.popleft()
+            if buffer.shape != frame.shape:
+                buffer = np.empty_like(frame) # Source changed size; the old buffer is just let go
+        except IndexError:
+            if self.allocated >= self.queue_frames:
+                self.dropped += 1
+                return False
+            buffer = np.empty_like(frame)
+            self.allocated += 1
+        np.copyto(buffer, frame) # The caller may draw on its frame afterwards
+        pose_records = [{field: pose[field] for field in POSE_FIELDS} for pose in poses]
+        self.recorded += 1
+        self.pending.put((buffer, frame_id, time.time() if capture_ts is None else capture_ts, pose_records, self.dropped))
+        return True
+
+    def stats_line(self):
+        return (f"Recorder: {self.written} written, {self.pending.qsize()} queued, "
+                f"{self.dropped} dropped, {self.errors} errors")
+
+    def stop(self):
+        """Writes out everything still queued and closes the files."""
+        if self.thread:
+            self.pending.put(None)
+            self.thread.join()
+            self.thread = None
+        print(self.stats_line())
+
+    # --- Writer thread ---
+    def _writer_loop(self):
+        while True:
+            item = self.pending.get()
+            if item is None:
+                break
+            buffer, frame_id, capture_ts, poses, dropped = item
+            try:
+                self._write_frame(buffer)
+                self.poses_file.write(json.dumps({"frame": self.written, "frame_id": frame_id, "capture_ts": round(capture_ts, 6),
+                                                  "dropped": dropped, "poses": poses}) + "\n")
+                self.written += 1
+            except (OSError, cv2.error, ValueError) as e:
+                self.errors += 1
+                print(f"Recorder write error: {e}")
+            self.free_buffers.append(buffer)
+        self._close_files()
+
+    def _write_frame(self, frame):
+        size = (frame.shape[1], frame.shape[0])
+        if self.frame_size is None:
+            self.frame_size = size
+            if self.fmt == "video":
+                self.video_writer = cv2.VideoWriter(os.path.join(self.output_dir, VIDEO_FILE),
+                                                    cv2.VideoWriter_fourcc(*VIDEO_FOURCC), self.fps, size)
+                if not self.video_writer.isOpened():
+                    print("VideoWriter could not be opened; recording raw .npy chunks instead.")
+                    self.video_writer = None
+                    self.fmt = "npy"
+            self._write_index()
+        elif size != self.frame_size:
+            raise ValueError(f"frame size changed from {self.frame_size} to {size}")
+
+        if self.video_writer is not None:
+            self.video_writer.write(frame)
+            return
+        if self.chunk is None:
+            path = os.path.join(self.output_dir, CHUNK_FILE.format(self.chunk_index))
+            self.chunk = np.lib.format.open_memmap(path, mode='w+', dtype=frame.dtype, shape=(self.chunk_frames,) + frame.shape)
+            self.chunk_fill = 0
+        self.chunk[self.chunk_fill] = frame
+        self.chunk_fill += 1
+        if self.chunk_fill == self.chunk_frames:
+            self._finish_chunk()
+
+    def _finish_chunk(self):
+        name = CHUNK_FILE.format(self.chunk_index)
+        path = os.path.join(self.output_dir, name)
+        self.chunk.flush()
+        if self.chunk_fill < self.chunk_frames:
+            # Last chunk of the recording: rewrite it with only the frames it holds
+            filled = np.array(self.chunk[:self.chunk_fill])
+            del self.chunk
+            np.save(path, filled)
+        self.chunk = None
+        self.chunks.append({"file": name, "frames": self.chunk_fill})
+        self.chunk_index += 1
+        self._write_index()
+
+    def _close_files(self):
+        if self.video_writer is not None:
+            self.video_writer.release()
+            self.video_writer = None
+        if self.chunk is not None:
+            if self.chunk_fill:
+                self._finish_chunk()
+            else:
+                self.chunk = None
+                os.remove(os.path.join(self.output_dir, CHUNK_FILE.format(self.chunk_index)))
+        if self.poses_file:
+            self.poses_file.close()
+            self.poses_file = None
+        self._write_index()
+
+    def _write_index(self):
+        index = {"format": self.fmt, "frame_size": self.frame_size, "fps": self.fps,
+                 "video": VIDEO_FILE if self.fmt == "video" else None, "chunks": self.chunks, "poses": POSES_FILE,
+                 "recorded": self.recorded, "written": self.written, "dropped": self.dropped, "errors": self.errors}
+        with open(os.path.join(self.output_dir, RECORDING_INDEX), 'w') as f:
+            json.dump(index, f, indent=2)
+
+
+def is_recording(path):
+    return os.path.isfile(os.path.join(path, RECORDING_INDEX))
+
+
+class RecordingReader:
+    """Plays a recording back frame by frame with a VideoCapture-like read(); pose records follow along."""
+    def __init__(self, path):
+        with open(os.path.join(path, RECORDING_INDEX), 'r') as f:
+            self.index = json.load(f)
+        self.path = path
+        self.capture = None
+        self.chunks = deque(self.index["chunks"])
+        self.chunk = None
+        self.chunk_pos = 0
+        if self.index["format"] == "video":
+            self.capture = cv2.VideoCapture(os.path.join(path, self.index["video"]))
+            if not self.capture.isOpened():
+                raise IOError(f"Could not open the video of recording {path}")
+        self.poses_file = open(os.path.join(path, self.index["poses"]), 'r')
+        self.last_record = None # Sidecar entry of the frame read last
+
+    def read(self):
+        if self.capture is not None:
+            ret, frame = self.capture.read()
+        else:
+            while self.chunk is None or self.chunk_pos >= len(self.chunk):
+                if not self.chunks:
+                    return False, None
+                entry = self.chunks.popleft()
+                self.chunk = np.load(os.path.join(self.path, entry["file"]), mmap_mode='r')[:entry["frames"]]
+                self.chunk_pos = 0
+            frame = np.array(self.chunk[self.chunk_pos]) # Copy out of the memmap: callers draw on frames
+            self.chunk_pos += 1
+            ret = True
+        if ret:
+            line = self.poses_file.readline()
+            self.last_record = json.loads(line) if line else None
+        return ret, frame
+
+    def release(self):
+        if self.capture is not None:
+            self.capture.release()
+        self.poses_file.close()
+
+
+def benchmark(fmt, seconds, fps, width, height, output_dir):
+    """Records synthetic frames at a fixed rate and reports what record() costs the caller and what got dropped."""
+    rng = np.random.default_rng(0)
+    frames = [rng.integers(0, 255, (height, width, 3), dtype=np.uint8) for _ in range(8)]
+    recorder = FrameRecorder(output_dir, fmt, fps=fps).start()
+    costs = []
+    interval = 1.0 / fps
+    start = time.perf_counter()
+    for i in range(int(seconds * fps)):
+        poses = [{"tag_id": 5, "x": float(i), "y": 0.0, "z": 0.0, "yaw": 0.0}]
+        begin = time.perf_counter()
+        recorder.record(frames[i % len(frames)], poses, frame_id=i)
+        costs.append((time.perf_counter() - begin) * 1000.0)
+        delay = start + (i + 1) * interval - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+    recorder.stop()
+    costs.sort()
+    print(f"{len(costs)} frames of {width}x{height} at {fps:.0f} FPS ({fmt}): record() p50 {costs[len(costs) // 2]:.3f} ms, "
+          f"p99 {costs[int(0.99 * (len(costs) - 1))]:.3f} ms, max {costs[-1]:.3f} ms; "
+          f"{recorder.written} written, {recorder.dropped} dropped")
+
+    reader = RecordingReader(output_dir)
+    played = 0
+    while reader.read()[0]:
+        played += 1
+    reader.release()
+    print(f"Played back {played} frames, last pose record {reader.last_record}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Frame and pose recorder for the localizer.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    info = subparsers.add_parser("info", help="Print the index of a recording")
+    info.add_argument("path")
+    bench = subparsers.add_parser("bench", help="Record synthetic frames and report the cost and drops")
+    bench.add_argument("--format", choices=FORMATS, default="video")
+    bench.add_argument("--seconds", type=float, default=5.0)
+    bench.add_argument("--fps", type=float, default=VIDEO_FPS)
+    bench.add_argument("--width", type=int, default=1280)
+    bench.add_argument("--height", type=int, default=720)
+    bench.add_argument("--output", default="recording_bench")
+    args = parser.parse_args()
+
+    if args.command == "info":
+        with open(os.path.join(args.path, RECORDING_INDEX), 'r') as f:
+            print(json.dumps(json.load(f), indent=2))
+    else:
+        benchmark(args.format, args.seconds, args.fps, args.width, args.height, args.output)
+
+
+if __name__ == "__main__":
+    main()
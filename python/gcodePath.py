@@ -0,0 +1,145 @@
+import math
+import re
+
+import numpy as np
+
+# Compiles a G-code file into a path the closed-loop follower can run: the linear moves become
+# one array of points with per-segment feed rate and laser state, plus cumulative arc length so
+# a position along the path is one searchsorted away. Understands the same subset as
+# robotDirector's line-by-line executor: G0/G1 X Y (Z ignored) F S, G90/G91, M3 [S], M5, S, F.
+
+DEFAULT_FEED_MM_PER_SEC = 10000.0 # Same default as robotDirector (ROBOT_MAX_LINEAR_VELOCITY_MM_PER_SEC)
+MIN_SEGMENT_MM = 1e-3             # Shorter moves are dropped (the director skips them too)
+
+MOVE_PATTERN = re.compile(r'^(G[01])(?: X([\d.-]+))?(?: Y([\d.-]+))?(?: Z([\d.-]+))?(?: F([\d.]+))?(?: S(\d+))?(?:\s*\(.*?\))?$')
+LASER_PATTERN = re.compile(r'^(M[35])(?: S(\d+))?(?:\s*\(.*?\))?$')
+POWER_PATTERN = re.compile(r'^S(\d+)(?:\s*\(.*?\))?$')
+FEED_PATTERN = re.compile(r'^F([\d.]+)(?:\s*\(.*?\))?$')
+MODE_PATTERN = re.compile(r'^(G90|G91)(?:\s*\(.*?\))?$')
+
+
+class GcodePath:
+    """
+    Polyline of the moves of a G-code program.
+    points (n+1, 2) mm; feed (n,) mm/s; laser_on (n,) bool; laser_power (n,) 0-255;
+    cumulative (n+1,) arc length at each point; line (n,) source line number of each segment.
+    """
+    def __init__(self, points, feed, laser_on, laser_power, line=None):
+        self.points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        self.feed = np.asarray(feed, dtype=np.float64)
+        self.laser_on = np.asarray(laser_on, dtype=bool)
+        self.laser_power = np.asarray(laser_power, dtype=np.int64)
+        self.line = np.asarray(line if line is not None else np.arange(len(self.feed)), dtype=np.int64)
+        deltas = np.diff(self.points, axis=0)
+        self.lengths = np.hypot(deltas[:, 0], deltas[:, 1])
+        self.directions = deltas / np.maximum(self.lengths, 1e-12)[:, None] # Unit vector of each segment
+        self.cumulative = np.concatenate(([0.0], np.cumsum(self.lengths)))
+
+    @property
+    def segment_count(self):
+        return len(self.lengths)
+
+    @property
+    def length(self):
+        return float(self.cumulative[-1])
+
+    def segment_at(self, s):
+        """Index of the segment containing arc length s (clamped to the path)."""
+        if self.segment_count == 0:
+            return 0
+        return int(min(max(np.searchsorted(self.cumulative, s, side='right') - 1, 0), self.segment_count - 1))
+
+    def point_at(self, s):
+        """(x, y, segment index) at arc length s along the path."""
+        if self.segment_count == 0:
+            return float(self.points[0, 0]), float(self.points[0, 1]), 0
+        s = min(max(s, 0.0), self.length)
+        i = self.segment_at(s)
+        along = s - self.cumulative[i]
+        x = self.points[i, 0] + self.directions[i, 0] * along
+        y = self.points[i, 1] + self.directions[i, 1] * along
+        return float(x), float(y), i
+
+    def translated(self, dx, dy):
+        """Copy of the path moved by (dx, dy), e.g. to start where the robot stands."""
+        return GcodePath(self.points + (dx, dy), self.feed, self.laser_on, self.laser_power, self.line)
+
+    def duration(self, speed_cap=None):
+        """Nominal run time in seconds at the programmed feeds (optionally capped)."""
+        feed = self.feed if speed_cap is None else np.minimum(self.feed, speed_cap)
+        return float(np.sum(self.lengths / np.maximum(feed, 1e-6)))
+
+
+def compile_lines(lines, default_feed=DEFAULT_FEED_MM_PER_SEC):
+    """Compiles G-code lines into a GcodePath. Unrecognized lines are skipped and counted."""
+    x = y = 0.0
+    absolute = True
+    feed = default_feed
+    laser_on = False
+    laser_power = 0
+    points = [(0.0, 0.0)]
+    feeds, lasers, powers, sources = [], [], [], []
+    skipped = 0
+
+    for number, raw in enumerate(lines, 1):
+        line = raw.strip()
+        if not line or line.startswith(';'):
+            continue
+        move = MOVE_PATTERN.match(line)
+        if move:
+            if move.group(5):
+                feed = float(move.group(5)) / 60.0 # mm/min -> mm/s
+            if move.group(6):
+                laser_power = int(move.group(6))
+                if laser_power == 0:
+                    laser_on = False
+            if move.group(2) is None and move.group(3) is None:
+                continue
+            target_x = float(move.group(2)) if move.group(2) is not None else (x if absolute else 0.0)
+            target_y = float(move.group(3)) if move.group(3) is not None else (y if absolute else 0.0)
+            if not absolute:
+                target_x += x
+                target_y += y
+            if math.hypot(target_x - x, target_y - y) >= MIN_SEGMENT_MM:
+                points.append((target_x, target_y))
+                feeds.append(feed)
+                lasers.append(laser_on)
+                powers.append(laser_power)
+                sources.append(number)
+            x, y = target_x, target_y
+            continue
+        laser = LASER_PATTERN.match(line)
+        if laser:
+            laser_on = laser.group(1) == 'M3'
+            laser_power = (int(laser.group(2)) if laser.group(2) else 255) if laser_on else 0
+            continue
+        power = POWER_PATTERN.match(line)
+        if power:
+            laser_power = int(power.group(1))
+            laser_on = laser_power > 0
+            continue
+        feed_only = FEED_PATTERN.match(line)
+        if feed_only:
+            feed = float(feed_only.group(1)) / 60.0
+            continue
+        mode = MODE_PATTERN.match(line)
+        if mode:
+            absolute = mode.group(1) == 'G90'
+            continue
+        skipped += 1
+
+    path = GcodePath(points, feeds, lasers, powers, sources)
+    path.skipped_lines = skipped
+    return path
+
+
+def compile_file(filepath, default_feed=DEFAULT_FEED_MM_PER_SEC):
+    with open(filepath, 'r') as f:
+        return compile_lines(f, default_feed)
+
+
+if __name__ == "__main__":
+    import sys
+    path = compile_file(sys.argv[1])
+    print(f"{path.segment_count} segments, {path.length:.1f} mm, {path.duration():.1f} s at programmed feeds, "
+          f"{int(np.sum(path.lengths[path.laser_on]))} mm with the laser on, {path.skipped_lines} lines skipped")
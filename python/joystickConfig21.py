@@ -1,11 +1,14 @@
-import tkinter as tk
-from tkinter import ttk, filedialog, messagebox
+try:
+    import tkinter as tk
+    from tkinter import ttk, filedialog, messagebox
+except ImportError: # A headless Pi running joystickDaemon.py may not have Tk installed
+    tk = None
 import pygame
 import json
 import os
-import threading
+import sys
 import time
-import socket # Import socket for network communication
+from joystickProtocol import TRANSPORT_TCP, TRANSPORTS, JoystickPublisher, format_link_summary
 
 # --- Configuration Constants ---
 CONFIG_FILE = "joystick_config.json"
@@ -27,6 +30,8 @@ ANALOG_DISPLAY_PRECISION = 2 # Decimal places for analog values
 # --- Network Configuration ---
 HOST = '127.0.0.1'  # Listen on localhost. Use '0.0.0.0' to listen on all available interfaces.
 PORT = 52345        # Port to listen on. Choose an available port.
+DEFAULT_TRANSPORT = TRANSPORT_TCP # TCP, UDP or Multicast (see joystickProtocol.py)
+UDP_HEARTBEAT_S = 0.25 # Resend unchanged state this often over UDP so a lost packet cannot leave a stale command
 
 # --- Joystick Manager Class ---
 class JoystickManager:
@@ -75,6 +80,8 @@ class JoystickManager:
                 # Only add hat motion event if it's not at (0,0) (neutral position)
                 if event.value != (0,0):
                     events.append({'type': 'hat_motion', 'joy_id': event.joy, 'hat': event.hat, 'value': event.value})
+            elif event.type == getattr(pygame, 'JOYDEVICEREMOVED', None): # Hot-plug events are pygame 2 only
+                events.append({'type': 'device_removed', 'joy_id': event.instance_id})
         return events
 
     def get_current_state(self):
@@ -92,9 +99,172 @@ class JoystickManager:
         pygame.joystick.quit()
         pygame.quit()
 
+# --- Config Files and Sending Rules (shared with joystickDaemon.py) ---
+def load_config_file(file_path):
+    """
+    Reads a saved joystick config.
+    Returns (mappings, axis_inverted, deadzone); raises on a missing or invalid file.
+    """
+    with open(file_path, 'r') as f:
+        loaded_config = json.load(f)
+    mappings = {k: v for k, v in loaded_config.items() if k in ACTIONS} # Only load valid actions
+    # Provide defaults if 'axis_inverted' or 'deadzone_threshold' are missing for backward compatibility
+    axis_inverted = loaded_config.get('axis_inverted', {})
+    deadzone = loaded_config.get('deadzone_threshold', DEFAULT_DEADZONE_THRESHOLD)
+    return mappings, axis_inverted, deadzone
+
+def payload_needs_sending(command_payload, last_sent_payload, publisher):
+    """Decides whether this tick's payload is sent (same rules in GUI and daemon mode)."""
+    # Condition 1: Payload has genuinely changed
+    if command_payload != last_sent_payload:
+        return True
+    # Condition 2: Any analog axis is active (non-zero beyond deadzone), force continuous send
+    if command_payload["x"] != 0.0 or command_payload["y"] != 0.0 or \
+       command_payload["r"] != 0.0 or command_payload["e"] != 0.0:
+        return True
+    # Condition 3: Any toggle/button action's *output value* is currently active (e.g., laser/power is 1)
+    if command_payload["laser"] == 1 or command_payload["power"] == 1:
+        return True
+    # Condition 4: The overall speed value is currently non-zero
+    if command_payload["speed"] > 0.0:
+        return True
+    # Condition 5: Datagrams can be lost, so resend unchanged state as a heartbeat
+    if publisher and publisher.is_datagram() and time.time() - publisher.last_send_time > UDP_HEARTBEAT_S:
+        return True
+    return False
+
+# --- Compiled Action Dispatch ---
+# The loaded config is flattened into a table of tuples so the per-tick loop does no
+# dictionary lookups, name comparisons or action-name string matching.
+INPUT_AXIS = 0
+INPUT_BUTTON = 1
+INPUT_HAT = 2
+INPUT_KINDS = {'axis': INPUT_AXIS, 'button': INPUT_BUTTON, 'hat': INPUT_HAT}
+
+# Payload slot each action writes to
+ACTION_SLOTS = {
+    "X-Axis (analog)": "x",
+    "Y-Axis (analog)": "y",
+    "R-Rotation (analog)": "r",
+    "E-Elevation (analog)": "e",
+    "Laser On/Off (toggle)": "laser",
+    "Power (toggle)": "power",
+    "Speed Up (button)": "speed_up",
+    "Speed Down (button)": "speed_down",
+}
+AXIS_SLOTS = ("x", "y", "r", "e")
+BUTTON_SLOTS = ("laser", "power")
+SPEED_STEP = 0.01 # Speed change per tick while Speed Up/Down is held
+
+def compile_dispatch_table(config, joystick, axis_inverted, deadzone):
+    """
+    Compiles the action mappings for one joystick into a flat dispatch table.
+    Returns (table, action_names): each table row is
+    (input kind, input index, inversion factor, deadzone, target slot, hat value)
+    and action_names[i] is the action row i came from (for the indicator lights).
+    Mappings for other joysticks or inputs this joystick doesn't have are left out.
+    """
+    table = []
+    action_names = []
+    if joystick is None:
+        return table, action_names
+
+    joy_name = joystick.get_name()
+    input_counts = {
+        INPUT_AXIS: joystick.get_numaxes(),
+        INPUT_BUTTON: joystick.get_numbuttons(),
+        INPUT_HAT: joystick.get_numhats(),
+    }
+    for action_name in ACTIONS:
+        config_map = config.get(action_name)
+        if not config_map or config_map.get('joy_name') != joy_name:
+            continue
+        kind = INPUT_KINDS.get(config_map.get('input_type'))
+        input_id = config_map.get('input_id')
+        if kind is None or not isinstance(input_id, int) or not 0 <= input_id < input_counts[kind]:
+            continue
+        inversion = -1.0 if axis_inverted.get(action_name, False) else 1.0
+        # JSON stores the hat position as a list; pygame reports it as a tuple
+        hat_value = tuple(config_map['value']) if kind == INPUT_HAT and config_map.get('value') is not None else None
+        table.append((kind, input_id, inversion, deadzone, ACTION_SLOTS.get(action_name), hat_value))
+        action_names.append(action_name)
+    return table, action_names
+
+def evaluate_dispatch_table(table, joystick, current_speed, values):
+    """
+    Runs one tick of the compiled table against the joystick.
+    Writes the processed value of every row into `values` (reused between ticks, so the
+    indicator lights need no second pass over the joystick) and returns (payload, new_speed).
+    """
+    command_payload = {
+        "x": 0.0,
+        "y": 0.0,
+        "r": 0.0,
+        "e": 0.0,
+        "laser": 0,
+        "power": 0,
+        "speed": current_speed
+    }
+    get_axis = joystick.get_axis
+    get_button = joystick.get_button
+    get_hat = joystick.get_hat
+
+    for i, (kind, input_id, inversion, deadzone, slot, hat_value) in enumerate(table):
+        if kind == INPUT_AXIS:
+            raw_axis_value = get_axis(input_id)
+            # Apply deadzone and then inversion
+            value = 0.0 if abs(raw_axis_value) <= deadzone else raw_axis_value * inversion
+            values[i] = value
+            if slot in AXIS_SLOTS:
+                command_payload[slot] = round(value, ANALOG_DISPLAY_PRECISION)
+        elif kind == INPUT_BUTTON:
+            pressed = get_button(input_id) # 1 if pressed, 0 if not
+            values[i] = pressed
+            if slot in BUTTON_SLOTS:
+                command_payload[slot] = pressed
+            elif slot == "speed_up":
+                # Increment speed continuously while button is held down, cap at 1.0
+                if pressed == 1:
+                    current_speed = min(1.0, current_speed + SPEED_STEP)
+                command_payload["speed"] = current_speed
+            elif slot == "speed_down":
+                # Decrement speed continuously while button is held down, cap at 0.0
+                if pressed == 1:
+                    current_speed = max(0.0, current_speed - SPEED_STEP)
+                command_payload["speed"] = current_speed
+        else:
+            # Hats only light their indicator when in the configured position
+            values[i] = 1 if get_hat(input_id) == hat_value else 0
+    return command_payload, current_speed
+
+def update_indicator_lights(table, values, cache, mapping_widgets, action_names):
+    """
+    Lights the indicator of every compiled row from this tick's evaluated values.
+    cache holds the last (colour, value) shown per row; rows where nothing visible changed make no Tk calls.
+    """
+    for i, (kind, input_id, inversion, deadzone, slot, hat_value) in enumerate(table):
+        value = values[i]
+        if kind == INPUT_AXIS:
+            is_active = value != 0.0 # Zero means inside the deadzone
+            value = round(value, ANALOG_DISPLAY_PRECISION) # Only what the label can show counts as a change
+        else:
+            is_active = value == 1 # Button pressed, or hat in its configured position
+        light_color = "limegreen" if is_active else "darkgray"
+
+        state = (light_color, value)
+        if cache[i] == state:
+            continue # Nothing visible changed, skip the Tk calls
+        cache[i] = state
+        widgets = mapping_widgets[action_names[i]]
+        widgets['indicator_light'].itemconfig("light_oval", fill=light_color)
+        if kind == INPUT_AXIS:
+            # Update mapped_label with live value and inversion status
+            inversion_status = " (Inverted)" if inversion < 0 else ""
+            widgets['mapped_label'].config(text=f"Axis {input_id} ({value:.{ANALOG_DISPLAY_PRECISION}f}){inversion_status}")
+
 # --- GUI Class ---
 class JoystickConfiguratorApp:
-    def __init__(self, master):
+    def __init__(self, master, config_path=None):
         self.master = master
         master.title("Robot Joystick Configurator")
         master.geometry("1100x620")
@@ -122,21 +292,25 @@ class JoystickConfiguratorApp:
         # --- New: Deadzone Threshold Variable ---
         self.deadzone_var = tk.DoubleVar(master, value=DEFAULT_DEADZONE_THRESHOLD)
 
-        # --- Socket Variables ---
-        self.server_socket = None
-        self.client_connection = None
-        self.client_address = None
-        self.server_thread = None
-        self.running_server = True # Flag to control server thread
+        # --- Network Publisher (TCP / UDP / Multicast) ---
+        self.publisher = None
+        self.transport_var = tk.StringVar(master, value=DEFAULT_TRANSPORT)
+        self.link_status_var = tk.StringVar(master, value="Link: no data")
 
         # --- New variables for JSON payload ---
         self.current_speed = 0.5 # Initial speed value, can be adjusted (e.g., 0.0 to 1.0)
         self.last_sent_payload = {} # To avoid sending redundant data
 
+        # --- Compiled dispatch table (see compile_dispatch_table) ---
+        self.dispatch_table = []
+        self.dispatch_actions = []
+        self.dispatch_values = []
+        self.indicator_cache = []
+
         self._setup_ui()
-        self._load_config() # Attempt to load config on startup
+        self._setup_socket_server() # Setup the socket server first so clients can connect while the config loads
+        self._load_config(config_path) # Load the config given on the command line, or ask for one
         self._update_joystick_selection_ui()
-        self._setup_socket_server() # Setup the socket server
         self._start_polling() # Start polling joystick and sending data
 
     def _setup_ui(self):
@@ -170,6 +344,15 @@ class JoystickConfiguratorApp:
         ttk.Button(right_top_frame, text="Load Config", command=self._load_config).pack(side=tk.RIGHT, padx=5)
         ttk.Button(right_top_frame, text="Save Config", command=self._save_config).pack(side=tk.RIGHT, padx=5)
 
+        # --- Transport selection and link quality reported back by the director ---
+        transport_frame = ttk.Frame(self.master, padding=(10, 0))
+        transport_frame.pack(fill=tk.X)
+        ttk.Label(transport_frame, text="Transport:").pack(side=tk.LEFT, padx=5)
+        transport_dropdown = ttk.Combobox(transport_frame, textvariable=self.transport_var, values=TRANSPORTS, state="readonly", width=10)
+        transport_dropdown.pack(side=tk.LEFT, padx=5)
+        transport_dropdown.bind("<<ComboboxSelected>>", self._on_transport_selected)
+        ttk.Label(transport_frame, textvariable=self.link_status_var).pack(side=tk.LEFT, padx=15)
+
         # --- Main Frame: Mappings Table ---
         main_frame = ttk.Frame(self.master, padding="10")
         main_frame.pack(fill=tk.BOTH, expand=True)
@@ -220,6 +403,7 @@ class JoystickConfiguratorApp:
         except ValueError:
             messagebox.showerror("Invalid Input", "Deadzone must be a number. Setting to default.")
             self.deadzone_var.set(DEFAULT_DEADZONE_THRESHOLD)
+        self._compile_dispatch_table() # The deadzone is baked into the table
         
         # Remove focus from the entry widget
         self.master.focus_set()
@@ -390,161 +574,44 @@ class JoystickConfiguratorApp:
                         break # Only assign one input per assignment cycle
 
         # --- Construct and Send JSON Payload based on Current State ---
-        if self.joystick_manager.active_joystick and not self.assignment_mode: # Only send data if not in assignment mode
-            current_state = self.joystick_manager.get_current_state()
-            
-            # Initialize command payload with default values
-            command_payload = {
-                "x": 0.0,
-                "y": 0.0,
-                "r": 0.0,
-                "e": 0.0,
-                "laser": 0,
-                "power": 0,
-                "speed": self.current_speed # Use the internal speed state
-            }
-
-            current_deadzone = self.deadzone_var.get() # Get the current deadzone threshold
-
-            for action_name in ACTIONS:
-                config_map = self.current_config.get(action_name)
-
-                if config_map and config_map.get('joy_name') == self.joystick_manager.active_joystick.get_name():
-                    input_type = config_map['input_type']
-                    input_id = config_map['input_id']
-
-                    # Apply inversion for analog axes
-                    if action_name in self.axis_inverted and self.axis_inverted[action_name]:
-                        inversion_factor = -1.0
-                    else:
-                        inversion_factor = 1.0
-
-                    if input_type == 'axis' and input_id in current_state['axes']:
-                        raw_axis_value = current_state['axes'][input_id]
-                        # Apply deadzone and then inversion
-                        if abs(raw_axis_value) <= current_deadzone:
-                            processed_axis_value = 0.0
-                        else:
-                            processed_axis_value = raw_axis_value * inversion_factor
-                        
-                        if action_name == "X-Axis (analog)":
-                            command_payload["x"] = round(processed_axis_value, ANALOG_DISPLAY_PRECISION)
-                        elif action_name == "Y-Axis (analog)":
-                            command_payload["y"] = round(processed_axis_value, ANALOG_DISPLAY_PRECISION)
-                        elif action_name == "R-Rotation (analog)":
-                            command_payload["r"] = round(processed_axis_value, ANALOG_DISPLAY_PRECISION)
-                        elif action_name == "E-Elevation (analog)":
-                            command_payload["e"] = round(processed_axis_value, ANALOG_DISPLAY_PRECISION)
-                    
-                    elif input_type == 'button' and input_id in current_state['buttons']:
-                        if action_name == "Laser On/Off (toggle)":
-                            command_payload["laser"] = current_state['buttons'][input_id] # 1 if pressed, 0 if not
-                        elif action_name == "Power (toggle)":
-                            command_payload["power"] = current_state['buttons'][input_id] # 1 if pressed, 0 if not
-                        elif action_name == "Speed Up (button)":
-                            # Increment speed continuously while button is held down
-                            if current_state['buttons'][input_id] == 1: # If button is currently pressed
-                                self.current_speed = min(1.0, self.current_speed + 0.01) # Increment speed, cap at 1.0
-                            command_payload["speed"] = self.current_speed # Always update payload with current_speed
-                        elif action_name == "Speed Down (button)":
-                            # Decrement speed continuously while button is held down
-                            if current_state['buttons'][input_id] == 1: # If button is currently pressed
-                                self.current_speed = max(0.0, self.current_speed - 0.01) # Decrement speed, cap at 0.0
-                            command_payload["speed"] = self.current_speed # Always update payload with current_speed
-                    
-                    elif input_type == 'hat' and input_id in current_state['hats']:
-                        # Hat values are tuples (x, y) where x, y are -1, 0, or 1
-                        # For now, we only use hat for specific values, not analog output
-                        pass # No direct command_payload update for hat, unless explicitly mapped for it
-
+        joystick = self.joystick_manager.active_joystick
+        if joystick:
+            # Evaluated in assignment mode too, so the lights keep showing which input moves
+            command_payload, current_speed = evaluate_dispatch_table(
+                self.dispatch_table, joystick, self.current_speed, self.dispatch_values)
 
             # --- Modified sending logic ---
-            should_send = False
-            # Condition 1: Payload has genuinely changed
-            if command_payload != self.last_sent_payload:
-                should_send = True
-            
-            # Condition 2: Any analog axis is active (non-zero beyond deadzone), force continuous send
-            # Use the processed values from command_payload for this check
-            if abs(command_payload["x"]) > 0.0 or \
-               abs(command_payload["y"]) > 0.0 or \
-               abs(command_payload["r"]) > 0.0 or \
-               abs(command_payload["e"]) > 0.0:
-                should_send = True
-
-            # Condition 3: Any toggle/button action's *output value* is currently active (e.g., laser/power is 1)
-            if command_payload["laser"] == 1 or \
-               command_payload["power"] == 1:
-                should_send = True
-            
-            # Condition 4: The overall speed value is currently non-zero
-            if command_payload["speed"] > 0.0:
-                should_send = True
+            if not self.assignment_mode: # Only send data (and apply speed buttons) if not in assignment mode
+                self.current_speed = current_speed
+                if payload_needs_sending(command_payload, self.last_sent_payload, self.publisher):
+                    self._send_joystick_data(command_payload)
+                    self.last_sent_payload = command_payload.copy() # Store a copy to compare in next cycle
 
-            # If any of the above conditions are met, send the command
-            if should_send:
-                self._send_joystick_data(json.dumps(command_payload))
-                self.last_sent_payload = command_payload.copy() # Store a copy to compare in next cycle
-
-        # --- Always update indicator lights and axis values on the GUI ---
-        current_state = self.joystick_manager.get_current_state()
-        current_deadzone = self.deadzone_var.get() # Get the current deadzone threshold
-
-        for action_name, widgets in self.mapping_widgets.items():
-            config_map = self.current_config.get(action_name)
-            indicator_canvas = widgets['indicator_light']
-            
-            is_active = False
-
-            # Only update if current joystick is active and mapping is for this joystick
-            if config_map and \
-               self.joystick_manager.active_joystick and \
-               config_map.get('joy_name') == self.joystick_manager.active_joystick.get_name():
-                
-                input_type = config_map['input_type']
-                input_id = config_map['input_id']
-                
-                if input_type == 'button' and input_id in current_state['buttons']:
-                    if current_state['buttons'][input_id] == 1: # Button is pressed
-                        is_active = True
-                elif input_type == 'axis' and input_id in current_state['axes']:
-                    raw_axis_value = current_state['axes'][input_id]
-                    # Apply inversion for display purposes as well
-                    if action_name in self.axis_inverted and self.axis_inverted[action_name]:
-                        display_axis_value = raw_axis_value * -1.0
-                    else:
-                        display_axis_value = raw_axis_value
-                    
-                    # Apply deadzone for display purposes
-                    if abs(display_axis_value) <= current_deadzone:
-                        display_axis_value = 0.0
-                        is_active = False # Not active if within deadzone
-                    else:
-                        is_active = True # Active if outside deadzone
-
-                    # Update mapped_label with live value and inversion status
-                    inversion_status = " (Inverted)" if self.axis_inverted.get(action_name, False) else ""
-                    widgets['mapped_label'].config(text=f"Axis {input_id} ({display_axis_value:.{ANALOG_DISPLAY_PRECISION}f}){inversion_status}")
-                            
-                elif input_type == 'hat' and input_id in current_state['hats']:
-                    # Check if the current hat state matches the configured hat value for this action
-                    if current_state['hats'][input_id] == config_map.get('value'):
-                        is_active = True
-
-                light_color = "limegreen" if is_active else "darkgray"
-                indicator_canvas.itemconfig("light_oval", fill=light_color)
-            else:
-                # If not mapped to active joystick or no joystick selected, ensure lights are off
-                indicator_canvas.itemconfig("light_oval", fill="darkgray")
-                # Reset axis labels if no active joystick or not mapped
-                if config_map and config_map.get('input_type') == 'axis':
-                    inversion_status = " (Inverted)" if self.axis_inverted.get(action_name, False) else ""
-                    widgets['mapped_label'].config(text=f"Axis {config_map['input_id']} (Analog){inversion_status}")
+            # --- Always update indicator lights and axis values on the GUI ---
+            # Uses the values evaluated above; widgets are only touched when their state changes.
+            self._update_indicator_lights()
 
+        self._update_link_status()
 
         # Re-schedule polling
         self.master.after(50, self._handle_joystick_events)
 
+    def _compile_dispatch_table(self):
+        """Rebuilds the flat dispatch table after the mapping, inversion, deadzone or joystick changes."""
+        try:
+            deadzone = float(self.deadzone_var.get())
+        except (tk.TclError, ValueError):
+            deadzone = DEFAULT_DEADZONE_THRESHOLD
+        self.dispatch_table, self.dispatch_actions = compile_dispatch_table(
+            self.current_config, self.joystick_manager.active_joystick, self.axis_inverted, deadzone)
+        self.dispatch_values = [0] * len(self.dispatch_table)
+        self.indicator_cache = [None] * len(self.dispatch_table) # Last (colour, value) shown per row
+
+    def _update_indicator_lights(self):
+        """Lights the indicator of every compiled row from this tick's evaluated values."""
+        update_indicator_lights(self.dispatch_table, self.dispatch_values, self.indicator_cache,
+                                self.mapping_widgets, self.dispatch_actions)
+
     def _start_polling(self):
         # Initial call to start the event loop
         self.master.after(50, self._handle_joystick_events)
@@ -589,6 +656,9 @@ class JoystickConfiguratorApp:
                 widgets['mapped_label'].config(text="Not assigned")
                 widgets['indicator_light'].itemconfig("light_oval", fill="darkgray")
 
+        # Every change that affects the display also affects the dispatch table
+        self._compile_dispatch_table()
+
     def _save_config(self):
         if not self.joystick_manager.active_joystick:
             messagebox.showwarning("Save Error", "No joystick selected to save configuration for.")
@@ -620,35 +690,33 @@ class JoystickConfiguratorApp:
             except Exception as e:
                 messagebox.showerror("Save Error", f"Failed to save configuration: {e}")
 
-    def _load_config(self):
-        file_path = filedialog.askopenfilename(defaultextension=".json",
-                                               filetypes=[("JSON files", "*.json")],
-                                               initialfile=CONFIG_FILE)
+    def _load_config(self, file_path=None):
+        """Loads a config file. Asks for the file unless a path is given (e.g. from the command line)."""
+        from_dialog = file_path is None
+        if from_dialog:
+            file_path = filedialog.askopenfilename(defaultextension=".json",
+                                                   filetypes=[("JSON files", "*.json")],
+                                                   initialfile=CONFIG_FILE)
         if file_path:
             try:
-                with open(file_path, 'r') as f:
-                    loaded_config = json.load(f)
-                
                 # Clear current config and load new one
-                self.current_config = {k: v for k, v in loaded_config.items() if k in ACTIONS} # Only load valid actions
+                self.current_config, loaded_axis_inverted, deadzone = load_config_file(file_path)
                 
-                # --- Load axis inversion states ---
-                # Provide a default empty dict if 'axis_inverted' key is missing for backward compatibility
-                loaded_axis_inverted = loaded_config.get('axis_inverted', {})
                 # Update self.axis_inverted, ensuring only valid analog axes are considered
                 for axis_name in self.axis_inverted.keys(): # Iterate over the keys we expect to invert
                     self.axis_inverted[axis_name] = loaded_axis_inverted.get(axis_name, False)
 
                 # --- Load deadzone threshold ---
-                # Provide default if 'deadzone_threshold' key is missing
-                self.deadzone_var.set(loaded_config.get('deadzone_threshold', DEFAULT_DEADZONE_THRESHOLD))
+                self.deadzone_var.set(deadzone)
                 
                 # If an active joystick is selected, update its display immediately
                 if self.joystick_manager.active_joystick:
                     self._update_mapped_inputs_display()
-                    messagebox.showinfo("Load Config", f"Configuration loaded from {os.path.basename(file_path)}")
-                else:
+                    if from_dialog:
+                        messagebox.showinfo("Load Config", f"Configuration loaded from {os.path.basename(file_path)}")
+                elif from_dialog:
                     messagebox.showinfo("Load Config", f"Configuration loaded from {os.path.basename(file_path)}. Select a joystick to apply.")
+                print(f"Configuration loaded from {file_path}")
                 
             except FileNotFoundError:
                 messagebox.showerror("Load Error", "Configuration file not found.")
@@ -658,99 +726,49 @@ class JoystickConfiguratorApp:
                 messagebox.showerror("Load Error", f"An error occurred: {e}")
 
     def _setup_socket_server(self):
-        """Sets up the TCP socket server to listen for client connections."""
+        """Starts the joystick publisher on the selected transport."""
+        self.publisher = JoystickPublisher(transport=self.transport_var.get(), host=HOST, port=PORT)
         try:
-            self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1) # Allow reuse of address
-            self.server_socket.bind((HOST, PORT))
-            self.server_socket.listen(1) # Listen for one incoming connection at a time
-            print(f"Socket server listening on {HOST}:{PORT}")
-
-            # Start a separate thread to accept connections to avoid blocking GUI
-            self.server_thread = threading.Thread(target=self._accept_connections_loop, daemon=True)
-            self.server_thread.start()
+            self.publisher.start()
         except Exception as e:
             print(f"Error setting up socket server: {e}")
             messagebox.showerror("Socket Error", f"Failed to set up socket server: {e}")
+        self.link_status_var.set(f"{self.publisher.transport}: {format_link_summary(None)}")
 
-    def _accept_connections_loop(self):
-        """Loop to accept incoming client connections."""
-        while self.running_server:
-            try:
-                if self.client_connection is None: # Only accept if no client is currently connected
-                    print("Waiting for client connection...")
-                    # This accept call will block until a client connects
-                    self.server_socket.settimeout(1.0) # Set a timeout so thread can check running_server flag
-                    conn, addr = self.server_socket.accept()
-                    self.client_connection = conn
-                    self.client_address = addr
-                    print(f"Accepted connection from {addr}")
-                    self.server_socket.settimeout(None) # Remove timeout once connected
-                else:
-                    time.sleep(0.1) # Small delay when client is already connected
-            except socket.timeout:
-                pass # No connection within timeout, continue loop
-            except Exception as e:
-                if self.running_server: # Only print error if server is expected to be running
-                    print(f"Error in accept connections loop: {e}")
-                if self.client_connection:
-                    self.client_connection.close()
-                self.client_connection = None
-                self.client_address = None
-            finally:
-                pygame.event.pump() # Ensure pygame events are processed even in this thread
-
-    def _send_joystick_data(self, message_string):
-        """Sends the joystick event string over the socket if a client is connected."""
-        
-        #print(f"Sent: {message_string.strip()}")      
+    def _on_transport_selected(self, event=None):
+        """Restarts the publisher when a different transport is chosen."""
+        if self.publisher and self.publisher.transport == self.transport_var.get():
+            return
+        if self.publisher:
+            self.publisher.stop()
+        self._setup_socket_server()
 
-        if self.client_connection:
-            try:
-                # Add newline delimiter for client parsing
-                # Encode the string as bytes before sending
-                self.client_connection.sendall((message_string + '\n').encode('utf-8'))
-                # print(f"Sent: {message_string.strip()}") # Uncomment for debugging sent data
-            except (BrokenPipeError, ConnectionResetError) as e:
-                print(f"Client disconnected: {e}")
-                if self.client_connection:
-                    self.client_connection.close()
-                self.client_connection = None
-                self.client_address = None
-            except Exception as e:
-                print(f"Error sending data: {e}")
-                if self.client_connection:
-                    self.client_connection.close()
-                self.client_connection = None
-                self.client_address = None
+    def _send_joystick_data(self, command_payload):
+        """Sends the joystick payload to the director if anyone is listening."""
+        if self.publisher:
+            self.publisher.publish(command_payload)
+
+    def _update_link_status(self):
+        """Shows the latency and loss the director reported for our stream."""
+        if self.publisher and self.publisher.poll_link_report():
+            self.link_status_var.set(f"{self.publisher.transport}: {format_link_summary(self.publisher.last_link_report)}")
 
     def on_closing(self):
         print("Closing application.")
-        self.running_server = False # Signal the server thread to stop
-        
-        # Give the server thread a moment to notice the flag and unblock accept()
-        if self.server_thread and self.server_thread.is_alive():
-            # If server_socket.accept() is blocking, closing the socket will raise an exception
-            # in the server thread, causing it to exit the loop.
-            try:
-                self.server_socket.shutdown(socket.SHUT_RDWR)
-            except OSError as e:
-                # Handle cases where socket is already closed or in a bad state
-                if "socket is not connected" not in str(e) and "Bad file descriptor" not in str(e):
-                    print(f"Warning during server socket shutdown: {e}")
-            self.server_thread.join(timeout=1.0) # Graceful shutdown for the thread
-
-        if self.server_socket:
-            self.server_socket.close() # Close the server socket
-        if self.client_connection:
-            self.client_connection.close() # Close any active client connection
+        if self.publisher:
+            self.publisher.stop() # Stops the server thread and closes all sockets
         self.joystick_manager.quit()
         self.master.destroy()
 
 if __name__ == "__main__":
+    # Optional config path: python joystickConfig21.py my_config.json (skips the file dialog)
+    # For a robot without a screen use joystickDaemon.py instead.
+    startup_start = time.perf_counter()
     root = tk.Tk()
-    app = JoystickConfiguratorApp(root)
+    app = JoystickConfiguratorApp(root, sys.argv[1] if len(sys.argv) > 1 else None)
     root.protocol("WM_DELETE_WINDOW", app.on_closing) # Handle window close event
+    root.update_idletasks() # Draw the window so the startup time includes the UI
+    print(f"Joystick configurator ready in {(time.perf_counter() - startup_start) * 1000:.0f} ms")
     root.mainloop()
 
 
@@ -0,0 +1,176 @@
+import time
+startup_start = time.perf_counter() # Taken before the heavy imports so the startup report includes them
+
+import os
+import argparse
+import signal
+
+# No window, no sound: SDL must be told before pygame is imported
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import pygame
+
+from joystickConfig21 import (HOST, PORT, DEFAULT_TRANSPORT, JoystickManager, load_config_file,
+                              compile_dispatch_table, evaluate_dispatch_table, payload_needs_sending)
+from joystickProtocol import TRANSPORTS, UDP_PORT, UDP_TARGET_HOST, JoystickPublisher, format_link_summary
+
+# Headless joystick-to-socket bridge for the Pi: same mapping, sending rules and transports
+# as joystickConfig21.py, but no Tk window and no file dialog.
+# Run: python joystickDaemon.py joystick_config.json [--transport UDP] [--stats]
+
+POLL_RATE_HZ = 20           # Same 50 ms tick as the configurator GUI
+RESCAN_INTERVAL_S = 2.0     # How often to look for a joystick when none is plugged in
+STATS_INTERVAL_S = 10.0     # How often --stats prints CPU use and link quality
+INITIAL_SPEED = 0.5         # Same starting speed as the GUI
+
+
+class JoystickDaemon:
+    def __init__(self, config_path, transport=DEFAULT_TRANSPORT, host=HOST, port=PORT,
+                 udp_host=UDP_TARGET_HOST, udp_port=UDP_PORT, rate_hz=POLL_RATE_HZ, stats=False):
+        self.running = True
+        self.rate_hz = rate_hz
+        self.stats = stats
+        self.current_speed = INITIAL_SPEED
+        self.last_sent_payload = {}
+        self.stop_payload = None # Zero state kept on the wire while the joystick is unplugged
+        self.dispatch_table = []
+        self.dispatch_values = []
+
+        # Start listening first so the director can connect while the joystick comes up
+        self.publisher = JoystickPublisher(transport=transport, host=host, port=port,
+                                           udp_host=udp_host, udp_port=udp_port)
+        self.publisher.start()
+
+        self.config, self.axis_inverted, self.deadzone = load_config_file(config_path)
+        print(f"Configuration loaded from {config_path}")
+
+        self.joystick_manager = JoystickManager()
+        self._select_joystick()
+
+    def _select_joystick(self):
+        """Picks the joystick named in the config, or the first one found, and compiles its table."""
+        names = self.joystick_manager.get_joystick_names()
+        configured = {m.get('joy_name') for m in self.config.values()}
+        index = next((i for i, name in enumerate(names) if name in configured), 0)
+        if names and self.joystick_manager.set_active_joystick(index):
+            print(f"Using joystick: {names[index]}")
+        else:
+            self.joystick_manager.active_joystick = None
+            print("No joystick found, will keep looking...")
+        self.dispatch_table, _ = compile_dispatch_table(
+            self.config, self.joystick_manager.active_joystick, self.axis_inverted, self.deadzone)
+        self.dispatch_values = [0] * len(self.dispatch_table)
+
+    def _joystick_removed(self, events, joystick):
+        """True if the active joystick was unplugged (a removal event for it, or its handle went dead)."""
+        instance_id = joystick.get_instance_id() if hasattr(joystick, 'get_instance_id') else None
+        if any(e['type'] == 'device_removed' and e['joy_id'] in (instance_id, None) for e in events):
+            return True
+        return not joystick.get_init()
+
+    def _lose_joystick(self):
+        """Stops the robot (the last state sent may have it moving) and goes back to looking for a joystick."""
+        print("Joystick removed, sending stop and rescanning...")
+        self.joystick_manager.active_joystick = None
+        self.stop_payload = {"x": 0.0, "y": 0.0, "r": 0.0, "e": 0.0, "laser": 0, "power": 0,
+                             "speed": self.current_speed}
+        self.publisher.publish(self.stop_payload)
+        self.last_sent_payload = self.stop_payload
+
+    def run(self):
+        period = 1.0 / self.rate_hz
+        next_tick = time.perf_counter()
+        last_rescan = time.monotonic()
+        last_stats = time.monotonic()
+        last_cpu = time.process_time()
+        print(f"Joystick daemon publishing in {(time.perf_counter() - startup_start) * 1000:.0f} ms "
+              f"({self.publisher.transport}, {self.rate_hz} Hz)")
+
+        while self.running:
+            events = self.joystick_manager.poll_events() # Keeps pygame's event queue drained and joystick state fresh
+            joystick = self.joystick_manager.active_joystick
+
+            if joystick:
+                command_payload = None
+                if not self._joystick_removed(events, joystick):
+                    try:
+                        command_payload, self.current_speed = evaluate_dispatch_table(
+                            self.dispatch_table, joystick, self.current_speed, self.dispatch_values)
+                    except pygame.error: # Unplugged between the event check and the read
+                        pass
+                if command_payload is None:
+                    self._lose_joystick()
+                    last_rescan = 0.0 # Look for it again right away
+                elif payload_needs_sending(command_payload, self.last_sent_payload, self.publisher):
+                    self.publisher.publish(command_payload)
+                    self.last_sent_payload = command_payload
+            else:
+                # Keep repeating the stop like a live zero state, so a lost datagram cannot leave the robot moving
+                if self.stop_payload and payload_needs_sending(self.stop_payload, self.last_sent_payload, self.publisher):
+                    self.publisher.publish(self.stop_payload)
+                if time.monotonic() - last_rescan > RESCAN_INTERVAL_S:
+                    last_rescan = time.monotonic()
+                    self.joystick_manager.detect_joysticks()
+                    self._select_joystick()
+                    if self.joystick_manager.active_joystick:
+                        self.stop_payload = None
+
+            self.publisher.poll_link_report()
+
+            if self.stats and time.monotonic() - last_stats >= STATS_INTERVAL_S:
+                now_cpu = time.process_time()
+                elapsed = time.monotonic() - last_stats
+                cpu_pct = 100.0 * (now_cpu - last_cpu) / elapsed
+                print(f"CPU {cpu_pct:.1f}% | sent seq {self.publisher.seq} | "
+                      f"{format_link_summary(self.publisher.last_link_report)}")
+                last_stats = time.monotonic()
+                last_cpu = now_cpu
+
+            # Fixed-rate loop: sleep until the next tick instead of a fixed delay, so work time doesn't add drift
+            next_tick += period
+            delay = next_tick - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_tick = time.perf_counter() # Fell behind, don't try to catch up with a burst
+
+    def stop(self, *args):
+        self.running = False
+
+    def close(self):
+        print("Stopping joystick daemon.")
+        self.publisher.stop()
+        self.joystick_manager.quit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless joystick to robot director bridge.")
+    parser.add_argument("config", help="Joystick config saved by joystickConfig21.py")
+    parser.add_argument("--transport", choices=TRANSPORTS, default=DEFAULT_TRANSPORT)
+    parser.add_argument("--host", default=HOST, help="TCP listen address (use 0.0.0.0 for all interfaces)")
+    parser.add_argument("--port", type=int, default=PORT, help="TCP listen port")
+    parser.add_argument("--udp-host", default=UDP_TARGET_HOST, help="Director address for unicast UDP")
+    parser.add_argument("--udp-port", type=int, default=UDP_PORT)
+    parser.add_argument("--rate", type=float, default=POLL_RATE_HZ, help="Poll/publish rate in Hz")
+    parser.add_argument("--stats", action="store_true", help=f"Print CPU use and link quality every {STATS_INTERVAL_S:.0f} s")
+    args = parser.parse_args()
+
+    try:
+        daemon = JoystickDaemon(args.config, transport=args.transport, host=args.host, port=args.port,
+                                udp_host=args.udp_host, udp_port=args.udp_port, rate_hz=args.rate, stats=args.stats)
+    except (OSError, ValueError) as e:
+        print(f"Could not start joystick daemon: {e}")
+        raise SystemExit(1)
+
+    signal.signal(signal.SIGTERM, daemon.stop) # systemd stop
+    try:
+        daemon.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        daemon.close()
+
+
+if __name__ == "__main__":
+    main()
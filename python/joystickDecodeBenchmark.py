@@ -0,0 +1,125 @@
+import json
+import queue
+import sys
+import time
+
+from joystickProtocol import LinkStats, LineFramer, stamp_payload
+from joystickSession import read_session
+
+# Compares the director's joystick stream handling before and after moving framing/decoding
+# into the reader thread, over a one-minute session (a recorded .jsl log or a synthetic one).
+# Before: the reader thread queued decoded str chunks and the Tk thread did += / split('\n', 1) /
+# json.loads / link stats for every message. After: the reader thread feeds a LineFramer, which
+# reads every message's stamps for the link stats with a regex and decodes only the newest state;
+# the Tk thread takes that slot once per 50 ms tick. The target is a 10x faster decode.
+# Run: python joystickDecodeBenchmark.py [session.jsl]
+
+DECODE_TARGET = 10.0  # Required decode speedup
+SESSION_SECONDS = 60
+SENDER_RATE_HZ = 20   # joystickConfig21 polls every 50 ms
+TK_TICK_S = 0.05      # _process_joystick_queue interval
+RECV_SIZES = {"1x (one message per recv)": 0, "replay max (4096-byte recv)": 4096}
+REPEATS = 5
+
+
+def synthetic_session():
+    records = []
+    for i in range(SESSION_SECONDS * SENDER_RATE_HZ):
+        x = round(((i * 7) % 200 - 100) / 100.0, 3)
+        records.append((i / SENDER_RATE_HZ, {"x": x, "y": round(-x / 2, 3), "r": 0.0, "e": 0.0,
+                                             "laser": (i // 40) % 2, "power": 1, "speed": 0.5}))
+    return records
+
+
+def make_stream(records):
+    """The bytes joystickConfig21 would put on the wire for this session, one message per entry."""
+    base = time.time()
+    return [(json.dumps(dict(stamp_payload(payload, seq), ts=base + t)) + '\n').encode('utf-8')
+            for seq, (t, payload) in enumerate(records)]
+
+
+def chunk_stream(messages, recv_size):
+    if not recv_size:
+        return messages
+    data = b''.join(messages)
+    return [data[i:i + recv_size] for i in range(0, len(data), recv_size)]
+
+
+def before(chunks, ticks):
+    """Old path: returns (total seconds, Tk-thread seconds, states applied)."""
+    data_queue = queue.Queue()
+    stats = LinkStats()
+    start = time.perf_counter()
+    for chunk in chunks: # Reader thread
+        data_queue.put(chunk.decode('utf-8'))
+    reader_s = time.perf_counter() - start
+
+    applied = 0
+    buffer = ''
+    start = time.perf_counter()
+    per_tick = max(1, len(chunks) // ticks)
+    for _ in range(0, len(chunks), per_tick): # Tk thread, every 50 ms drains what arrived
+        for _ in range(per_tick):
+            if data_queue.empty():
+                break
+            buffer += data_queue.get_nowait()
+            while '\n' in buffer:
+                message_string, buffer = buffer.split('\n', 1)
+                if not message_string.strip():
+                    continue
+                joystick_data = json.loads(message_string)
+                if stats.accept(joystick_data, recv_time=joystick_data["ts"]):
+                    applied += 1
+    tk_s = time.perf_counter() - start
+    return reader_s + tk_s, tk_s, applied
+
+
+def after(chunks, ticks):
+    """New path: returns (total seconds, Tk-thread seconds, states applied)."""
+    framer = LineFramer()
+    stats = LinkStats()
+    slot = []
+    applied = 0
+    reader_s = 0.0
+    tk_s = 0.0
+    per_tick = max(1, len(chunks) // ticks)
+    for i in range(0, len(chunks), per_tick):
+        start = time.perf_counter()
+        for chunk in chunks[i:i + per_tick]: # Reader thread
+            newest = framer.feed_newest(chunk, stats)
+            if newest is not None:
+                slot[:] = [newest]
+        mid = time.perf_counter()
+        if slot: # Tk thread
+            slot.pop()
+            applied += 1
+        tk_s += time.perf_counter() - mid
+        reader_s += mid - start
+    return reader_s + tk_s, tk_s, applied
+
+
+def run(records):
+    messages = make_stream(records)
+    duration = records[-1][0] if records else 0.0
+    ticks = max(1, int(duration / TK_TICK_S))
+    print(f"Session: {len(messages)} messages, {duration:.1f} s, {sum(map(len, messages))} bytes")
+    for label, recv_size in RECV_SIZES.items():
+        chunks = chunk_stream(messages, recv_size)
+        ticks_here = ticks if not recv_size else max(1, min(ticks, len(chunks))) # Replay at max speed arrives in a few ticks
+        best_before = min((before(chunks, ticks_here) for _ in range(REPEATS)), key=lambda r: r[0])
+        best_after = min((after(chunks, ticks_here) for _ in range(REPEATS)), key=lambda r: r[0])
+        print(f"\n{label}: {len(chunks)} reads")
+        print(f"  Before: total {best_before[0] * 1000:8.2f} ms, Tk thread {best_before[1] * 1000:8.2f} ms, {best_before[2]} states applied")
+        print(f"  After:  total {best_after[0] * 1000:8.2f} ms, Tk thread {best_after[1] * 1000:8.2f} ms, {best_after[2]} states applied")
+        speedup = best_before[0] / best_after[0]
+        print(f"  Decode speedup {speedup:.1f}x ({'meets' if speedup >= DECODE_TARGET else 'misses'} the "
+              f"{DECODE_TARGET:.0f}x target), Tk thread speedup {best_before[1] / max(best_after[1], 1e-9):.0f}x")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        _, session_records = read_session(sys.argv[1])
+        session_records = [(t, {k: v for k, v in payload.items() if k != "seq"}) for t, payload in session_records]
+    else:
+        session_records = synthetic_session()
+    run(session_records)
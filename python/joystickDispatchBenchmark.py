@@ -0,0 +1,158 @@
+import time
+import sys
+
+from joystickConfig21 import (ACTIONS, ANALOG_DISPLAY_PRECISION, DEFAULT_DEADZONE_THRESHOLD,
+                              compile_dispatch_table, evaluate_dispatch_table, update_indicator_lights)
+
+# Measures the per-tick cost of turning joystick state into a command payload plus the
+# indicator-light pass, before (dictionary walk over ACTIONS) and after (compiled table).
+# Run: python joystickDispatchBenchmark.py [ticks]
+
+TICKS = 20000
+
+# A typical gamepad: 6 axes, 12 buttons, 1 hat
+EXAMPLE_CONFIG = {
+    "X-Axis (analog)": {"joy_name": "Bench Pad", "input_type": "axis", "input_id": 0},
+    "Y-Axis (analog)": {"joy_name": "Bench Pad", "input_type": "axis", "input_id": 1},
+    "R-Rotation (analog)": {"joy_name": "Bench Pad", "input_type": "axis", "input_id": 3},
+    "E-Elevation (analog)": {"joy_name": "Bench Pad", "input_type": "axis", "input_id": 4},
+    "Laser On/Off (toggle)": {"joy_name": "Bench Pad", "input_type": "button", "input_id": 0},
+    "Power (toggle)": {"joy_name": "Bench Pad", "input_type": "button", "input_id": 1},
+    "Speed Up (button)": {"joy_name": "Bench Pad", "input_type": "button", "input_id": 5},
+    "Speed Down (button)": {"joy_name": "Bench Pad", "input_type": "button", "input_id": 4},
+}
+AXIS_INVERTED = {"X-Axis (analog)": False, "Y-Axis (analog)": True, "R-Rotation (analog)": False, "E-Elevation (analog)": False}
+
+
+class FakeJoystick:
+    """Stands in for pygame.joystick.Joystick with slowly moving sticks."""
+    def __init__(self):
+        self.tick = 0
+
+    def get_name(self): return "Bench Pad"
+    def get_numaxes(self): return 6
+    def get_numbuttons(self): return 12
+    def get_numhats(self): return 1
+    def get_axis(self, i): return ((self.tick + 37 * i) % 200 - 100) / 100.0
+    def get_button(self, i): return 1 if (self.tick // 50 + i) % 7 == 0 else 0
+    def get_hat(self, i): return (0, 0)
+
+
+class FakeWidget:
+    """Counts the Tk calls the indicator pass would make."""
+    calls = 0
+    def itemconfig(self, *args, **kwargs): FakeWidget.calls += 1
+    def config(self, *args, **kwargs): FakeWidget.calls += 1
+
+
+def get_current_state(joystick):
+    # Same as JoystickManager.get_current_state: reads every input of the joystick
+    state = {'buttons': {}, 'axes': {}, 'hats': {}}
+    for i in range(joystick.get_numbuttons()):
+        state['buttons'][i] = joystick.get_button(i)
+    for i in range(joystick.get_numaxes()):
+        state['axes'][i] = joystick.get_axis(i)
+    for i in range(joystick.get_numhats()):
+        state['hats'][i] = joystick.get_hat(i)
+    return state
+
+
+def legacy_tick(joystick, config, axis_inverted, deadzone, current_speed, mapping_widgets):
+    """The per-tick logic of _handle_joystick_events before the dispatch table."""
+    current_state = get_current_state(joystick)
+    command_payload = {"x": 0.0, "y": 0.0, "r": 0.0, "e": 0.0, "laser": 0, "power": 0, "speed": current_speed}
+    for action_name in ACTIONS:
+        config_map = config.get(action_name)
+        if config_map and config_map.get('joy_name') == joystick.get_name():
+            input_type = config_map['input_type']
+            input_id = config_map['input_id']
+            inversion_factor = -1.0 if axis_inverted.get(action_name) else 1.0
+            if input_type == 'axis' and input_id in current_state['axes']:
+                raw_axis_value = current_state['axes'][input_id]
+                processed_axis_value = 0.0 if abs(raw_axis_value) <= deadzone else raw_axis_value * inversion_factor
+                if action_name == "X-Axis (analog)":
+                    command_payload["x"] = round(processed_axis_value, ANALOG_DISPLAY_PRECISION)
+                elif action_name == "Y-Axis (analog)":
+                    command_payload["y"] = round(processed_axis_value, ANALOG_DISPLAY_PRECISION)
+                elif action_name == "R-Rotation (analog)":
+                    command_payload["r"] = round(processed_axis_value, ANALOG_DISPLAY_PRECISION)
+                elif action_name == "E-Elevation (analog)":
+                    command_payload["e"] = round(processed_axis_value, ANALOG_DISPLAY_PRECISION)
+            elif input_type == 'button' and input_id in current_state['buttons']:
+                if action_name == "Laser On/Off (toggle)":
+                    command_payload["laser"] = current_state['buttons'][input_id]
+                elif action_name == "Power (toggle)":
+                    command_payload["power"] = current_state['buttons'][input_id]
+                elif action_name == "Speed Up (button)":
+                    if current_state['buttons'][input_id] == 1:
+                        current_speed = min(1.0, current_speed + 0.01)
+                    command_payload["speed"] = current_speed
+                elif action_name == "Speed Down (button)":
+                    if current_state['buttons'][input_id] == 1:
+                        current_speed = max(0.0, current_speed - 0.01)
+                    command_payload["speed"] = current_speed
+
+    # Indicator pass: state read again and every light/label reconfigured every tick
+    current_state = get_current_state(joystick)
+    for action_name, widgets in mapping_widgets.items():
+        config_map = config.get(action_name)
+        is_active = False
+        if config_map and config_map.get('joy_name') == joystick.get_name():
+            input_type = config_map['input_type']
+            input_id = config_map['input_id']
+            if input_type == 'button' and input_id in current_state['buttons']:
+                is_active = current_state['buttons'][input_id] == 1
+            elif input_type == 'axis' and input_id in current_state['axes']:
+                display_axis_value = current_state['axes'][input_id] * (-1.0 if axis_inverted.get(action_name) else 1.0)
+                if abs(display_axis_value) <= deadzone:
+                    display_axis_value = 0.0
+                else:
+                    is_active = True
+                inversion_status = " (Inverted)" if axis_inverted.get(action_name, False) else ""
+                widgets['mapped_label'].config(text=f"Axis {input_id} ({display_axis_value:.{ANALOG_DISPLAY_PRECISION}f}){inversion_status}")
+            widgets['indicator_light'].itemconfig("light_oval", fill="limegreen" if is_active else "darkgray")
+    return command_payload, current_speed
+
+
+def compiled_tick(joystick, table, current_speed, values, cache, mapping_widgets, action_names):
+    """The per-tick logic with the compiled table (the same calls as _handle_joystick_events)."""
+    command_payload, current_speed = evaluate_dispatch_table(table, joystick, current_speed, values)
+    update_indicator_lights(table, values, cache, mapping_widgets, action_names)
+    return command_payload, current_speed
+
+
+def run(ticks):
+    joystick = FakeJoystick()
+    mapping_widgets = {name: {'mapped_label': FakeWidget(), 'indicator_light': FakeWidget()} for name in ACTIONS}
+
+    FakeWidget.calls = 0
+    speed = 0.5
+    start = time.perf_counter()
+    for t in range(ticks):
+        joystick.tick = t
+        payload_before, speed = legacy_tick(joystick, EXAMPLE_CONFIG, AXIS_INVERTED, DEFAULT_DEADZONE_THRESHOLD, speed, mapping_widgets)
+    legacy_us = (time.perf_counter() - start) / ticks * 1e6
+    legacy_calls = FakeWidget.calls / ticks
+
+    table, action_names = compile_dispatch_table(EXAMPLE_CONFIG, joystick, AXIS_INVERTED, DEFAULT_DEADZONE_THRESHOLD)
+    values = [0] * len(table)
+    cache = [None] * len(table)
+    FakeWidget.calls = 0
+    speed = 0.5
+    start = time.perf_counter()
+    for t in range(ticks):
+        joystick.tick = t
+        payload_after, speed = compiled_tick(joystick, table, speed, values, cache, mapping_widgets, action_names)
+    compiled_us = (time.perf_counter() - start) / ticks * 1e6
+    compiled_calls = FakeWidget.calls / ticks
+
+    if payload_before != payload_after:
+        print(f"WARNING: payloads differ: {payload_before} vs {payload_after}")
+    print(f"Ticks: {ticks}")
+    print(f"Before (ACTIONS walk):   {legacy_us:8.2f} us/tick, {legacy_calls:.2f} Tk calls/tick")
+    print(f"After (compiled table):  {compiled_us:8.2f} us/tick, {compiled_calls:.2f} Tk calls/tick")
+    print(f"Speedup: {legacy_us / compiled_us:.1f}x")
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else TICKS)
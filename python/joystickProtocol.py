@@ -0,0 +1,472 @@
+import json
+import re
+import socket
+import threading
+import time
+from collections import deque
+
+# --- Transport Configuration (shared by joystickConfig and robotDirector) ---
+JOYSTICK_HOST = '127.0.0.1' # TCP listen address of the joystick server. Use '0.0.0.0' to listen on all interfaces.
+JOYSTICK_PORT = 52345       # TCP port of the joystick server
+MAX_SUBSCRIBERS = 8         # Director plus recorders/loggers connected at the same time
+SUBSCRIBER_SEND_TIMEOUT_S = 0.5 # A TCP subscriber that can't take a message this quickly is dropped
+
+TRANSPORT_TCP = "TCP"
+TRANSPORT_UDP = "UDP"
+TRANSPORT_MULTICAST = "Multicast"
+TRANSPORTS = [TRANSPORT_TCP, TRANSPORT_UDP, TRANSPORT_MULTICAST]
+
+UDP_PORT = 52346                 # Datagram port for UDP and multicast joystick state
+UDP_TARGET_HOST = '127.0.0.1'    # Where unicast UDP datagrams are sent (the director's machine)
+MULTICAST_GROUP = '239.255.52.45' # Administratively scoped group, stays on the local network
+MULTICAST_TTL = 1                # Do not let multicast packets leave the local subnet
+
+# --- Link Quality Configuration ---
+STALE_PACKET_MS = 250       # Packets delayed this much more than the best recent delay are stale
+LATENCY_BASELINE_S = 10.0   # The staleness baseline is the best delay of this many seconds, so it follows clock shifts
+LINK_STATS_WINDOW = 200     # Number of latency samples kept for the rolling statistics
+LINK_REPORT_INTERVAL_S = 1.0 # How often the receiver reports link quality back to the sender
+LINK_REPORT_TYPE = "link_stats"
+MAX_FRAME_BYTES = 4096      # A TCP line longer than this is garbage, not a joystick state
+
+# Stamps of a JSON line, read without decoding it (json.dumps puts no space before the colon)
+SEQ_PATTERN = re.compile(rb'"seq": ?(\d+)')
+TS_PATTERN = re.compile(rb'"ts": ?([-+0-9.eE]+)')
+
+
+def stamp_payload(payload, seq):
+    """Returns a copy of the joystick payload with a sequence number and send timestamp added."""
+    stamped = dict(payload)
+    stamped["seq"] = seq
+    # Wall-clock time so latency can be measured between two machines with NTP-synced clocks
+    stamped["ts"] = time.time()
+    return stamped
+
+
+def encode_datagram(payload):
+    """Encodes a (stamped) payload dictionary into the bytes of one datagram."""
+    return json.dumps(payload, separators=(',', ':')).encode('utf-8')
+
+
+def decode_datagram(data):
+    """Decodes the bytes of one datagram back into a payload dictionary."""
+    return json.loads(data.decode('utf-8'))
+
+
+class LinkStats:
+    """
+    Tracks ordering, loss and one-way latency of a stamped joystick stream.
+    accept() decides whether a message is still worth applying: out-of-order messages are
+    rejected, and stale ones too when a newer state is already in hand. The newest state is
+    never dropped for being late, since the alternative is to keep applying an even older one.
+    """
+    def __init__(self, window=LINK_STATS_WINDOW, stale_ms=STALE_PACKET_MS, baseline_s=LATENCY_BASELINE_S):
+        self.stale_ms = stale_ms
+        self.baseline_s = baseline_s
+        self.latencies_ms = deque(maxlen=window)
+        # (recv_time, latency_ms) with increasing latencies: the front is the best delay of the window
+        self.baseline = deque()
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.last_seq = None
+            self.last_ts = None
+            self.received = 0
+            self.lost = 0
+            self.out_of_order = 0
+            self.stale = 0
+            self.latencies_ms.clear()
+            self.baseline.clear()
+
+    def accept(self, message, recv_time=None, superseded=False):
+        """
+        Records a received message and returns True if it should be applied.
+        superseded is True when a newer message of the same read follows this one; only then
+        is a stale message rejected. Messages without a sequence number (older senders) are
+        always accepted.
+        """
+        seq = message.get("seq")
+        ts = message.get("ts")
+        if seq is None or ts is None:
+            return True
+        if recv_time is None:
+            recv_time = time.time()
+        with self.lock:
+            return self._record(seq, ts, recv_time, superseded)
+
+    def accept_stamps(self, seqs, stamps, recv_time=None):
+        """
+        accept() for the sequence numbers and timestamps of one read's messages, in order, under one
+        lock. Returns the index of the last accepted one, or -1; all but the last are superseded.
+        """
+        if recv_time is None:
+            recv_time = time.time()
+        newest = -1
+        last = len(seqs) - 1
+        with self.lock:
+            for i in range(len(seqs)):
+                if self._record(seqs[i], stamps[i], recv_time, i < last):
+                    newest = i
+        return newest
+
+    def _record(self, seq, ts, recv_time, superseded):
+        """accept() with the lock held."""
+        if self.last_seq is not None and seq <= self.last_seq:
+            if ts > self.last_ts:
+                # Lower sequence number but newer timestamp: the sender restarted and counts from zero again
+                self.last_seq = None
+                self.baseline.clear()
+            else:
+                self.out_of_order += 1
+                return False
+
+        if self.last_seq is not None and seq > self.last_seq + 1:
+            self.lost += seq - self.last_seq - 1
+        self.last_seq = seq
+        self.last_ts = ts
+        self.received += 1
+
+        latency_ms = (recv_time - ts) * 1000.0
+        self.latencies_ms.append(latency_ms)
+        # Sliding-window minimum: drop samples this one beats, then samples that left the window
+        baseline = self.baseline
+        while baseline and baseline[-1][1] >= latency_ms:
+            baseline.pop()
+        baseline.append((recv_time, latency_ms))
+        while baseline[0][0] < recv_time - self.baseline_s:
+            baseline.popleft()
+
+        # Staleness is judged relative to the best recent delay, so a clock offset between two
+        # machines, or a step in it (NTP correction, new route), is absorbed within baseline_s
+        if latency_ms - baseline[0][1] > self.stale_ms:
+            self.stale += 1
+            if superseded:
+                return False
+        return True
+
+    def summary(self):
+        """Returns a dictionary snapshot of the link statistics."""
+        with self.lock:
+            samples = sorted(self.latencies_ms)
+            received = self.received
+            lost = self.lost
+            out_of_order = self.out_of_order
+            stale = self.stale
+        expected = received + lost
+        summary = {
+            "type": LINK_REPORT_TYPE,
+            "received": received,
+            "lost": lost,
+            "loss_pct": (100.0 * lost / expected) if expected else 0.0,
+            "out_of_order": out_of_order,
+            "stale": stale,
+            "latency_avg_ms": 0.0,
+            "latency_p95_ms": 0.0,
+            "latency_max_ms": 0.0,
+        }
+        if samples:
+            summary["latency_avg_ms"] = sum(samples) / len(samples)
+            summary["latency_p95_ms"] = samples[min(len(samples) - 1, int(0.95 * len(samples)))]
+            summary["latency_max_ms"] = samples[-1]
+        return summary
+
+
+def format_link_summary(summary):
+    """Formats a link summary (local or reported by the other side) for a status label."""
+    if not summary or not summary.get("received"):
+        return "Link: no data"
+    return (f"Link: {summary['latency_avg_ms']:.1f} ms avg, "
+            f"{summary['latency_p95_ms']:.1f} ms p95, "
+            f"{summary['loss_pct']:.1f}% loss, "
+            f"{summary['out_of_order']} late, {summary['stale']} stale")
+
+
+class LineFramer:
+    """
+    Splits a newline-delimited JSON byte stream into decoded messages.
+    Bytes are appended to one bytearray and complete lines are found by offset, so there is
+    no string concatenation or re-splitting of the remainder; consumed bytes are dropped once
+    per feed(). All complete lines of one read are decoded with a single json.loads call.
+    feed_newest() goes further for the director, which only applies the newest state: the stamps
+    of every line are read with a regex for the link stats, and only one line is decoded.
+    """
+    def __init__(self, max_frame_bytes=MAX_FRAME_BYTES):
+        self.buffer = bytearray()
+        self.max_frame_bytes = max_frame_bytes
+
+    def reset(self):
+        self.buffer.clear()
+
+    def _take_complete(self, data):
+        """Adds received bytes; returns every complete line (without the last newline), or None."""
+        buffer = self.buffer
+        scan_from = len(buffer) # Bytes already buffered hold no newline
+        buffer += data
+        end = buffer.rfind(b'\n', scan_from)
+        if end < 0:
+            if len(buffer) > self.max_frame_bytes:
+                print(f"Dropping {len(buffer)} bytes without a line break")
+                buffer.clear()
+            return None
+        complete = bytes(memoryview(buffer)[:end])
+        del buffer[:end + 1]
+        return complete
+
+    def feed(self, data):
+        """Adds received bytes and returns the list of messages completed by them."""
+        complete = self._take_complete(data)
+        if complete is None:
+            return []
+        try:
+            # One decode for the whole batch: the lines become the items of a JSON array
+            return json.loads(b'[' + complete.replace(b'\n', b',') + b']')
+        except ValueError:
+            pass
+
+        # Something in the batch is bad (or a line is empty): fall back to line by line
+        return self._decode_lines(complete)
+
+    def _decode_lines(self, complete):
+        messages = []
+        for line in complete.split(b'\n'):
+            if not line.strip():
+                continue
+            try:
+                messages.append(json.loads(line))
+            except ValueError as e:
+                print(f"Skipping invalid JSON line: {e} - {line[:80]!r}")
+        return messages
+
+    def feed_newest(self, data, link_stats, recv_time=None):
+        """
+        Adds received bytes, records the stamps of every completed message in link_stats and returns
+        the newest accepted message (a dict), or None.
+        """
+        complete = self._take_complete(data)
+        if complete is None:
+            return None
+        lines = complete.count(b'\n') + 1
+        if lines == 1: # The usual case at 20 Hz: one message, decoded anyway
+            try:
+                message = json.loads(complete)
+            except ValueError as e:
+                print(f"Skipping invalid JSON line: {e} - {complete[:80]!r}")
+                return None
+            return message if isinstance(message, dict) and link_stats.accept(message, recv_time) else None
+        seqs = SEQ_PATTERN.findall(complete)
+        stamps = TS_PATTERN.findall(complete)
+        if len(seqs) != lines or len(stamps) != lines:
+            # Unstamped (older sender), empty or bad lines: decode them all the ordinary way
+            newest = None
+            messages = self._decode_lines(complete)
+            for i, message in enumerate(messages):
+                if isinstance(message, dict) and link_stats.accept(message, recv_time, superseded=i < len(messages) - 1):
+                    newest = message
+            return newest
+
+        newest = link_stats.accept_stamps([int(seq) for seq in seqs], [float(ts) for ts in stamps], recv_time)
+        if newest < 0:
+            return None
+        start = 0
+        for _ in range(newest):
+            start = complete.index(b'\n', start) + 1
+        end = complete.find(b'\n', start)
+        try:
+            message = json.loads(complete[start:end if end >= 0 else len(complete)])
+        except ValueError as e:
+            print(f"Skipping invalid JSON line: {e}")
+            return None
+        return message if isinstance(message, dict) else None
+
+
+# --- Joystick Publisher Class ---
+class JoystickPublisher:
+    """
+    Sends joystick payloads to the robot director over TCP, UDP or multicast.
+    Every payload is stamped with a sequence number and timestamp so the receiver can
+    drop out-of-order or stale state and report latency and loss back to us.
+    Over TCP any number of subscribers (the director, a session recorder, ...) can attach.
+    """
+    def __init__(self, transport=TRANSPORT_TCP, host=JOYSTICK_HOST, port=JOYSTICK_PORT,
+                 udp_host=UDP_TARGET_HOST, udp_port=UDP_PORT):
+        self.transport = transport
+        self.host = host
+        self.port = port
+        self.udp_host = udp_host
+        self.udp_port = udp_port
+
+        # --- Socket Variables ---
+        self.server_socket = None
+        self.clients = [] # One {'conn', 'address', 'report_buffer'} per connected TCP subscriber
+        self.clients_lock = threading.Lock()
+        self.server_thread = None
+        self.running_server = False # Flag to control server thread
+        self.udp_socket = None
+        self.udp_destination = None
+
+        self.seq = 0 # Sequence number of the next payload
+        self.last_send_time = 0.0
+        self.last_link_report = None # Latest link statistics reported by the director
+
+    def start(self):
+        """Opens the sockets for the selected transport. Raises on failure."""
+        self.running_server = True
+        if self.transport == TRANSPORT_TCP:
+            self._setup_socket_server()
+        else:
+            self._setup_datagram_socket()
+
+    def _setup_socket_server(self):
+        """Sets up the TCP socket server to listen for client connections."""
+        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1) # Allow reuse of address
+        self.server_socket.bind((self.host, self.port))
+        self.server_socket.listen(MAX_SUBSCRIBERS)
+        self.server_socket.settimeout(1.0) # Lets the accept thread check running_server
+        print(f"Socket server listening on {self.host}:{self.port}")
+
+        # Start a separate thread to accept connections to avoid blocking GUI
+        self.server_thread = threading.Thread(target=self._accept_connections_loop, daemon=True)
+        self.server_thread.start()
+
+    def _setup_datagram_socket(self):
+        """Sets up the UDP socket used for unicast or multicast joystick datagrams."""
+        self.udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if self.transport == TRANSPORT_MULTICAST:
+            self.udp_socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, MULTICAST_TTL)
+            self.udp_socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1) # Deliver to listeners on this machine too
+            self.udp_destination = (MULTICAST_GROUP, self.udp_port)
+        else:
+            self.udp_destination = (self.udp_host, self.udp_port)
+        self.udp_socket.setblocking(False) # Link reports are polled from the GUI loop
+        print(f"{self.transport} joystick datagrams going to {self.udp_destination[0]}:{self.udp_destination[1]}")
+
+    def _accept_connections_loop(self):
+        """Loop to accept incoming client connections."""
+        while self.running_server:
+            try:
+                conn, address = self.server_socket.accept()
+            except socket.timeout:
+                continue # No connection within timeout, continue loop
+            except OSError as e:
+                if self.running_server: # Only print error if server is expected to be running
+                    print(f"Error in accept connections loop: {e}")
+                    time.sleep(0.1)
+                continue
+
+            with self.clients_lock:
+                if len(self.clients) >= MAX_SUBSCRIBERS:
+                    print(f"Refusing connection from {address}: {MAX_SUBSCRIBERS} subscribers already connected")
+                    conn.close()
+                    continue
+                conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1) # Small state messages, send immediately
+                conn.settimeout(SUBSCRIBER_SEND_TIMEOUT_S)
+                self.clients.append({'conn': conn, 'address': address, 'report_buffer': b''})
+            print(f"Accepted connection from {address}")
+
+    def _drop_client(self, client):
+        with self.clients_lock:
+            if client in self.clients:
+                self.clients.remove(client)
+        try:
+            client['conn'].close()
+        except OSError:
+            pass
+
+    def subscriber_count(self):
+        with self.clients_lock:
+            return len(self.clients)
+
+    def is_datagram(self):
+        return self.transport != TRANSPORT_TCP
+
+    def publish(self, payload):
+        """Stamps the payload and sends it over the active transport."""
+        message = stamp_payload(payload, self.seq)
+        self.seq += 1
+        self.last_send_time = time.time()
+
+        if self.is_datagram():
+            if self.udp_socket:
+                try:
+                    self.udp_socket.sendto(encode_datagram(message), self.udp_destination)
+                except BlockingIOError:
+                    pass # Socket buffer full; the next state supersedes this one anyway
+                except OSError as e:
+                    print(f"Error sending datagram: {e}")
+            return
+
+        # Newline-delimited JSON, encoded once for every subscriber
+        data = (json.dumps(message) + '\n').encode('utf-8')
+        with self.clients_lock:
+            clients = list(self.clients)
+        for client in clients:
+            try:
+                client['conn'].sendall(data)
+            except (BrokenPipeError, ConnectionResetError) as e:
+                print(f"Client {client['address']} disconnected: {e}")
+                self._drop_client(client)
+            except OSError as e: # Includes socket.timeout from a subscriber that stopped reading
+                print(f"Error sending data to {client['address']}: {e}")
+                self._drop_client(client)
+
+    def poll_link_report(self):
+        """
+        Reads any link statistics the director sent back without blocking.
+        Returns the newest report, or None if nothing new arrived.
+        """
+        newest = None
+        if self.is_datagram():
+            while self.udp_socket:
+                try:
+                    data, _ = self.udp_socket.recvfrom(2048)
+                except OSError: # Includes BlockingIOError when nothing is waiting
+                    break
+                try:
+                    report = decode_datagram(data)
+                except ValueError:
+                    continue
+                if report.get("type") == LINK_REPORT_TYPE:
+                    newest = report
+        else:
+            with self.clients_lock:
+                clients = list(self.clients)
+            for client in clients:
+                conn = client['conn']
+                try:
+                    conn.setblocking(False)
+                    chunk = conn.recv(4096)
+                    if chunk:
+                        client['report_buffer'] += chunk
+                except OSError:
+                    pass
+                finally:
+                    conn.settimeout(SUBSCRIBER_SEND_TIMEOUT_S)
+                while b'\n' in client['report_buffer']:
+                    line, client['report_buffer'] = client['report_buffer'].split(b'\n', 1)
+                    try:
+                        report = json.loads(line)
+                    except ValueError:
+                        continue
+                    if report.get("type") == LINK_REPORT_TYPE:
+                        newest = report
+        if newest:
+            self.last_link_report = newest
+        return newest
+
+    def stop(self):
+        self.running_server = False # Signal the server thread to stop
+        if self.server_thread and self.server_thread.is_alive():
+            self.server_thread.join(timeout=1.5) # accept() times out every second
+        if self.server_socket:
+            self.server_socket.close() # Close the server socket
+            self.server_socket = None
+        with self.clients_lock:
+            clients = list(self.clients)
+        for client in clients:
+            self._drop_client(client) # Close every subscriber connection
+        if self.udp_socket:
+            self.udp_socket.close()
+            self.udp_socket = None
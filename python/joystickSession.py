@@ -0,0 +1,212 @@
+import argparse
+import socket
+import struct
+import time
+
+from joystickProtocol import (JOYSTICK_HOST, JOYSTICK_PORT, TRANSPORT_TCP, TRANSPORT_MULTICAST, TRANSPORTS,
+                              UDP_PORT, UDP_TARGET_HOST, MULTICAST_GROUP, LINK_REPORT_TYPE,
+                              JoystickPublisher, LineFramer, decode_datagram, format_link_summary)
+
+# Records a joystick control session to a compact binary log and plays it back into the
+# director, so tuning runs and regression checks don't need a human at the stick.
+#
+#   python joystickSession.py record session.jsl                # attach to joystickConfig21 over TCP
+#   python joystickSession.py record session.jsl --transport Multicast   # listen next to the director
+#   python joystickSession.py replay session.jsl --speed 10     # 1, 10, ... or 'max'
+#
+# The replayer takes the configurator's place: start it instead of joystickConfig21.py/joystickDaemon.py
+# and connect the director as usual.
+
+SESSION_MAGIC = b"JSL1"
+HEADER_FORMAT = "<4sd"       # Magic, wall-clock start time of the recording
+RECORD_FORMAT = "<dI4fBBf"   # t since start (s), seq, x, y, r, e, laser, power, speed
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+RECORD_SIZE = struct.calcsize(RECORD_FORMAT) # 34 bytes per joystick state vs ~130 as JSON
+WAIT_FOR_SUBSCRIBER_S = 30.0 # How long replay waits for the director to connect over TCP
+PROGRESS_INTERVAL_S = 2.0
+
+
+def pack_record(t, payload):
+    return struct.pack(RECORD_FORMAT, t, int(payload.get("seq", 0)) & 0xFFFFFFFF,
+                       float(payload.get("x", 0.0)), float(payload.get("y", 0.0)),
+                       float(payload.get("r", 0.0)), float(payload.get("e", 0.0)),
+                       1 if payload.get("laser") else 0,
+                       max(0, min(255, int(payload.get("power", 0)))),
+                       float(payload.get("speed", 0.0)))
+
+
+def unpack_record(data):
+    """Returns (t, payload) in the shape joystickConfig21 sends."""
+    t, seq, x, y, r, e, laser, power, speed = struct.unpack(RECORD_FORMAT, data)
+    # float32 storage: round back to the precision the configurator sends
+    return t, {"x": round(x, 3), "y": round(y, 3), "r": round(r, 3), "e": round(e, 3),
+               "laser": laser, "power": power, "speed": round(speed, 3), "seq": seq}
+
+
+def read_session(path):
+    """Loads a session log. Returns (start_wall_time, [(t, payload), ...])."""
+    with open(path, "rb") as f:
+        data = f.read()
+    if len(data) < HEADER_SIZE:
+        raise ValueError(f"{path} is not a joystick session log")
+    magic, start_wall = struct.unpack_from(HEADER_FORMAT, data, 0)
+    if magic != SESSION_MAGIC:
+        raise ValueError(f"{path} is not a joystick session log")
+    records = []
+    for offset in range(HEADER_SIZE, len(data) - RECORD_SIZE + 1, RECORD_SIZE):
+        records.append(unpack_record(data[offset:offset + RECORD_SIZE])) # A torn last record is ignored
+    return start_wall, records
+
+
+def _open_subscriber_socket(transport, host, port, udp_port):
+    """Connects to the joystick server (TCP) or binds the datagram port (UDP/multicast)."""
+    if transport == TRANSPORT_TCP:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.connect((host, port))
+        print(f"Recording from joystick server {host}:{port}")
+    else:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1) # Share the port with the director
+        sock.bind(('', udp_port))
+        if transport == TRANSPORT_MULTICAST:
+            membership = struct.pack("4s4s", socket.inet_aton(MULTICAST_GROUP), socket.inet_aton("0.0.0.0"))
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+        print(f"Recording {transport} datagrams on port {udp_port}")
+    sock.settimeout(0.5)
+    return sock
+
+
+def record(path, transport=TRANSPORT_TCP, host=JOYSTICK_HOST, port=JOYSTICK_PORT, udp_port=UDP_PORT, duration=None):
+    sock = _open_subscriber_socket(transport, host, port, udp_port)
+    start = time.monotonic() # Offsets come from our own clock so replay timing doesn't depend on the sender's
+    count = 0
+    framer = LineFramer()
+    with open(path, "wb") as f:
+        f.write(struct.pack(HEADER_FORMAT, SESSION_MAGIC, time.time()))
+        try:
+            while duration is None or time.monotonic() - start < duration:
+                try:
+                    if transport == TRANSPORT_TCP:
+                        chunk = sock.recv(4096)
+                        if not chunk:
+                            print("Joystick server closed the connection.")
+                            break
+                        messages = framer.feed(chunk)
+                    else:
+                        data, _ = sock.recvfrom(2048)
+                        messages = [decode_datagram(data)]
+                except socket.timeout:
+                    continue
+                except ValueError as e:
+                    print(f"Skipping bad message: {e}")
+                    continue
+
+                now = time.monotonic() - start
+                for message in messages:
+                    if message.get("type") == LINK_REPORT_TYPE:
+                        continue # Reports from the director, not joystick state
+                    f.write(pack_record(now, message))
+                    count += 1
+        except KeyboardInterrupt:
+            pass
+        finally:
+            sock.close()
+    print(f"Recorded {count} joystick states ({time.monotonic() - start:.1f} s) to {path}")
+
+
+def replay(path, speed=1.0, transport=TRANSPORT_TCP, host=JOYSTICK_HOST, port=JOYSTICK_PORT,
+           udp_host=UDP_TARGET_HOST, udp_port=UDP_PORT, loops=1):
+    """
+    Publishes a recorded session like joystickConfig21 would. speed is a multiplier on the
+    recorded timing; None sends as fast as the socket takes it.
+    """
+    _, records = read_session(path)
+    if not records:
+        print(f"{path} has no joystick states.")
+        return
+    publisher = JoystickPublisher(transport=transport, host=host, port=port, udp_host=udp_host, udp_port=udp_port)
+    publisher.start()
+    try:
+        if transport == TRANSPORT_TCP:
+            print("Waiting for the director to connect...")
+            deadline = time.monotonic() + WAIT_FOR_SUBSCRIBER_S
+            while publisher.subscriber_count() == 0:
+                if time.monotonic() > deadline:
+                    print("No subscriber connected, giving up.")
+                    return
+                time.sleep(0.05)
+
+        sent = 0
+        start = time.perf_counter()
+        last_progress = start
+        for _ in range(loops):
+            loop_start = time.perf_counter()
+            for t, payload in records:
+                if speed:
+                    delay = loop_start + t / speed - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                publisher.publish(payload) # Re-stamped with a fresh seq/ts so the director's link stats stay valid
+                sent += 1
+                if time.perf_counter() - last_progress >= PROGRESS_INTERVAL_S:
+                    last_progress = time.perf_counter()
+                    publisher.poll_link_report()
+                    print(f"Sent {sent} states | {format_link_summary(publisher.last_link_report)}")
+            if transport == TRANSPORT_TCP and publisher.subscriber_count() == 0:
+                print("Director disconnected.")
+                break
+
+        elapsed = time.perf_counter() - start
+        time.sleep(1.2) # Give the director time to send its last link report
+        publisher.poll_link_report()
+        rate = f"{sent / elapsed:.0f} states/s" if elapsed > 0 else "n/a"
+        print(f"Replayed {sent} states in {elapsed:.2f} s ({rate})")
+        print(f"Director link: {format_link_summary(publisher.last_link_report)}")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        publisher.stop()
+
+
+def parse_speed(value):
+    if value.lower() == "max":
+        return None
+    speed = float(value)
+    if speed <= 0:
+        raise argparse.ArgumentTypeError("speed must be > 0 or 'max'")
+    return speed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record and replay joystick control sessions.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    rec = sub.add_parser("record", help="Capture the joystick stream to a session log")
+    rec.add_argument("path")
+    rec.add_argument("--transport", choices=TRANSPORTS, default=TRANSPORT_TCP)
+    rec.add_argument("--host", default=JOYSTICK_HOST, help="Joystick server address (TCP)")
+    rec.add_argument("--port", type=int, default=JOYSTICK_PORT)
+    rec.add_argument("--udp-port", type=int, default=UDP_PORT)
+    rec.add_argument("--duration", type=float, default=None, help="Stop after this many seconds (default: Ctrl+C)")
+
+    rep = sub.add_parser("replay", help="Feed a session log to the director")
+    rep.add_argument("path")
+    rep.add_argument("--speed", type=parse_speed, default=1.0, help="Playback speed: 1, 10, ... or 'max'")
+    rep.add_argument("--loops", type=int, default=1)
+    rep.add_argument("--transport", choices=TRANSPORTS, default=TRANSPORT_TCP)
+    rep.add_argument("--host", default=JOYSTICK_HOST, help="TCP listen address")
+    rep.add_argument("--port", type=int, default=JOYSTICK_PORT)
+    rep.add_argument("--udp-host", default=UDP_TARGET_HOST, help="Director address for unicast UDP")
+    rep.add_argument("--udp-port", type=int, default=UDP_PORT)
+    args = parser.parse_args()
+
+    if args.command == "record":
+        record(args.path, transport=args.transport, host=args.host, port=args.port,
+               udp_port=args.udp_port, duration=args.duration)
+    else:
+        replay(args.path, speed=args.speed, transport=args.transport, host=args.host, port=args.port,
+               udp_host=args.udp_host, udp_port=args.udp_port, loops=args.loops)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,369 @@
+import argparse
+import math
+import random
+import threading
+import time
+from collections import deque
+from functools import lru_cache
+
+import numpy as np
+
+from closedLoopFollower import ClosedLoopFollower, CONTROL_RATE_HZ, MAX_SPEED_MM_PER_SEC, POSE_TIMEOUT_S
+from gcodePath import compile_file
+from odometry import COMMAND_LATENCY_S, OdometryEstimator, advance
+from omniKinematics import body_velocity, feed_limits
+from poseStream import POSE_PORT, PoseStreamServer
+from robotSimulator import CAMERA_FPS, DETECTION_DELAY_S, POSE_NOISE, SIM_TAG_ID, pose_message
+from velocityCalibration import nominal_command
+
+# The robot behind the serial bridge, simulated from the firmware (ino/3wheeler101.ino) instead of
+# from the follower's mm/s like robotSimulator. SimulatedSerial takes the director's
+# "MX:..,MY:..,R:..,L:..,P:..,S:..\n" lines where serial.Serial would; each command reaches the
+# wheels COMMAND_LATENCY_S later, at the step rates the firmware would set (omniKinematics: scale
+# factor, 2 * 3.1459, truncated and clamped step delays), and the pose follows exactly from those
+# between commands, so nothing is stepped at a fixed physics rate. SyntheticLocalizer films it at
+# the camera rate and delivers noisy poses after the detection delay, as PoseStreamClient messages
+# or through a PoseStreamServer.
+#
+# Two clocks:
+#   - real time: robotDirector opens SIM_PORT as its serial port and connects its localizer to the
+#     simulator's pose stream; the director runs exactly as with the robot.
+#   - virtual: run_job() drives the closed-loop follower (or the open-loop executor's command
+#     schedule) against the firmware model event by event, as fast as it computes, and reports the
+#     path deviation. A 30k-segment job takes seconds.
+#
+# The firmware ignores the S (speed factor) field: its speed scaling is commented out.
+
+SIM_PORT = "sim"              # Serial port name robotDirector opens as this simulator
+FIRMWARE_LOOP_US = 0.0        # Average lateness of a step behind its delay (moveMotors polling); 0: on time
+REALTIME_STEP_S = 0.005       # Real time: how often the robot and the camera are brought up to now
+BRIDGE_ACK = b"Radio Success: 1\n" # What the desktop bridge answers to every command it relays
+OPEN_LOOP_MIN_MOVE_MS = 50    # robotDirector's open-loop executor: shortest move...
+OPEN_LOOP_GAP_MS = 10         # ...and the pause after the stop command before the next line
+VELOCITY_CACHE = 4096         # Distinct commands whose delivered velocity is remembered
+
+
+def encode_command(x, y, rotation, laser_on=False, laser_power=0, speed_factor=1.0):
+    """The serial line robotDirector writes to the bridge."""
+    return (f"MX:{x: .8f},MY:{y: .8f},R:{rotation: .8f},L:{int(laser_on)},P:{laser_power},"
+            f"S:{speed_factor: .8f}\n").encode('utf-8')
+
+
+@lru_cache(maxsize=VELOCITY_CACHE)
+def firmware_velocity(x, y, rotation, loop_us=FIRMWARE_LOOP_US):
+    """body_velocity() of one command as floats, memoized: stops and axis moves repeat all through a job."""
+    vx, vy, omega = body_velocity(x, y, rotation, loop_us)
+    return float(vx), float(vy), float(omega)
+
+
+def parse_command(line):
+    """A bridge line -> command dict like robotDirector's ("x", "y" m/s, "rotation" rev/s, ...), or None."""
+    try:
+        fields = dict(item.split(":", 1) for item in line.strip().split(","))
+        return {"x": float(fields["MX"]), "y": float(fields["MY"]), "rotation": float(fields["R"]),
+                "laser_on": fields["L"].strip() == "1", "laser_power": int(fields["P"]),
+                "speed_factor": float(fields["S"])}
+    except (ValueError, KeyError):
+        return None
+
+
+class FirmwareRobot:
+    """
+    The robot as its firmware drives it. command() at the time a line is written; advance_to(t) with
+    non-decreasing times returns the true pose (x mm, y mm, yaw deg) at t. Thread-safe.
+    """
+    def __init__(self, x=0.0, y=0.0, yaw=0.0, command_latency=COMMAND_LATENCY_S, loop_us=FIRMWARE_LOOP_US):
+        self.command_latency = command_latency
+        self.loop_us = loop_us
+        self.lock = threading.Lock()
+        self.x, self.y, self.yaw = float(x), float(y), float(yaw)
+        self.ts = None # Time of the pose above
+        self.velocity = (0.0, 0.0, 0.0) # Robot frame (mm/s, mm/s, deg/s) the wheels run at now
+        self.laser_on = False
+        self.laser_power = 0
+        self.pending = deque() # (effective_ts, vx, vy, omega, laser_on, laser_power), in time order
+        self.commands = 0
+        self.distance = 0.0
+        self.laser_distance = 0.0 # mm travelled with the laser on
+
+    def command(self, command, sent_ts):
+        vx, vy, omega = firmware_velocity(command["x"], command["y"], command["rotation"], self.loop_us)
+        with self.lock:
+            self.pending.append((sent_ts + self.command_latency, vx, vy, omega,
+                                 bool(command["laser_on"]), int(command["laser_power"])))
+            self.commands += 1
+
+    def _integrate(self, t):
+        dt = t - self.ts
+        if dt <= 0.0:
+            return
+        vx, vy, omega = self.velocity
+        self.x, self.y, self.yaw = advance(self.x, self.y, self.yaw, vx, vy, omega, dt)
+        travelled = math.hypot(vx, vy) * dt
+        self.distance += travelled
+        if self.laser_on:
+            self.laser_distance += travelled
+        self.ts = t
+
+    def advance_to(self, t):
+        with self.lock:
+            if self.ts is None:
+                self.ts = t
+            while self.pending and self.pending[0][0] <= t:
+                effective, vx, vy, omega, laser_on, laser_power = self.pending.popleft()
+                self._integrate(effective)
+                self.velocity = (vx, vy, omega)
+                self.laser_on, self.laser_power = laser_on, laser_power
+            self._integrate(t)
+            return self.x, self.y, self.yaw
+
+
+class SyntheticLocalizer:
+    """
+    Films a FirmwareRobot: a noisy pose every camera period, handed to deliver(message) detection_delay
+    after its capture, shaped like PoseStreamClient's messages. mono_offset maps the simulation
+    clock to time.monotonic() for the stage stamps (0 on a virtual clock).
+    """
+    def __init__(self, robot, deliver, tag_id=SIM_TAG_ID, camera_fps=CAMERA_FPS, detection_delay=DETECTION_DELAY_S,
+                 noise=POSE_NOISE, seed=None, mono_offset=0.0):
+        self.robot = robot
+        self.deliver = deliver
+        self.tag_id = tag_id
+        self.period = 1.0 / camera_fps
+        self.detection_delay = detection_delay
+        self.noise = noise
+        self.random = random.Random(seed)
+        self.mono_offset = mono_offset
+        self.next_capture = None
+        self.in_flight = deque() # (deliver_at, message)
+        self.seq = 0
+        self.truth = [] # (capture_ts, x, y, yaw) of every capture, for comparing against
+
+    def advance_to(self, t):
+        """Captures the frames due by t and delivers the detections that are done by t."""
+        if self.next_capture is None:
+            self.next_capture = t
+        while self.next_capture <= t:
+            capture = self.next_capture
+            x, y, yaw = self.robot.advance_to(capture)
+            self.truth.append((capture, x, y, yaw))
+            self.seq += 1
+            message = pose_message(self.seq, capture, capture + self.mono_offset, self.tag_id, x, y, yaw,
+                                   self.random, self.noise, self.detection_delay)
+            self.in_flight.append((capture + self.detection_delay, message))
+            self.next_capture += self.period
+        self.robot.advance_to(t)
+        while self.in_flight and self.in_flight[0][0] <= t:
+            deliver_at, message = self.in_flight.popleft()
+            message["recv_ts"] = deliver_at
+            message["recv_mono"] = deliver_at + self.mono_offset
+            self.deliver(message)
+
+
+class SimulatedSerial:
+    """
+    serial.Serial stand-in for the desktop bridge: write() parses robotDirector's command lines and
+    drives a FirmwareRobot, stamped with clock(); every command is acknowledged like the bridge does.
+    start() runs the robot in real time and serves its poses on a PoseStreamServer, so the director's
+    "Connect Localizer" watches the simulated robot.
+    """
+    def __init__(self, robot=None, clock=time.time):
+        self.robot = robot or FirmwareRobot()
+        self.clock = clock
+        self.is_open = True
+        self.lock = threading.Lock()
+        self.partial = b""
+        self.replies = deque()
+        self.malformed = 0
+        self.server = None
+        self.localizer = None
+        self.thread = None
+
+    def write(self, data):
+        now = self.clock()
+        with self.lock:
+            self.partial += data
+            *lines, self.partial = self.partial.split(b"\n")
+        for line in lines:
+            command = parse_command(line.decode('utf-8', errors='replace'))
+            if command is None:
+                self.malformed += 1
+                continue
+            self.robot.command(command, now)
+            with self.lock:
+                self.replies.append(BRIDGE_ACK)
+        return len(data)
+
+    @property
+    def in_waiting(self):
+        with self.lock:
+            return sum(len(reply) for reply in self.replies)
+
+    def readline(self):
+        with self.lock:
+            return self.replies.popleft() if self.replies else b""
+
+    def start(self, pose_port=POSE_PORT):
+        """Real time: advances the robot every REALTIME_STEP_S and publishes its poses on pose_port."""
+        self.server = PoseStreamServer(port=pose_port)
+        self.server.start()
+
+        def publish(message):
+            grab = message["timing"]["grab_mono"]
+            timing = {"grab": grab, "detect_start": grab + message["timing"]["detect_start_ms"] / 1000.0,
+                      "detect_end": grab + message["timing"]["detect_end_ms"] / 1000.0,
+                      "pnp_end": grab + message["timing"]["pnp_end_ms"] / 1000.0}
+            self.server.publish(message["poses"], message["capture_ts"], timing)
+
+        self.localizer = SyntheticLocalizer(self.robot, publish, mono_offset=time.monotonic() - time.time())
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        return self
+
+    def _run(self):
+        while self.is_open:
+            self.localizer.advance_to(self.clock())
+            time.sleep(REALTIME_STEP_S)
+
+    def close(self):
+        self.is_open = False
+        if self.thread:
+            self.thread.join(timeout=1.0)
+            self.thread = None
+        if self.server:
+            self.server.stop()
+            self.server = None
+
+
+def _open_loop_schedule(path, max_speed):
+    """(time offset s, command line) pairs the open-loop executor sends for the path, one move and one stop per segment."""
+    moving = np.flatnonzero(path.lengths >= 1e-3)
+    direction = path.directions[moving]
+    feed = np.minimum(np.minimum(path.feed[moving], max_speed), feed_limits(direction[:, 0], direction[:, 1])[1])
+    duration_ms = np.maximum(OPEN_LOOP_MIN_MOVE_MS, (path.lengths[moving] / feed * 1000.0).astype(np.int64)) # Its master.after() delay
+    schedule = []
+    t = 0.0
+    for i, segment in enumerate(moving.tolist()):
+        x, y, _ = nominal_command(direction[i, 0] * feed[i], direction[i, 1] * feed[i], 0.0)
+        laser_on = bool(path.laser_on[segment])
+        power = int(path.laser_power[segment]) if laser_on else 0
+        schedule.append((t, encode_command(x, y, 0.0, laser_on, power)))
+        t += duration_ms[i] / 1000.0
+        schedule.append((t, encode_command(0.0, 0.0, 0.0, laser_on, power)))
+        t += OPEN_LOOP_GAP_MS / 1000.0
+    return schedule
+
+
+def run_job(path, closed_loop=True, max_speed=MAX_SPEED_MM_PER_SEC, rate_hz=CONTROL_RATE_HZ, realtime=False,
+            max_seconds=None, pose_server=None, seed=0):
+    """
+    Runs a GcodePath against the firmware model from its start point and returns a dict with the
+    follower (closed loop), the localizer's poses (n, 4), the true poses (n, 4), the simulated and
+    the wall-clock duration. Virtual clock unless realtime.
+    """
+    start = time.time() if realtime else 1000.0
+    now = [start]
+    robot = FirmwareRobot(path.points[0, 0], path.points[0, 1])
+    serial_port = SimulatedSerial(robot, clock=lambda: now[0])
+    odometry = OdometryEstimator(firmware_velocity) # The director's estimator, on the same model
+    poses = []
+
+    def deliver(message):
+        pose = message["poses"][0]
+        odometry.fix(pose["x"], pose["y"], pose["yaw"], message["capture_ts"])
+        poses.append((message["capture_ts"], pose["x"], pose["y"], pose["yaw"]))
+        if pose_server:
+            pose_server.publish(message["poses"], message["capture_ts"])
+
+    localizer = SyntheticLocalizer(robot, deliver, seed=seed)
+
+    def write(line, t):
+        now[0] = t
+        serial_port.write(line)
+        odometry.command(parse_command(line.decode('utf-8')), t) # As robotDirector stamps what it sent
+
+    def wait_until(t):
+        if realtime:
+            time.sleep(max(0.0, t - time.time()))
+        localizer.advance_to(t)
+
+    wall_start = time.perf_counter()
+    follower = None
+    if closed_loop:
+        # robotDirector's serial path: the follower's mm/s through the nominal command, stamped when written
+        def send(vx, vy, omega, laser_on, laser_power):
+            x, y, rotation = nominal_command(vx, vy, omega)
+            write(encode_command(x, y, rotation, laser_on, laser_power), now[0])
+
+        follower = ClosedLoopFollower(path, None, send, rate_hz=rate_hz, max_speed=max_speed)
+        period = 1.0 / rate_hz
+        limit = max_seconds if max_seconds is not None else 3.0 * path.duration(max_speed) + 10.0
+        t = start
+        while t - start < limit:
+            wait_until(t)
+            fresh = odometry.last_fix_ts is not None and t - odometry.last_fix_ts <= POSE_TIMEOUT_S
+            if follower.tick(odometry.pose(t) if fresh else None, period, t):
+                break
+            t += period
+        write(encode_command(0.0, 0.0, 0.0), t)
+    else:
+        t = start
+        for offset, line in _open_loop_schedule(path, max_speed):
+            if max_seconds is not None and offset > max_seconds:
+                break
+            t = start + offset
+            wait_until(t)
+            write(line, t)
+    t += 1.0 # Let the robot stop and the last detections arrive
+    wait_until(t)
+    return {"follower": follower, "robot": robot, "poses": np.array(poses).reshape(-1, 4),
+            "truth": np.array(localizer.truth).reshape(-1, 4), "start_ts": start, "sim_s": t - start,
+            "wall_s": time.perf_counter() - wall_start, "malformed": serial_port.malformed}
+
+
+def main():
+    from pathDeviation import analyze, heatmap, report
+    parser = argparse.ArgumentParser(description="Runs a G-code job against the simulated firmware, faster than real time.")
+    parser.add_argument("gcode")
+    parser.add_argument("--open-loop", action="store_true", help="The director's open-loop executor instead of the follower")
+    parser.add_argument("--speed", type=float, default=MAX_SPEED_MM_PER_SEC, help="Speed limit (mm/s)")
+    parser.add_argument("--rate", type=float, default=CONTROL_RATE_HZ)
+    parser.add_argument("--seconds", type=float, default=None, help="Stop after this much simulated time")
+    parser.add_argument("--realtime", action="store_true", help="Run in real time and serve the poses on the pose stream port")
+    parser.add_argument("--heatmap", default=None, help="PNG of the true cross-track error")
+    args = parser.parse_args()
+
+    path = compile_file(args.gcode)
+    server = None
+    if args.realtime:
+        server = PoseStreamServer()
+        server.start()
+    try:
+        run = run_job(path, closed_loop=not args.open_loop, max_speed=args.speed, rate_hz=args.rate,
+                      realtime=args.realtime, max_seconds=args.seconds, pose_server=server)
+    finally:
+        if server:
+            server.stop()
+
+    follower = run["follower"]
+    robot = run["robot"]
+    if follower:
+        print(f"Closed loop {follower.result_line()}, {follower.pose_misses} pose misses")
+    print(f"{path.segment_count} segments, {path.length:.0f} mm: simulated {run['sim_s']:.1f} s in {run['wall_s']:.2f} s "
+          f"({run['sim_s'] / max(run['wall_s'], 1e-9):.0f}x real time), {robot.commands} commands, "
+          f"{run['malformed']} malformed; laser on for {robot.laser_distance:.0f} of "
+          f"{float(path.lengths[path.laser_on].sum()):.0f} mm of cuts")
+    # The truth says how the robot really moved; the localizer's poses are what the director would log
+    for label, samples in (("True", run["truth"]), ("Measured", run["poses"])):
+        if not len(samples):
+            continue
+        result = analyze(path, samples, start_ts=run["start_ts"], max_speed=args.speed)
+        text, _ = report(result, path)
+        print(f"{label} {text[0].lower()}{text[1:]}")
+        if label == "True" and args.heatmap:
+            heatmap(result, path, args.heatmap)
+            print(f"Heatmap written to {args.heatmap}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,342 @@
+import argparse
+import math
+import os
+import pickle
+import time
+
+import cv2
+import numpy as np
+
+from calibrationCache import CalibrationCache
+from poseStream import POSE_HOST, POSE_PORT, PoseStreamServer
+
+# LED localizer: finds the robot by its coloured LEDs instead of an AprilTag (see
+# gantryCamTracker/gantryCams5.txt and pics/robotCamColourLEDs.png): threshold each LED colour in
+# HSV on a downscaled frame, take the blob centroids from connectedComponentsWithStats, then match
+# the blobs to the robot's LED layout to get x, y and yaw. Poses are published on the same pose
+# stream as AprilTagTest14.py (poseStream.py), so robotDirector doesn't care which localizer runs.
+#
+# With a calibration file the LED centroids are undistorted and projected onto the LED plane
+# (camera looking straight down from CAMERA_HEIGHT_MM), giving millimetres like the AprilTag path.
+# Without one the poses are in pixels and, like AprilTagTest14's fallback, are not published.
+#
+#   python ledLocalizer.py --source 0 --serve
+#   python ledLocalizer.py --benchmark                       # synthetic LED frames with ground truth
+#   python ledLocalizer.py --benchmark ../vids/3WheelsBothNoSoda.mp4 --frames 300
+
+CAMERA_INDEX = 0
+CALIBRATION_FILE = 'camera_calibration_data.pkl'
+DOWNSCALE = 0.5                 # Thresholding runs on a frame this size; centroids are scaled back up
+CAMERA_HEIGHT_MM = 2000.0       # Camera above the floor (gantry cameras look straight down)
+LED_HEIGHT_MM = 250.0           # LED posts above the floor
+MIN_BLOB_AREA = 1               # In downscaled pixels; LEDs are only a few pixels across
+MAX_BLOB_AREA = 400             # Anything bigger is a lamp or a reflection, not an LED
+MAX_LED_SPREAD_PX = 200         # LEDs of one robot are within this many full-size pixels of the anchor LED
+MIN_LEDS = 3                    # LEDs needed for a pose (two always fit perfectly, so a bad match can't be told apart)
+MAX_FIT_ERROR = 0.15            # RMS fit residual allowed, as a fraction of the pattern's size
+
+# HSV ranges per LED colour (OpenCV hue is 0-179). Red wraps around, so it has two ranges.
+LED_COLOURS = {
+    "blue": [((100, 80, 200), (130, 255, 255))],
+    "green": [((45, 80, 200), (85, 255, 255))],
+    "red": [((0, 80, 200), (10, 255, 255)), ((170, 80, 200), (179, 255, 255))],
+}
+
+# LED layout of each robot in its own frame (mm, x right, y forward). The first LED is the anchor
+# the search starts from; every colour appears once per robot.
+# !!! Measure these on the robot, like the TAG_TO_ROBOT_CENTER offsets in AprilTagTest14.py !!!
+LED_PATTERNS = {
+    1: [("blue", (0.0, 90.0)), ("red", (-80.0, -50.0)), ("green", (80.0, -50.0))],
+}
+
+STATS_INTERVAL_S = 5.0
+
+
+class LedLocalizer:
+    def __init__(self, calibration=None, downscale=DOWNSCALE, patterns=LED_PATTERNS):
+        self.calibration = calibration # CalibrationCache or None
+        self.downscale = downscale
+        self.patterns = {robot_id: ([colour for colour, _ in leds], np.array([p for _, p in leds], dtype=np.float64))
+                         for robot_id, leds in patterns.items()}
+        self.colours = sorted({colour for colour, _ in sum(patterns.values(), [])})
+        self.plane_distance = CAMERA_HEIGHT_MM - LED_HEIGHT_MM
+        # Buffers, (re)allocated when the frame size changes
+        self._size = None
+        self._small = None
+        self._hsv = None
+        self._mask = None
+        self._part = None
+
+    def _allocate(self, frame):
+        height, width = frame.shape[:2]
+        small_size = (max(1, int(width * self.downscale)), max(1, int(height * self.downscale)))
+        self._small = np.empty((small_size[1], small_size[0], 3), dtype=np.uint8)
+        self._hsv = np.empty_like(self._small)
+        self._mask = np.empty(self._small.shape[:2], dtype=np.uint8)
+        self._part = np.empty_like(self._mask)
+        self._size = (width, height)
+
+    def find_leds(self, frame):
+        """Returns {colour: (n, 2) array of LED centroids in full-size pixels}."""
+        if self._size != (frame.shape[1], frame.shape[0]):
+            self._allocate(frame)
+        cv2.resize(frame, (self._small.shape[1], self._small.shape[0]), dst=self._small, interpolation=cv2.INTER_AREA)
+        cv2.cvtColor(self._small, cv2.COLOR_BGR2HSV, dst=self._hsv)
+        leds = {}
+        for colour in self.colours:
+            ranges = LED_COLOURS[colour]
+            cv2.inRange(self._hsv, ranges[0][0], ranges[0][1], dst=self._mask)
+            for low, high in ranges[1:]:
+                cv2.inRange(self._hsv, low, high, dst=self._part)
+                cv2.bitwise_or(self._mask, self._part, dst=self._mask)
+            count, _, stats, centroids = cv2.connectedComponentsWithStats(self._mask, connectivity=8)
+            areas = stats[1:, cv2.CC_STAT_AREA]
+            keep = (areas >= MIN_BLOB_AREA) & (areas <= MAX_BLOB_AREA)
+            # Centroids of pixel centres: +0.5 to go to pixel edges, scale up, -0.5 back
+            leds[colour] = (centroids[1:][keep] + 0.5) / self.downscale - 0.5
+        return leds
+
+    def to_plane(self, points):
+        """Full-size pixel points -> millimetres on the LED plane (camera frame), or None without calibration."""
+        if self.calibration is None or len(points) == 0:
+            return None
+        normalized = cv2.undistortPoints(points.reshape(-1, 1, 2).astype(np.float32),
+                                         self.calibration.camera_matrix, self.calibration.dist_coeffs)
+        return normalized.reshape(-1, 2).astype(np.float64) * self.plane_distance
+
+    def estimate_poses(self, frame):
+        """Finds the robots in a frame. Returns pose dictionaries shaped like AprilTagTest14.estimate_tag_poses."""
+        leds = self.find_leds(frame)
+        poses = []
+        for robot_id, (colours, model) in self.patterns.items():
+            anchors = leds.get(colours[0], ())
+            for anchor in anchors:
+                # Nearest LED of every other pattern colour around this anchor
+                image_points = [anchor]
+                used = [0]
+                for i, colour in enumerate(colours[1:], start=1):
+                    candidates = leds.get(colour)
+                    if candidates is None or len(candidates) == 0:
+                        continue
+                    distances = np.hypot(candidates[:, 0] - anchor[0], candidates[:, 1] - anchor[1])
+                    nearest = int(np.argmin(distances))
+                    if distances[nearest] <= MAX_LED_SPREAD_PX:
+                        image_points.append(candidates[nearest])
+                        used.append(i)
+                if len(used) < min(MIN_LEDS, len(colours)):
+                    continue
+                pose = self._fit_pose(robot_id, np.array(image_points), model[used], frame)
+                if pose is not None:
+                    poses.append(pose)
+        return poses
+
+    def _fit_pose(self, robot_id, image_points, model_points, frame):
+        """
+        2D fit of the LED layout to the observed LEDs (rigid in mm, similarity in pixels).
+        Returns None when the LEDs don't have the pattern's shape (stray lights).
+        """
+        plane_points = self.to_plane(image_points)
+        calibrated = plane_points is not None
+        observed = plane_points if calibrated else image_points.copy()
+        if not calibrated:
+            observed[:, 0] -= frame.shape[1] / 2 # Pixels from the image centre, like the AprilTag fallback
+            observed[:, 1] -= frame.shape[0] / 2
+        # Robot frame has y forward; image/camera frame has y down, so flip the model's y
+        model = model_points * (1.0, -1.0)
+        model_mean = model.mean(axis=0)
+        observed_mean = observed.mean(axis=0)
+        m = model - model_mean
+        o = observed - observed_mean
+        dot = float(np.sum(m[:, 0] * o[:, 0] + m[:, 1] * o[:, 1]))
+        cross = float(np.sum(m[:, 0] * o[:, 1] - m[:, 1] * o[:, 0]))
+        angle = math.atan2(cross, dot)
+        scale = 1.0 if calibrated else math.hypot(dot, cross) / max(float(np.sum(m * m)), 1e-9)
+        c, s = math.cos(angle), math.sin(angle)
+        residual = o - scale * np.stack((c * m[:, 0] - s * m[:, 1], s * m[:, 0] + c * m[:, 1]), axis=1)
+        pattern_size = math.sqrt(float(np.sum(m * m)) / len(m))
+        if scale <= 0 or math.sqrt(float(np.sum(residual * residual)) / len(m)) > MAX_FIT_ERROR * scale * pattern_size:
+            return None
+        # Robot origin = where the model origin lands: observed_mean - scale * R @ model_mean
+        x = observed_mean[0] - scale * (c * model_mean[0] - s * model_mean[1])
+        y = observed_mean[1] - scale * (s * model_mean[0] + c * model_mean[1])
+        yaw = (math.degrees(angle) + 360) % 360
+
+        pose = {"tag_id": robot_id, "corners": image_points, "center": image_points.mean(axis=0),
+                "x": x, "y": y, "z": self.plane_distance if calibrated else 0, "yaw": yaw, "sent": calibrated,
+                "leds": len(image_points)}
+        if calibrated:
+            pose["text"] = f"ID:{robot_id} RX:{x:.2f} RY:{y:.2f} RZ:{pose['z']:.2f} RYaw:{yaw:.2f} deg ({len(image_points)} LEDs)"
+        else:
+            pose["text"] = f"ID:{robot_id} RX_px:{x:.2f} RY_px:{y:.2f} RYaw:{yaw:.2f} deg ({len(image_points)} LEDs, No calibration)"
+        return pose
+
+
+def draw_led_poses(frame, poses):
+    for pose in poses:
+        for point in pose["corners"]:
+            cv2.circle(frame, (int(point[0]), int(point[1])), 8, (0, 255, 0), 1)
+        cv2.putText(frame, pose["text"], (10, frame.shape[0] - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
+
+
+def load_calibration(filepath):
+    """CalibrationCache from a camCalibration2.py pickle, or None if there is no usable file."""
+    if not os.path.exists(filepath):
+        print(f"No calibration file at {filepath}: poses stay in pixels and are not published.")
+        return None
+    with open(filepath, 'rb') as f:
+        data = pickle.load(f)
+    print("Camera calibration data loaded successfully.")
+    return CalibrationCache(data['camera_matrix'], data['dist_coeffs'])
+
+
+# --- Benchmark ---
+
+def synthetic_frames(count, size=(800, 600), seed=3):
+    """Dark frames with the LED pattern of robot 1 drawn at random poses. Returns (frames, truths in pixels)."""
+    rng = np.random.default_rng(seed)
+    colours_bgr = {"blue": (255, 60, 0), "green": (0, 255, 40), "red": (0, 0, 255)}
+    pixels_per_mm = 0.5
+    frames, truths = [], []
+    for _ in range(count):
+        frame = rng.integers(0, 40, (size[1], size[0], 3), dtype=np.uint8)
+        x, y, yaw = rng.uniform(150, size[0] - 150), rng.uniform(150, size[1] - 150), rng.uniform(0, 360)
+        c, s = math.cos(math.radians(yaw)), math.sin(math.radians(yaw))
+        for colour, (mx, my) in LED_PATTERNS[1]:
+            u = x + pixels_per_mm * (c * mx - s * -my)
+            v = y + pixels_per_mm * (s * mx + c * -my)
+            cv2.circle(frame, (int(round(u)), int(round(v))), 3, colours_bgr[colour], -1)
+        frames.append(frame)
+        truths.append((x - size[0] / 2, y - size[1] / 2, yaw))
+    return frames, truths
+
+
+def time_path(frames, estimate):
+    times = []
+    detections = 0
+    for frame in frames:
+        start = time.perf_counter()
+        detections += len(estimate(frame))
+        times.append((time.perf_counter() - start) * 1000.0)
+    times.sort()
+    total = sum(times) / 1000.0
+    return len(frames) / total, times[len(times) // 2], times[int(0.95 * (len(times) - 1))], detections
+
+
+def benchmark(video=None, max_frames=300, calibration_file=CALIBRATION_FILE):
+    """Per-frame cost of the LED path vs the AprilTag path on the same frames."""
+    truths = None
+    if video:
+        capture = cv2.VideoCapture(video)
+        frames = []
+        while len(frames) < max_frames:
+            ret, frame = capture.read()
+            if not ret:
+                break
+            frames.append(frame)
+        capture.release()
+        if not frames:
+            print(f"No frames read from {video}")
+            return
+    else:
+        frames, truths = synthetic_frames(max_frames)
+    print(f"{len(frames)} frames of {frames[0].shape[1]}x{frames[0].shape[0]} from {video or 'synthetic LED scenes'}")
+
+    localizer = LedLocalizer(load_calibration(calibration_file) if video else None)
+    time_path(frames[:10], localizer.estimate_poses) # Warm-up
+    fps, p50, p95, detections = time_path(frames, localizer.estimate_poses)
+    print(f"LED:      {fps:7.1f} FPS, per frame p50 {p50:6.2f} ms p95 {p95:6.2f} ms, {detections} robot detections")
+
+    if truths:
+        errors = []
+        for frame, (tx, ty, tyaw) in zip(frames, truths):
+            poses = localizer.estimate_poses(frame)
+            if poses:
+                yaw_error = abs((poses[0]["yaw"] - tyaw + 180) % 360 - 180)
+                errors.append((math.hypot(poses[0]["x"] - tx, poses[0]["y"] - ty), yaw_error))
+        if errors:
+            errors = np.array(errors)
+            print(f"LED accuracy: {len(errors)}/{len(frames)} found, position error p50 {np.median(errors[:, 0]):.2f} px, "
+                  f"yaw error p50 {np.median(errors[:, 1]):.2f} deg")
+
+    try:
+        import AprilTagTest14 as tag_localizer
+        if os.path.exists(calibration_file):
+            tag_localizer.load_camera_calibration(calibration_file)
+        tag_localizer.initialize_apriltag_detector()
+    except ImportError as e:
+        print(f"AprilTag path skipped: {e}")
+        return
+    time_path(frames[:10], tag_localizer.estimate_tag_poses)
+    tag_fps, tag_p50, tag_p95, tag_detections = time_path(frames, tag_localizer.estimate_tag_poses)
+    print(f"AprilTag: {tag_fps:7.1f} FPS, per frame p50 {tag_p50:6.2f} ms p95 {tag_p95:6.2f} ms, {tag_detections} tag detections")
+    print(f"LED path is {fps / tag_fps:.1f}x the AprilTag path's throughput")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Coloured-LED robot localizer.")
+    parser.add_argument("--source", default=CAMERA_INDEX, help="Camera index, video file or stream URL")
+    parser.add_argument("--calibration", default=CALIBRATION_FILE)
+    parser.add_argument("--serve", action="store_true", help="Publish poses to robotDirector and other clients")
+    parser.add_argument("--port", type=int, default=POSE_PORT)
+    parser.add_argument("--show", action="store_true", help="Show the frames with the found LEDs")
+    parser.add_argument("--print-poses", action="store_true")
+    parser.add_argument("--benchmark", nargs="?", const="", default=None, metavar="VIDEO",
+                        help="Time the LED path against the AprilTag path (synthetic frames if no video)")
+    parser.add_argument("--frames", type=int, default=300, help="Frames used by --benchmark")
+    args = parser.parse_args()
+
+    if args.benchmark is not None:
+        benchmark(args.benchmark or None, args.frames, args.calibration)
+        return
+
+    localizer = LedLocalizer(load_calibration(args.calibration))
+    source = int(args.source) if isinstance(args.source, str) and args.source.isdigit() else args.source
+    capture = cv2.VideoCapture(source)
+    if not capture.isOpened():
+        print(f"Could not open {args.source}")
+        return
+    pose_server = None
+    if args.serve:
+        pose_server = PoseStreamServer(POSE_HOST, args.port)
+        pose_server.start()
+
+    frames = 0
+    last_report = time.perf_counter()
+    try:
+        while True:
+            ret, frame = capture.read()
+            if not ret:
+                print("Error: Could not read frame. Exiting.")
+                break
+            capture_ts = time.time()
+            timing = {"grab": time.monotonic()}
+            timing["detect_start"] = timing["grab"]
+            poses = localizer.estimate_poses(frame)
+            timing["detect_end"] = timing["pnp_end"] = time.monotonic() # Blob search and fit are one stage here
+            calibrated = [pose for pose in poses if pose["sent"]]
+            if pose_server and calibrated:
+                pose_server.publish(calibrated, capture_ts, timing)
+            if args.print_poses:
+                for pose in poses:
+                    print(pose["text"])
+            if args.show:
+                draw_led_poses(frame, poses)
+                cv2.imshow("LED Localizer", frame)
+                if cv2.waitKey(1) & 0xFF == ord('q'):
+                    break
+            frames += 1
+            if time.perf_counter() - last_report >= STATS_INTERVAL_S:
+                print(f"LED localizer: {frames / (time.perf_counter() - last_report):.1f} FPS")
+                frames = 0
+                last_report = time.perf_counter()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        capture.release()
+        if pose_server:
+            pose_server.stop()
+        cv2.destroyAllWindows()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,511 @@
+import argparse
+import glob
+import os
+import socket
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import cv2
+import numpy as np
+
+# Ingest for the ESP32 camera streams (gantryCamTracker/robotCam24calibrateNOINFO.ino, robotCam23mDNS.ino).
+# Each camera serves multipart/x-mixed-replace JPEGs on port 80, path "/", sent with HTTP chunked
+# encoding as: part header, JPEG, "\r\n--" + boundary + "\r\n". seeAllCams5.html re-requests all 9
+# URLs every 200 ms; here every camera gets one persistent connection instead.
+#
+# One receive thread per camera reads into a bytearray and finds part headers and boundaries in
+# place (no splitting into per-line or per-chunk bytes objects); only a finished JPEG is copied out.
+# JPEG decoding runs in a shared thread pool (cv2.imdecode releases the GIL), with at most one
+# decode in flight per camera: a JPEG that arrives while its camera is still decoding replaces the
+# waiting one, so consumers always get the newest frame and never a backlog.
+#
+#   python mjpegIngest.py watch                        # the 9 gantry cameras, stats every 5 s
+#   python mjpegIngest.py serve --cameras 9            # stand-in cameras on ports 8081..8089
+#   python mjpegIngest.py bench --cameras 9 --fps 25   # stand-ins in a subprocess + ingest, offline
+
+PART_BOUNDARY = "123456789000000000000987654321" # PART_BOUNDARY of the camera sketches
+GANTRY_CAMERAS = [f"http://camera{i}.local/" for i in range(1, 10)]
+RECV_CHUNK_BYTES = 65536
+MAX_BUFFER_BYTES = 4 * 1024 * 1024 # A stream that goes this long without a complete part has lost sync
+DECODE_WORKERS = 4
+CONNECT_TIMEOUT_S = 3.0
+RECONNECT_DELAY_S = 2.0
+STATS_INTERVAL_S = 5.0
+LATENCY_WINDOW = 200
+
+# Stand-in server
+STANDIN_BASE_PORT = 8081
+STANDIN_FPS = 25.0
+STANDIN_SIZE = (800, 600)   # SVGA, the camera sketches' frame size
+STANDIN_QUALITY = 80
+PICS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "pics")
+
+
+class MjpegStream:
+    """One persistent connection to one camera. Calls on_jpeg(camera_id, jpeg_bytes, recv_time, recv_ts)."""
+    def __init__(self, camera_id, url, on_jpeg):
+        self.camera_id = camera_id
+        self.url = url
+        self.on_jpeg = on_jpeg
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.path = parts.path or "/"
+        if parts.query:
+            self.path += "?" + parts.query
+        self.running = False
+        self.connected = False
+        self.sock = None
+        self.thread = None
+
+        self.buffer = bytearray()         # De-chunked stream bytes not parsed yet
+        self.scratch = bytearray(RECV_CHUNK_BYTES)
+        self.boundary_marker = b""
+        self.chunked = False
+        self.chunk_left = 0               # Payload bytes left in the current HTTP chunk
+        self.chunk_trailer = 0            # CRLF bytes left after the current chunk's payload
+        self.size_line = bytearray()      # Partly received chunk size line
+        self.bytes_received = 0
+        self.resyncs = 0
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.sock:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+        if self.thread:
+            self.thread.join(timeout=1.0)
+
+    def _run(self):
+        while self.running:
+            try:
+                self._connect()
+                self.connected = True
+                self._receive()
+            except (OSError, ValueError) as e:
+                if self.running:
+                    print(f"Camera {self.camera_id} ({self.url}): {e}")
+            finally:
+                self.connected = False
+                if self.sock:
+                    self.sock.close()
+                    self.sock = None
+            if self.running:
+                time.sleep(RECONNECT_DELAY_S)
+
+    def _connect(self):
+        self.sock = socket.create_connection((self.host, self.port), timeout=CONNECT_TIMEOUT_S)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1024 * 1024)
+        self.sock.sendall(f"GET {self.path} HTTP/1.1\r\nHost: {self.host}\r\nConnection: keep-alive\r\n\r\n".encode('ascii'))
+
+        # Response headers
+        self.buffer.clear()
+        while b"\r\n\r\n" not in self.buffer:
+            data = self.sock.recv(4096)
+            if not data:
+                raise ValueError("connection closed before the response headers")
+            self.buffer += data
+            if len(self.buffer) > 65536:
+                raise ValueError("response headers too long")
+        header_end = self.buffer.find(b"\r\n\r\n")
+        lines = bytes(self.buffer[:header_end]).decode('latin-1').split("\r\n")
+        if " 200 " not in lines[0] + " ":
+            raise ValueError(f"unexpected response: {lines[0]}")
+        headers = {}
+        for line in lines[1:]:
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        boundary = PART_BOUNDARY
+        content_type = headers.get("content-type", "")
+        if "boundary=" in content_type:
+            boundary = content_type.split("boundary=", 1)[1].split(";")[0].strip().strip('"')
+        self.boundary_marker = b"\r\n--" + boundary.encode('ascii')
+        self.chunked = "chunked" in headers.get("transfer-encoding", "").lower()
+        self.chunk_left = self.chunk_trailer = 0
+        self.size_line.clear()
+
+        # Whatever came after the headers is stream data
+        rest = bytes(self.buffer[header_end + 4:])
+        self.buffer.clear()
+        self._add(memoryview(rest))
+        print(f"Camera {self.camera_id}: streaming from {self.url}{' (chunked)' if self.chunked else ''}")
+
+    def _receive(self):
+        self.sock.settimeout(CONNECT_TIMEOUT_S)
+        view = memoryview(self.scratch)
+        while self.running:
+            received = self.sock.recv_into(view)
+            if not received:
+                raise ValueError("stream closed by the camera")
+            self.bytes_received += received
+            self._add(view[:received])
+
+    def _add(self, data):
+        """Appends received bytes (a memoryview) to the stream buffer, removing HTTP chunk framing, then parses."""
+        if not self.chunked:
+            self.buffer += data
+        else:
+            i = 0
+            n = len(data)
+            while i < n:
+                if self.chunk_left:
+                    take = min(self.chunk_left, n - i)
+                    self.buffer += data[i:i + take]
+                    i += take
+                    self.chunk_left -= take
+                    if not self.chunk_left:
+                        self.chunk_trailer = 2
+                elif self.chunk_trailer:
+                    take = min(self.chunk_trailer, n - i)
+                    i += take
+                    self.chunk_trailer -= take
+                else:
+                    # Chunk size line: hex digits [;extensions] CRLF
+                    j = i
+                    while j < n and data[j] != 0x0A:
+                        j += 1
+                    self.size_line += data[i:j]
+                    if j == n:
+                        break
+                    i = j + 1
+                    size = int(bytes(self.size_line).split(b";")[0].strip() or b"0", 16)
+                    self.size_line.clear()
+                    if size == 0:
+                        raise ValueError("stream ended (last chunk)")
+                    self.chunk_left = size
+        self._parse_parts()
+
+    def _parse_parts(self):
+        """Hands every complete JPEG in the buffer to on_jpeg, then drops the consumed bytes."""
+        buffer = self.buffer
+        pos = 0
+        while True:
+            # Part headers, possibly preceded by the boundary line (the sketches send it after each JPEG)
+            header_end = buffer.find(b"\r\n\r\n", pos)
+            if header_end < 0:
+                break
+            body_start = header_end + 4
+            length_at = buffer.find(b"Content-Length:", pos, header_end)
+            if length_at < 0:
+                length_at = buffer.find(b"content-length:", pos, header_end)
+            if length_at >= 0:
+                line_end = buffer.find(b"\r\n", length_at, body_start)
+                body_end = body_start + int(buffer[length_at + 15:line_end])
+                if len(buffer) < body_end:
+                    break
+            else:
+                body_end = buffer.find(self.boundary_marker, body_start) # No length: the body ends at the boundary
+                if body_end < 0:
+                    break
+            recv_time = time.perf_counter()
+            self.on_jpeg(self.camera_id, bytes(buffer[body_start:body_end]), recv_time, time.time()) # The one copy
+            pos = body_end
+        if pos:
+            del buffer[:pos]
+        if len(buffer) > MAX_BUFFER_BYTES:
+            self.resyncs += 1
+            buffer.clear()
+
+
+class _CameraState:
+    __slots__ = ("stream", "decoding", "pending", "frame", "frame_id", "received", "decoded", "skipped",
+                 "failed", "decode_ms", "latency_ms")
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.decoding = False   # A decode of this camera is in the pool
+        self.pending = None     # Newest JPEG waiting for that decode to finish; replaced, never queued
+        self.frame = None       # (frame_id, recv_time, recv_ts, image) of the newest decoded frame
+        self.frame_id = 0
+        self.received = 0
+        self.decoded = 0
+        self.skipped = 0        # JPEGs replaced before they could be decoded
+        self.failed = 0
+        self.decode_ms = deque(maxlen=LATENCY_WINDOW)
+        self.latency_ms = deque(maxlen=LATENCY_WINDOW) # Last byte received -> frame decoded
+
+
+class MjpegIngest:
+    """
+    Persistent MJPEG connections to several cameras with pooled decoding.
+    cameras is {camera_id: url} (or a list of urls, numbered from 0).
+    """
+    def __init__(self, cameras, decode_workers=DECODE_WORKERS):
+        if not isinstance(cameras, dict):
+            cameras = dict(enumerate(cameras))
+        self.condition = threading.Condition()
+        self.cameras = {camera_id: _CameraState(MjpegStream(camera_id, url, self._on_jpeg))
+                        for camera_id, url in cameras.items()}
+        self.pool = ThreadPoolExecutor(max_workers=decode_workers, thread_name_prefix="mjpeg-decode")
+
+    def start(self):
+        for state in self.cameras.values():
+            state.stream.start()
+
+    def stop(self):
+        for state in self.cameras.values():
+            state.stream.stop()
+        self.pool.shutdown(wait=True)
+        with self.condition:
+            self.condition.notify_all()
+
+    def _on_jpeg(self, camera_id, jpeg, recv_time, recv_ts):
+        """Receive thread: start a decode now, or park the JPEG as this camera's newest pending one."""
+        state = self.cameras[camera_id]
+        with self.condition:
+            state.received += 1
+            if state.decoding:
+                if state.pending is not None:
+                    state.skipped += 1
+                state.pending = (jpeg, recv_time, recv_ts)
+                return
+            state.decoding = True
+        self.pool.submit(self._decode, camera_id, jpeg, recv_time, recv_ts)
+
+    def _decode(self, camera_id, jpeg, recv_time, recv_ts):
+        state = self.cameras[camera_id]
+        while True:
+            start = time.perf_counter()
+            image = cv2.imdecode(np.frombuffer(jpeg, dtype=np.uint8), cv2.IMREAD_COLOR) # Reads the bytes in place
+            done = time.perf_counter()
+            with self.condition:
+                if image is None:
+                    state.failed += 1
+                else:
+                    state.frame_id += 1
+                    state.frame = (state.frame_id, recv_time, recv_ts, image)
+                    state.decoded += 1
+                    state.decode_ms.append((done - start) * 1000.0)
+                    state.latency_ms.append((done - recv_time) * 1000.0)
+                    self.condition.notify_all()
+                if state.pending is None:
+                    state.decoding = False
+                    return
+                jpeg, recv_time, recv_ts = state.pending # Go straight on with the newest waiting JPEG
+                state.pending = None
+
+    def get_frame(self, camera_id, last_id=0, timeout=1.0):
+        """
+        Waits for a frame of camera_id newer than last_id.
+        Returns (frame_id, (frame_id, recv_time, recv_ts, image)), or (last_id, None) on timeout.
+        """
+        state = self.cameras[camera_id]
+        deadline = time.perf_counter() + timeout
+        with self.condition:
+            while state.frame is None or state.frame[0] == last_id:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    return last_id, None
+                self.condition.wait(remaining)
+            return state.frame[0], state.frame
+
+    def latest(self, camera_id):
+        """Newest decoded frame of a camera without waiting, or None."""
+        with self.condition:
+            return self.cameras[camera_id].frame
+
+    def report(self, elapsed):
+        """One stats line per camera since the last report; resets the counters."""
+        lines = []
+        with self.condition:
+            for camera_id, state in self.cameras.items():
+                decode = sorted(state.decode_ms)
+                latency = sorted(state.latency_ms)
+                line = (f"Cam {camera_id}: {'up' if state.stream.connected else 'down'}, "
+                        f"received {state.received / elapsed:5.1f} FPS, decoded {state.decoded / elapsed:5.1f} FPS, "
+                        f"skipped {state.skipped}, failed {state.failed}, "
+                        f"{state.stream.bytes_received / elapsed / 1e6:.2f} MB/s")
+                if latency:
+                    line += (f", decode {decode[len(decode) // 2]:.1f} ms, "
+                             f"receive->frame p50 {latency[len(latency) // 2]:.1f} ms p95 {latency[int(0.95 * (len(latency) - 1))]:.1f} ms")
+                lines.append(line)
+                state.received = state.decoded = state.skipped = state.failed = 0
+                state.stream.bytes_received = 0
+        return lines
+
+
+class MjpegCapture:
+    """cv2.VideoCapture-style reader of one camera of a shared MjpegIngest (for multiCamLocalizer)."""
+    def __init__(self, ingest, camera_id, timeout=RECONNECT_DELAY_S * 2):
+        self.ingest = ingest
+        self.camera_id = camera_id
+        self.timeout = timeout
+        self.last_id = 0
+        self.last_frame = None # (frame_id, recv_time, recv_ts, image) returned by the last read()
+
+    def isOpened(self):
+        return True # The ingest keeps reconnecting on its own
+
+    def read(self):
+        self.last_id, item = self.ingest.get_frame(self.camera_id, self.last_id, self.timeout)
+        if item is None:
+            return False, None
+        self.last_frame = item
+        return True, item[3]
+
+    def release(self):
+        pass
+
+
+# --- Stand-in camera server ---
+
+def load_standin_frames(pattern=None, size=STANDIN_SIZE, quality=STANDIN_QUALITY, limit=20):
+    """JPEGs for the stand-in cameras: pics/*.jpg scaled to the camera frame size, or a test pattern."""
+    paths = sorted(glob.glob(pattern or os.path.join(PICS_DIR, "*.jpg")))[:limit]
+    frames = []
+    for path in paths:
+        image = cv2.imread(path)
+        if image is None:
+            continue
+        ok, jpeg = cv2.imencode(".jpg", cv2.resize(image, size), [cv2.IMWRITE_JPEG_QUALITY, quality])
+        if ok:
+            frames.append(jpeg.tobytes())
+    if not frames:
+        for i in range(10):
+            image = np.zeros((size[1], size[0], 3), dtype=np.uint8)
+            cv2.circle(image, (size[0] // 2 + 20 * i, size[1] // 2), 60, (0, 0, 255), -1)
+            frames.append(cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, quality])[1].tobytes())
+    return frames
+
+
+def _serve_client(client, frames, fps):
+    """Streams to one client the way the camera sketch does: chunked, part header, JPEG, boundary."""
+    def chunk(data):
+        client.sendall(b"%X\r\n" % len(data) + data + b"\r\n")
+    try:
+        request = b""
+        while b"\r\n\r\n" not in request:
+            data = client.recv(4096)
+            if not data:
+                return
+            request += data
+        client.sendall(("HTTP/1.1 200 OK\r\n"
+                        f"Content-Type: multipart/x-mixed-replace;boundary={PART_BOUNDARY}\r\n"
+                        "Transfer-Encoding: chunked\r\n"
+                        "Access-Control-Allow-Origin: *\r\n\r\n").encode('ascii'))
+        boundary = f"\r\n--{PART_BOUNDARY}\r\n".encode('ascii')
+        interval = 1.0 / fps
+        next_time = time.perf_counter()
+        index = 0
+        while True:
+            jpeg = frames[index % len(frames)]
+            index += 1
+            chunk(b"Content-Type: image/jpeg\r\nContent-Length: %u\r\n\r\n" % len(jpeg))
+            chunk(jpeg)
+            chunk(boundary)
+            next_time += interval
+            delay = next_time - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_time = time.perf_counter() # Can't keep up: don't try to catch up with a burst
+    except OSError:
+        pass
+    finally:
+        client.close()
+
+
+def serve_standin(cameras=9, base_port=STANDIN_BASE_PORT, fps=STANDIN_FPS, pattern=None, ready=None):
+    """Runs stand-in cameras on base_port .. base_port + cameras - 1, path "/". Blocks."""
+    frames = load_standin_frames(pattern)
+    listeners = []
+    for i in range(cameras):
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind(("127.0.0.1", base_port + i))
+        listener.listen(4)
+        listeners.append(listener)
+
+    def accept_loop(listener):
+        while True:
+            client, _ = listener.accept()
+            client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            threading.Thread(target=_serve_client, args=(client, frames, fps), daemon=True).start()
+
+    for listener in listeners:
+        threading.Thread(target=accept_loop, args=(listener,), daemon=True).start()
+    print(f"{cameras} stand-in cameras on http://127.0.0.1:{base_port}/ .. :{base_port + cameras - 1}/, "
+          f"{fps:.0f} FPS, {len(frames)} frames of ~{sum(map(len, frames)) // len(frames) // 1024} KB")
+    if ready is not None:
+        ready.set()
+    while True:
+        time.sleep(1)
+
+
+def watch(urls, decode_workers, seconds=None):
+    """Ingests the given cameras and prints stats every STATS_INTERVAL_S (for seconds, or until Ctrl+C)."""
+    ingest = MjpegIngest(urls, decode_workers)
+    ingest.start()
+    start = last_report = time.perf_counter()
+    cpu_start = time.process_time()
+    try:
+        while seconds is None or time.perf_counter() - start < seconds:
+            time.sleep(0.2)
+            now = time.perf_counter()
+            if now - last_report >= STATS_INTERVAL_S:
+                for line in ingest.report(now - last_report):
+                    print(line)
+                last_report = now
+    except KeyboardInterrupt:
+        pass
+    finally:
+        elapsed = time.perf_counter() - start
+        if time.perf_counter() - last_report >= 1.0: # Stats of the partial last interval
+            for line in ingest.report(time.perf_counter() - last_report):
+                print(line)
+        print(f"CPU: {(time.process_time() - cpu_start) / elapsed * 100:.0f}% of one core over {elapsed:.1f} s")
+        ingest.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Persistent MJPEG ingest for the ESP32 cameras.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    wat = sub.add_parser("watch", help="Ingest camera streams and print per-camera stats")
+    wat.add_argument("urls", nargs="*", default=GANTRY_CAMERAS)
+    wat.add_argument("--decoders", type=int, default=DECODE_WORKERS)
+
+    srv = sub.add_parser("serve", help="Run stand-in MJPEG cameras (ESP32 stream format)")
+    srv.add_argument("--cameras", type=int, default=9)
+    srv.add_argument("--port", type=int, default=STANDIN_BASE_PORT)
+    srv.add_argument("--fps", type=float, default=STANDIN_FPS)
+    srv.add_argument("--pictures", default=None, help="Glob of JPEGs to stream (default ../pics/*.jpg)")
+
+    ben = sub.add_parser("bench", help="Stand-in cameras in a subprocess, ingested here")
+    ben.add_argument("--cameras", type=int, default=9)
+    ben.add_argument("--port", type=int, default=STANDIN_BASE_PORT)
+    ben.add_argument("--fps", type=float, default=STANDIN_FPS)
+    ben.add_argument("--seconds", type=float, default=10.0)
+    ben.add_argument("--decoders", type=int, default=DECODE_WORKERS)
+    ben.add_argument("--pictures", default=None)
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        serve_standin(args.cameras, args.port, args.fps, args.pictures)
+    elif args.command == "watch":
+        watch(args.urls, args.decoders)
+    else:
+        import multiprocessing
+        ready = multiprocessing.Event()
+        server = multiprocessing.Process(target=serve_standin, args=(args.cameras, args.port, args.fps, args.pictures, ready),
+                                         daemon=True)
+        server.start()
+        ready.wait(30)
+        try:
+            watch([f"http://127.0.0.1:{args.port + i}/" for i in range(args.cameras)], args.decoders, args.seconds)
+        finally:
+            server.terminate()
+
+
+if __name__ == "__main__":
+    main()
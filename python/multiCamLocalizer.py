@@ -0,0 +1,320 @@
+import argparse
+import os
+import queue
+import threading
+import time
+import multiprocessing
+from multiprocessing import shared_memory
+from collections import deque
+
+import cv2
+import numpy as np
+
+from mjpegIngest import MjpegCapture, MjpegIngest
+from poseFusion import PoseFusion, load_extrinsics
+from poseStream import POSE_PORT, PoseStreamServer
+
+# Multi-camera AprilTag localizer for the gantry (9 ESP32 cameras, see gantryCamTracker/seeAllCams5.html).
+# One capture thread per camera copies the newest frame into that camera's shared-memory slots and
+# queues a small task; a pool of detector processes reads the frame straight out of shared memory
+# (no pickling of images) and returns the poses. A gather loop in the main process collects the
+# per-camera results with their capture timestamps.
+#
+#   python multiCamLocalizer.py                                   # the 9 gantry cameras
+#   python multiCamLocalizer.py 0 1 ../vids/3WheelsBothNoSoda.mp4 --workers 3
+
+GANTRY_CAMERAS = [f"http://camera{i}.local/" for i in range(1, 10)] # ESP32-CAM MJPEG streams
+SLOTS_PER_CAMERA = 2        # Frames of one camera that can be in the pool at once; newer frames are dropped
+STATS_INTERVAL_S = 5.0
+LATENCY_WINDOW = 200
+RECONNECT_DELAY_S = 2.0     # Wait before reopening a camera that stopped delivering
+TASK_STOP = None            # Sent once per worker to shut the pool down
+FUSION_HOLD_S = 0.1         # Fuse a moment only once every camera has had this long to report it
+
+
+# --- Worker Process ---
+_worker_segments = {} # Shared memory name -> SharedMemory, attached once per worker
+
+
+def _worker_main(task_queue, result_queue, calibration_file):
+    """Detector process: takes (camera, slot) tasks, reads the frame from shared memory, returns poses."""
+    import AprilTagTest14 as localizer # Imported here so every spawned process builds its own detector
+    if calibration_file and os.path.exists(calibration_file):
+        localizer.load_camera_calibration(calibration_file)
+    localizer.initialize_apriltag_detector(nthreads=1) # Parallelism comes from the processes
+
+    while True:
+        task = task_queue.get()
+        if task is TASK_STOP:
+            break
+        camera_id, shm_name, slot, shape, frame_id, capture_time, capture_ts, queued_time = task
+        start = time.perf_counter()
+        segment = _worker_segments.get(shm_name)
+        if segment is None:
+            segment = shared_memory.SharedMemory(name=shm_name)
+            _worker_segments[shm_name] = segment
+        frame_bytes = shape[0] * shape[1] * shape[2]
+        frame = np.ndarray(shape, dtype=np.uint8, buffer=segment.buf, offset=slot * frame_bytes) # No copy
+        try:
+            poses = localizer.estimate_tag_poses(frame)
+        except (ValueError, cv2.error) as e:
+            print(f"[Worker {os.getpid()}] camera {camera_id}: {e}")
+            poses = []
+        del frame # Release the view before the segment can be closed
+        results = [{"tag_id": int(p["tag_id"]), "x": float(p["x"]), "y": float(p["y"]), "z": float(p["z"]),
+                    "yaw": float(p["yaw"]), "calibrated": p["sent"],
+                    "corners": np.asarray(p["corners"], dtype=np.float32).tolist()} for p in poses]
+        result_queue.put((camera_id, slot, frame_id, capture_time, capture_ts, queued_time,
+                          start, time.perf_counter(), results))
+
+    for segment in _worker_segments.values():
+        segment.close()
+
+
+# --- Per-camera state in the main process ---
+class CameraFeed:
+    """Capture thread plus the shared-memory slots and statistics of one camera."""
+    def __init__(self, camera_id, source, task_queue, ingest=None):
+        self.camera_id = camera_id
+        self.source = int(source) if isinstance(source, str) and source.isdigit() else source
+        self.task_queue = task_queue
+        self.ingest = ingest # Shared MjpegIngest for camera streams; None reads through cv2.VideoCapture
+        self.shm = None
+        self.shape = None
+        self.free_slots = deque()
+        self.lock = threading.Lock()
+        self.running = False
+        self.thread = None
+
+        # Statistics, reset every report
+        self.captured = 0
+        self.processed = 0
+        self.dropped = 0
+        self.queue_lag_ms = deque(maxlen=LATENCY_WINDOW)  # Task queued -> worker starts on it
+        self.latency_ms = deque(maxlen=LATENCY_WINDOW)    # Frame captured -> poses back in this process
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._capture_loop, daemon=True)
+        self.thread.start()
+
+    def _allocate(self, shape):
+        """Creates the shared-memory slots the first time the frame size is known."""
+        frame_bytes = shape[0] * shape[1] * shape[2]
+        self.shm = shared_memory.SharedMemory(create=True, size=frame_bytes * SLOTS_PER_CAMERA)
+        self.shape = shape
+        self.frame_bytes = frame_bytes
+        self.free_slots.extend(range(SLOTS_PER_CAMERA))
+        print(f"Camera {self.camera_id}: {shape[1]}x{shape[0]}, {SLOTS_PER_CAMERA} shared slots")
+
+    def _capture_loop(self):
+        while self.running:
+            capture = MjpegCapture(self.ingest, self.camera_id) if self.ingest else cv2.VideoCapture(self.source)
+            if not capture.isOpened():
+                print(f"Camera {self.camera_id}: could not open {self.source}, retrying...")
+                time.sleep(RECONNECT_DELAY_S)
+                continue
+            while self.running:
+                ret, frame = capture.read()
+                if not ret:
+                    print(f"Camera {self.camera_id}: stream ended")
+                    break
+                capture_time = time.perf_counter()
+                capture_ts = time.time() # Wall clock for consumers in other processes/machines
+                if self.ingest:
+                    _, capture_time, capture_ts, _ = capture.last_frame # When the JPEG arrived, before decoding
+                self.captured += 1
+                if self.shm is None:
+                    self._allocate(frame.shape)
+                elif frame.shape != self.shape:
+                    self.dropped += 1 # Resolution changed under us; slots are sized for the first one
+                    continue
+
+                with self.lock:
+                    slot = self.free_slots.popleft() if self.free_slots else None
+                if slot is None:
+                    self.dropped += 1 # Every slot is still being worked on: skip, a newer frame comes next
+                    continue
+                target = np.ndarray(self.shape, dtype=np.uint8, buffer=self.shm.buf, offset=slot * self.frame_bytes)
+                target[...] = frame # One memcpy, then only a small tuple goes through the queue
+                del target
+                self.task_queue.put((self.camera_id, self.shm.name, slot, self.shape, self.captured,
+                                     capture_time, capture_ts, time.perf_counter()))
+            capture.release()
+            if self.running and isinstance(self.source, str) and not self.source.startswith("http"):
+                break # A video file that ended stays ended
+            time.sleep(RECONNECT_DELAY_S)
+
+    def release_slot(self, slot):
+        with self.lock:
+            self.free_slots.append(slot)
+
+    def stop(self):
+        self.running = False
+        if self.thread:
+            self.thread.join(timeout=2.0)
+
+    def close(self):
+        if self.shm:
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+
+    def report(self, elapsed):
+        lag = sorted(self.queue_lag_ms)
+        latency = sorted(self.latency_ms)
+        line = (f"Cam {self.camera_id}: capture {self.captured / elapsed:5.1f} FPS, "
+                f"detect {self.processed / elapsed:5.1f} FPS, dropped {self.dropped}")
+        if latency:
+            line += (f", queue lag {sum(lag) / len(lag):5.1f} ms, latency avg {sum(latency) / len(latency):6.1f} ms"
+                     f" p95 {latency[int(0.95 * (len(latency) - 1))]:6.1f} ms")
+        self.captured = self.processed = self.dropped = 0
+        return line
+
+
+class MultiCamLocalizer:
+    """Fans frames from several cameras out to a pool of detector processes and gathers the poses."""
+    def __init__(self, sources, workers=None, calibration_file=None, on_result=None, on_tick=None, use_ffmpeg=False):
+        self.context = multiprocessing.get_context("spawn") # Same behaviour on Windows and Linux, no forked threads
+        self.task_queue = self.context.Queue()
+        self.result_queue = self.context.Queue()
+        self.workers = workers or max(1, (os.cpu_count() or 2) - 1) # Leave a core for capture and gathering
+        self.calibration_file = calibration_file
+        self.on_result = on_result # Called as on_result(camera_id, capture_ts, poses) from the gather loop
+        self.on_tick = on_tick # Called after every gather step (fusion flushes from here)
+        # Camera streams share one MJPEG ingest (persistent connections, pooled JPEG decoding)
+        streams = {i: source for i, source in enumerate(sources)
+                   if isinstance(source, str) and source.startswith("http") and not use_ffmpeg}
+        self.ingest = MjpegIngest(streams) if streams else None
+        self.feeds = [CameraFeed(i, source, self.task_queue, self.ingest if i in streams else None)
+                      for i, source in enumerate(sources)]
+        self.processes = []
+        self.running = False
+
+    def start(self):
+        self.running = True
+        for _ in range(self.workers):
+            process = self.context.Process(target=_worker_main,
+                                           args=(self.task_queue, self.result_queue, self.calibration_file),
+                                           daemon=True)
+            process.start()
+            self.processes.append(process)
+        if self.ingest:
+            self.ingest.start()
+        for feed in self.feeds:
+            feed.start()
+        print(f"Multi-camera localizer: {len(self.feeds)} cameras, {self.workers} detector processes")
+
+    def run(self):
+        """Gather loop: collects results, frees slots, prints per-camera stats. Blocks until stop()."""
+        last_report = time.perf_counter()
+        while self.running:
+            try:
+                result = self.result_queue.get(timeout=0.2)
+            except queue.Empty:
+                result = None
+            if result is not None:
+                camera_id, slot, frame_id, capture_time, capture_ts, queued_time, start, end, poses = result
+                feed = self.feeds[camera_id]
+                feed.release_slot(slot)
+                feed.processed += 1
+                # perf_counter is a system-wide monotonic clock, so worker and main process times compare
+                feed.queue_lag_ms.append((start - queued_time) * 1000.0)
+                feed.latency_ms.append((time.perf_counter() - capture_time) * 1000.0)
+                if self.on_result and poses:
+                    self.on_result(camera_id, capture_ts, poses)
+            if self.on_tick:
+                self.on_tick()
+
+            now = time.perf_counter()
+            if now - last_report >= STATS_INTERVAL_S:
+                elapsed = now - last_report
+                total = sum(feed.processed for feed in self.feeds)
+                for feed in self.feeds:
+                    print(feed.report(elapsed))
+                in_flight = sum(SLOTS_PER_CAMERA - len(feed.free_slots) for feed in self.feeds if feed.shm)
+                print(f"Total: {total / elapsed:.1f} frames/s over {self.workers} processes, {in_flight} frames in flight")
+                last_report = now
+
+    def stop(self):
+        self.running = False
+        for feed in self.feeds:
+            feed.stop()
+        if self.ingest:
+            self.ingest.stop()
+        for _ in self.processes:
+            self.task_queue.put(TASK_STOP)
+        for process in self.processes:
+            process.join(timeout=2.0)
+            if process.is_alive():
+                process.terminate()
+        for feed in self.feeds:
+            feed.close() # Unlink the shared memory only after the workers let go of it
+
+
+def print_poses(camera_id, capture_ts, poses):
+    for pose in poses:
+        print(f"Cam {camera_id} ID:{pose['tag_id']} X:{pose['x']:.2f} Y:{pose['y']:.2f} Yaw:{pose['yaw']:.2f}")
+
+
+class FusedOutput:
+    """Feeds per-camera results into PoseFusion and prints and/or publishes the world-frame poses."""
+    def __init__(self, fusion, print_poses=False, pose_server=None):
+        self.fusion = fusion
+        self.print_poses = print_poses
+        self.pose_server = pose_server
+        self.latest = {} # tag_id -> newest fused pose
+
+    def on_result(self, camera_id, capture_ts, poses):
+        self.fusion.add(camera_id, capture_ts, poses)
+
+    def on_tick(self):
+        for pose in self.fusion.flush(before_ts=time.time() - FUSION_HOLD_S):
+            self.latest[pose["tag_id"]] = pose
+            if self.pose_server:
+                self.pose_server.publish([pose], pose["ts"])
+            if self.print_poses:
+                print(f"World ID:{pose['tag_id']} X:{pose['x']:.1f} Y:{pose['y']:.1f} Yaw:{pose['yaw']:.1f} "
+                      f"+-{pose['sigma_mm']:.1f} mm from {pose['cameras']} camera(s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="AprilTag localizer over several cameras with a detector process pool.")
+    parser.add_argument("sources", nargs="*", default=GANTRY_CAMERAS, help="Camera indices, video files or stream URLs")
+    parser.add_argument("--workers", type=int, default=None, help="Detector processes (default: cores - 1)")
+    parser.add_argument("--calibration", default="camera_calibration_data.pkl")
+    parser.add_argument("--print-poses", action="store_true")
+    parser.add_argument("--extrinsics", default=None, help="Camera-to-world JSON (see poseFusion.py) to fuse into world poses")
+    parser.add_argument("--serve", action="store_true", help="Publish the fused world poses on the pose stream (needs --extrinsics)")
+    parser.add_argument("--port", type=int, default=POSE_PORT)
+    parser.add_argument("--ffmpeg", action="store_true", help="Read stream URLs through cv2.VideoCapture instead of mjpegIngest")
+    args = parser.parse_args()
+
+    pose_server = None
+    if args.serve and args.extrinsics:
+        pose_server = PoseStreamServer(port=args.port)
+        pose_server.start()
+    elif args.serve:
+        print("--serve needs --extrinsics: per-camera poses are in different frames")
+    if args.extrinsics:
+        output = FusedOutput(PoseFusion(load_extrinsics(args.extrinsics)), print_poses=args.print_poses,
+                             pose_server=pose_server)
+        on_result, on_tick = output.on_result, output.on_tick
+    else:
+        on_result, on_tick = (print_poses if args.print_poses else None), None
+    localizer = MultiCamLocalizer(args.sources, workers=args.workers, calibration_file=args.calibration,
+                                  on_result=on_result, on_tick=on_tick, use_ffmpeg=args.ffmpeg)
+    localizer.start()
+    try:
+        localizer.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        localizer.stop()
+        if pose_server:
+            pose_server.stop()
+        print("Multi-camera localizer stopped.")
+
+
+if __name__ == "__main__":
+    main()
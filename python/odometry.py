@@ -0,0 +1,198 @@
+import math
+import threading
+import time
+from collections import deque
+
+from closedLoopFollower import HEADING_OFFSET_DEG, wrap_degrees
+from omniKinematics import body_velocity
+
+# Dead-reckoning pose between camera fixes. Every velocity command is stamped when it is written to
+# the serial bridge and turned into the robot-frame velocity the wheels actually deliver
+# (omniKinematics: the firmware's scale factor, rotation factor and step delay clamping). pose()
+# integrates those piecewise-constant velocities from the last corrected pose to now, so a
+# controller or the display gets a fresh pose at any rate instead of one per camera frame.
+#
+# A localizer fix is for its capture time, which is already in the past when it arrives: the
+# estimate is integrated to the capture time, pulled toward the fix there, and everything after
+# is re-integrated from the corrected pose on the next pose() call.
+#
+# Times are wall clock (time.time()), the same clock as the pose stream's capture_ts and PoseFilterBank.
+
+COMMAND_LATENCY_S = 0.015   # Serial write -> wheels at the new rate (bridge + radio + firmware loop)
+FIX_GAIN = 0.5              # Share of a fix's position innovation applied to the estimate
+YAW_FIX_GAIN = 0.3          # The same for yaw (detection yaw is noisier than position)
+OUTLIER_MM = 50.0           # Fixes further than this from the estimate are rejected...
+MAX_CONSECUTIVE_OUTLIERS = 5  # ...until this many in a row: then the robot was moved, restart from the fix
+MAX_EXTRAPOLATE_S = 1.0     # No fix for this long: pose() returns None
+INNOVATION_WINDOW = 100     # Fixes kept for the correction statistic
+MAX_COMMANDS = 2048         # Command history bound for when fixes stop coming (about a minute of commands)
+
+
+def advance(x, y, yaw, vx, vy, omega, dt):
+    """Pose after dt seconds at constant robot-frame velocity (mm/s, mm/s, deg/s), integrated exactly."""
+    theta0 = math.radians(yaw - HEADING_OFFSET_DEG)
+    turn = math.radians(omega) * dt
+    if abs(turn) < 1e-6:
+        c = math.cos(theta0 + turn * 0.5) * dt
+        s = math.sin(theta0 + turn * 0.5) * dt
+    else:
+        # Integrals of cos and sin of the heading over the interval
+        w = turn / dt
+        c = (math.sin(theta0 + turn) - math.sin(theta0)) / w
+        s = (math.cos(theta0) - math.cos(theta0 + turn)) / w
+    return x + vx * c - vy * s, y + vx * s + vy * c, (yaw + omega * dt) % 360.0
+
+
+class OdometryEstimator:
+    """
+    command() from the thread that writes to serial, fix() from the pose stream thread, pose() from
+    anywhere. velocity_model(x, y, r) maps a command (m/s, m/s, rev/s) to the delivered robot-frame
+    (mm/s, mm/s, deg/s); velocityCalibration's table can stand in for the firmware model.
+    """
+    def __init__(self, velocity_model=body_velocity, command_latency=COMMAND_LATENCY_S, fix_gain=FIX_GAIN,
+                 yaw_fix_gain=YAW_FIX_GAIN):
+        self.velocity_model = velocity_model
+        self.command_latency = command_latency
+        self.fix_gain = fix_gain
+        self.yaw_fix_gain = yaw_fix_gain
+        self.lock = threading.Lock()
+        self.commands = deque(maxlen=MAX_COMMANDS) # (effective_ts, vx, vy, omega), in time order
+        self.anchor = None      # (ts, x, y, yaw): last corrected pose
+        self.last_fix_ts = None
+
+        # Counters
+        self.fixes = 0
+        self.rejected = 0
+        self.resets = 0
+        self.late = 0
+        self.outliers_in_row = 0
+        self.innovations_mm = deque(maxlen=INNOVATION_WINDOW) # Estimate-to-fix distance of accepted fixes
+
+    def command(self, command, sent_ts=None):
+        """A command dict as written to the serial bridge ("x", "y" m/s, "rotation" rev/s), stamped when written."""
+        vx, vy, omega = self.velocity_model(command["x"], command["y"], command["rotation"])
+        effective = (time.time() if sent_ts is None else sent_ts) + self.command_latency
+        with self.lock:
+            if self.anchor is None:
+                self.commands.clear() # Nothing to integrate from yet: only the command in force matters
+            self.commands.append((effective, float(vx), float(vy), float(omega)))
+
+    def _integrate(self, ts, x, y, yaw, end):
+        """Pose at time end, from (x, y, yaw) at time ts, through the commands in between."""
+        vx = vy = omega = 0.0
+        for t, cvx, cvy, comega in self.commands:
+            if t > end:
+                break
+            if t > ts:
+                x, y, yaw = advance(x, y, yaw, vx, vy, omega, t - ts)
+                ts = t
+            vx, vy, omega = cvx, cvy, comega # Velocity in force from t on
+        if end > ts:
+            x, y, yaw = advance(x, y, yaw, vx, vy, omega, end - ts)
+        return x, y, yaw
+
+    def _prune(self):
+        # Keep the command in force at the anchor time and everything after it
+        while len(self.commands) > 1 and self.commands[1][0] <= self.anchor[0]:
+            self.commands.popleft()
+
+    def fix(self, x, y, yaw, capture_ts):
+        """A localizer pose of the robot (mm, deg) captured at capture_ts."""
+        with self.lock:
+            if self.anchor is None:
+                self.anchor = (capture_ts, x, y, yaw)
+                self.last_fix_ts = capture_ts
+                self.fixes += 1
+                return
+            if capture_ts <= self.anchor[0]:
+                self.late += 1 # Older than the pose it would correct: out-of-order delivery
+                return
+            ex, ey, eyaw = self._integrate(*self.anchor, capture_ts)
+            dx, dy = x - ex, y - ey
+            innovation = math.hypot(dx, dy)
+            if innovation > OUTLIER_MM:
+                self.rejected += 1
+                self.outliers_in_row += 1
+                if self.outliers_in_row < MAX_CONSECUTIVE_OUTLIERS:
+                    return
+                self.resets += 1
+                self.anchor = (capture_ts, x, y, yaw)
+            else:
+                self.anchor = (capture_ts, ex + self.fix_gain * dx, ey + self.fix_gain * dy,
+                               (eyaw + self.yaw_fix_gain * wrap_degrees(yaw - eyaw)) % 360.0)
+                self.innovations_mm.append(innovation)
+            self.outliers_in_row = 0
+            self.last_fix_ts = capture_ts
+            self.fixes += 1
+            self._prune()
+
+    def pose(self, now=None):
+        """(x, y, yaw) at time now (default: now), or None without a recent fix."""
+        if now is None:
+            now = time.time()
+        with self.lock:
+            if self.anchor is None or now - self.last_fix_ts > MAX_EXTRAPOLATE_S:
+                return None
+            return self._integrate(*self.anchor, now)
+
+    def stats_line(self):
+        with self.lock:
+            innovations = list(self.innovations_mm)
+        line = f"Odometry: {self.fixes} fixes, {self.rejected} rejected, {self.resets} resets"
+        if innovations:
+            innovations.sort()
+            line += (f", estimate off by {innovations[len(innovations) // 2]:.1f} mm (p50) / "
+                     f"{innovations[int(0.95 * (len(innovations) - 1))]:.1f} mm (p95) at each fix")
+        return line
+
+
+def benchmark(seconds=10.0, command_hz=33.0, camera_fps=30.0, camera_delay=0.08, noise_mm=1.0):
+    """
+    Drives a circle with a model mismatch (the real robot 5 % faster than the model) and compares
+    the odometry pose and the last raw fix against the truth at a 200 Hz control tick.
+    """
+    import random
+    rng = random.Random(0)
+    estimator = OdometryEstimator()
+    x = y = yaw = 0.0
+    dt = 0.005
+    fixes = deque()
+    last_fix = None
+    odometry_errors, fix_errors = [], []
+    command = {"x": 0.0, "y": 0.0, "rotation": 0.0}
+    next_command = next_capture = 0.0
+    t0 = 1000.0
+    start = time.perf_counter()
+    for i in range(int(seconds / dt)):
+        t = t0 + i * dt
+        if t - t0 >= next_command:
+            phase = (t - t0) * 0.5
+            command = {"x": 0.08 * math.cos(phase), "y": 0.08 * math.sin(phase), "rotation": 0.02}
+            estimator.command(command, t)
+            next_command += 1.0 / command_hz
+        vx, vy, omega = body_velocity(command["x"], command["y"], command["rotation"])
+        if t - t0 >= COMMAND_LATENCY_S:
+            x, y, yaw = advance(x, y, yaw, float(vx) * 1.05, float(vy) * 1.05, float(omega), dt)
+        if t - t0 >= next_capture:
+            fixes.append((t + camera_delay, x + rng.gauss(0, noise_mm), y + rng.gauss(0, noise_mm), yaw, t))
+            next_capture += 1.0 / camera_fps
+        while fixes and fixes[0][0] <= t:
+            _, fx, fy, fyaw, capture = fixes.popleft()
+            estimator.fix(fx, fy, fyaw, capture)
+            last_fix = (fx, fy)
+        pose = estimator.pose(t)
+        if pose and last_fix:
+            odometry_errors.append(math.hypot(pose[0] - x, pose[1] - y))
+            fix_errors.append(math.hypot(last_fix[0] - x, last_fix[1] - y))
+    elapsed = time.perf_counter() - start
+    odometry_errors.sort()
+    fix_errors.sort()
+    p = lambda values, q: values[int(q * (len(values) - 1))]
+    print(f"{len(odometry_errors)} control ticks at {1 / dt:.0f} Hz, {elapsed / len(odometry_errors) * 1e6:.1f} us per tick")
+    print(f"Error to the truth p50/p95: odometry {p(odometry_errors, 0.5):.2f}/{p(odometry_errors, 0.95):.2f} mm, "
+          f"newest fix {p(fix_errors, 0.5):.2f}/{p(fix_errors, 0.95):.2f} mm")
+    print(estimator.stats_line())
+
+
+if __name__ == "__main__":
+    benchmark()
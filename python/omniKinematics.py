@@ -0,0 +1,182 @@
+import math
+import time
+
+import numpy as np
+
+# Host-side copy of the wheel kinematics in ino/3wheeler101.ino, vectorized so a whole compiled job
+# (gcodePath.GcodePath) is checked in one pass. The firmware takes (x, y, r) commands, x and y in
+# m/s and r in rev/s, scales them by SCALE_FACTOR, turns r into rad/s with its 2 * 3.1459, solves
+# the three wheel angular velocities and sets one step delay per wheel:
+#
+#   delay = (unsigned long)(1e6 / |SPS|), 0 (stopped) below 0.1 SPS, else clamped to [100, 50000] us
+#
+# So a wheel asked for more than 10000 steps/s runs at 10000 (saturated: the robot goes slower and
+# off direction), and one asked for 0.1-20 steps/s runs at 20 (stalled: it creeps faster than it
+# should). Neither is visible from the host; this module predicts both, the velocity the wheels
+# actually deliver, and the fastest feed each segment can run at.
+#
+# Keep the constants in step with the .ino.
+
+WHEEL_RADIUS_M = 0.029
+ROBOT_RADIUS_M = 0.161
+STEPS_PER_REV = 8288.0
+SCALE_FACTOR = 0.8
+FIRMWARE_TWO_PI = 2 * 3.1459      # What the firmware multiplies r by (not quite 2 pi)
+MIN_ACCEPTABLE_DELAY_US = 100
+MAX_ACCEPTABLE_DELAY_US = 50000
+STOP_SPS = 0.1                    # Below this a wheel is stopped (delay 0)
+MAX_SPS = 1e6 / MIN_ACCEPTABLE_DELAY_US
+MIN_SPS = 1e6 / MAX_ACCEPTABLE_DELAY_US
+
+# Wheel angular velocity (rad/s) = WHEEL_MATRIX @ (scaled_x, scaled_y, ROBOT_RADIUS * scaled_r) / WHEEL_RADIUS
+WHEEL_MATRIX = np.array([[0.0, 1.0, 1.0],
+                         [-0.866, -0.5, 1.0],
+                         [0.866, -0.5, 1.0]])
+WHEEL_MATRIX_INVERSE = np.linalg.inv(WHEEL_MATRIX)
+RAD_PER_SEC_TO_SPS = STEPS_PER_REV / (2.0 * math.pi) # The firmware uses the real PI here
+
+
+def wheel_step_rates(x, y, r, scale=SCALE_FACTOR):
+    """Commands (m/s, m/s, rev/s; scalars or arrays) -> signed wheel steps/s, shape (..., 3)."""
+    body = np.stack(np.broadcast_arrays(np.asarray(x, dtype=np.float64) * scale,
+                                        np.asarray(y, dtype=np.float64) * scale,
+                                        np.asarray(r, dtype=np.float64) * scale * FIRMWARE_TWO_PI * ROBOT_RADIUS_M), axis=-1)
+    return body @ WHEEL_MATRIX.T * (RAD_PER_SEC_TO_SPS / WHEEL_RADIUS_M)
+
+
+def step_delays(sps):
+    """Step delays (us) the firmware sets for the given step rates: 0 = stopped, else clamped."""
+    rate = np.abs(sps)
+    delays = np.zeros(rate.shape, dtype=np.int64)
+    moving = rate >= STOP_SPS
+    delays[moving] = (1e6 / rate[moving]).astype(np.int64) # The C cast truncates
+    np.clip(delays, MIN_ACCEPTABLE_DELAY_US, MAX_ACCEPTABLE_DELAY_US, out=delays, where=moving)
+    return delays
+
+
+def delivered_step_rates(sps, loop_us=0.0):
+    """
+    Signed step rates the wheels really run at: the clamped, integer delays, plus loop_us of average
+    lateness per step (moveMotors steps on the first loop pass at or after the delay).
+    """
+    delays = step_delays(sps)
+    rates = np.zeros(delays.shape, dtype=np.float64)
+    moving = delays > 0
+    rates[moving] = np.sign(sps[moving]) * 1e6 / (delays[moving] + loop_us)
+    return rates
+
+
+def commands_from_step_rates(sps, scale=SCALE_FACTOR):
+    """Inverse of wheel_step_rates: wheel steps/s -> the (x, y, r) command that would produce them, shape (..., 3)."""
+    body = (np.asarray(sps, dtype=np.float64) * (WHEEL_RADIUS_M / RAD_PER_SEC_TO_SPS)) @ WHEEL_MATRIX_INVERSE.T
+    return np.stack([body[..., 0] / scale, body[..., 1] / scale,
+                     body[..., 2] / (scale * FIRMWARE_TWO_PI * ROBOT_RADIUS_M)], axis=-1)
+
+
+def body_velocity(x, y, r, loop_us=0.0):
+    """
+    Robot-frame velocity the wheels deliver for a command (m/s, m/s, rev/s): (vx mm/s, vy mm/s,
+    omega deg/s), each a scalar or array. Includes SCALE_FACTOR, the 2 * 3.1459 and the step delay
+    clamping and truncation.
+    """
+    sps = delivered_step_rates(wheel_step_rates(x, y, r), loop_us)
+    body = (sps * (WHEEL_RADIUS_M / RAD_PER_SEC_TO_SPS)) @ WHEEL_MATRIX_INVERSE.T # (vx, vy, R * omega), m/s
+    return body[..., 0] * 1000.0, body[..., 1] * 1000.0, np.degrees(body[..., 2] / ROBOT_RADIUS_M)
+
+
+def feed_limits(dx, dy):
+    """
+    Slowest and fastest speed (mm/s, commanded) along robot-frame unit directions (dx, dy) that keep
+    every moving wheel between MIN_SPS and MAX_SPS. A wheel that barely turns in a direction can
+    make the minimum very large; it only ever costs that wheel's 20 steps/s of creep.
+    """
+    per_mm_per_sec = np.abs(wheel_step_rates(np.asarray(dx) / 1000.0, np.asarray(dy) / 1000.0, 0.0)) # SPS per mm/s
+    fastest = np.max(per_mm_per_sec, axis=-1)
+    max_feed = MAX_SPS / np.maximum(fastest, 1e-12)
+    slowest = np.where(per_mm_per_sec * max_feed[..., None] >= STOP_SPS, per_mm_per_sec, np.inf).min(axis=-1)
+    min_feed = MIN_SPS / slowest
+    return min_feed, max_feed
+
+
+def max_feed(dx_mm, dy_mm, heading_deg=0.0):
+    """Fastest commanded speed (mm/s) for one move of (dx_mm, dy_mm) world mm at the given robot heading."""
+    length = math.hypot(dx_mm, dy_mm)
+    if length < 1e-9:
+        return math.inf
+    angle = math.radians(heading_deg)
+    ux, uy = dx_mm / length, dy_mm / length
+    return float(feed_limits(math.cos(angle) * ux + math.sin(angle) * uy, -math.sin(angle) * ux + math.cos(angle) * uy)[1])
+
+
+class PathKinematics:
+    """
+    The firmware's view of every segment of a GcodePath, run as velocity commands along each segment.
+    heading_deg is the world -> robot rotation the commands go through (closedLoopFollower's yaw minus
+    HEADING_OFFSET_DEG; 0 for the open-loop executor, which sends world directions as they are).
+    Per segment (n,): command (n, 3), step_rates and delays (n, 3), saturated, stalled, speed_ratio
+    (delivered / commanded speed), direction_error_deg, min_feed, max_feed and feasible_feed (mm/s).
+    """
+    def __init__(self, path, heading_deg=0.0, speed_factor=1.0, max_speed=None, loop_us=0.0):
+        self.path = path
+        feed = path.feed if max_speed is None else np.minimum(path.feed, max_speed)
+        feed = feed * speed_factor
+        angle = math.radians(heading_deg)
+        dx = math.cos(angle) * path.directions[:, 0] + math.sin(angle) * path.directions[:, 1]
+        dy = -math.sin(angle) * path.directions[:, 0] + math.cos(angle) * path.directions[:, 1]
+
+        self.command = np.stack([feed * dx / 1000.0, feed * dy / 1000.0, np.zeros_like(feed)], axis=1)
+        self.step_rates = wheel_step_rates(self.command[:, 0], self.command[:, 1], self.command[:, 2])
+        self.delays = step_delays(self.step_rates)
+        rate = np.abs(self.step_rates)
+        self.saturated = np.any(rate > MAX_SPS, axis=1)
+        self.stalled = np.any((rate >= STOP_SPS) & (rate < MIN_SPS), axis=1)
+
+        delivered = commands_from_step_rates(delivered_step_rates(self.step_rates, loop_us))
+        commanded_speed = np.hypot(self.command[:, 0], self.command[:, 1])
+        delivered_speed = np.hypot(delivered[:, 0], delivered[:, 1])
+        self.delivered = delivered
+        self.speed_ratio = delivered_speed / np.maximum(commanded_speed, 1e-12)
+        cross = self.command[:, 0] * delivered[:, 1] - self.command[:, 1] * delivered[:, 0]
+        dot = self.command[:, 0] * delivered[:, 0] + self.command[:, 1] * delivered[:, 1]
+        self.direction_error_deg = np.degrees(np.abs(np.arctan2(cross, dot)))
+
+        self.min_feed, self.max_feed = feed_limits(dx, dy) # Commanded mm/s
+        # Back in programmed-feed units, so the follower's speed factor lands on the limit again
+        self.feasible_feed = np.minimum(path.feed, self.max_feed / speed_factor) if speed_factor > 0 else path.feed.copy()
+
+    def limited_path(self):
+        """Copy of the path with every feed lowered to what its segment can run at."""
+        from gcodePath import GcodePath
+        limited = GcodePath(self.path.points, self.feasible_feed, self.path.laser_on, self.path.laser_power, self.path.line)
+        limited.skipped_lines = getattr(self.path, "skipped_lines", 0)
+        return limited
+
+    def summary(self):
+        lengths = self.path.lengths
+        if not len(lengths):
+            return "0 segments"
+        feasible_s = float(np.sum(lengths / np.maximum(self.feasible_feed, 1e-6)))
+        return (f"{len(lengths)} segments: {int(self.saturated.sum())} saturate a wheel ({lengths[self.saturated].sum():.0f} mm), "
+                f"{int(self.stalled.sum())} stall one ({lengths[self.stalled].sum():.0f} mm); delivered speed "
+                f"{self.speed_ratio.min():.2f}-{self.speed_ratio.max():.2f}x of commanded, worst direction error "
+                f"{self.direction_error_deg.max():.2f} deg; {self.path.duration():.1f} s at programmed feeds, "
+                f"{feasible_s:.1f} s at feasible feeds")
+
+
+if __name__ == "__main__":
+    import argparse
+    from gcodePath import compile_file
+    parser = argparse.ArgumentParser(description="Checks a G-code job against the firmware's wheel kinematics.")
+    parser.add_argument("gcode")
+    parser.add_argument("--heading", type=float, default=0.0, help="Robot heading the job runs at (deg)")
+    parser.add_argument("--speed-factor", type=float, default=1.0)
+    parser.add_argument("--max-speed", type=float, default=None, help="Feed cap (mm/s)")
+    args = parser.parse_args()
+
+    path = compile_file(args.gcode)
+    start = time.perf_counter()
+    kinematics = PathKinematics(path, args.heading, args.speed_factor, args.max_speed)
+    elapsed_ms = (time.perf_counter() - start) * 1000.0
+    print(kinematics.summary())
+    print(f"Checked in {elapsed_ms:.1f} ms; fastest feasible feed {kinematics.max_feed.min():.0f}-{kinematics.max_feed.max():.0f} mm/s "
+          f"(axis moves: X {max_feed(1.0, 0.0):.0f}, Y {max_feed(0.0, 1.0):.0f} mm/s)")
@@ -0,0 +1,292 @@
+import argparse
+import csv
+import json
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from gcodePath import compile_file
+from pathTracker import CORNER_DEG, RELOCALIZE_MM, PurePursuitTracker, corner_arc_lengths, segment_distances
+
+# Planned-versus-actual analysis of a G-code run. DeviationLogger records the localizer's poses of
+# the robot while a job runs (CSV plus a JSON sidecar with where the job was anchored and when it
+# started); analyze() then measures every pose against the compiled path:
+#
+#   cross-track  signed distance to the nearest path point (positive = left of the direction of travel)
+#   along-track  arc length of that point minus the arc length the plan would have reached since the
+#                robot entered the current section (positive = ahead, negative = behind)
+#
+# Sections run between corners and laser on/off changes; the plan is re-anchored at each section
+# entry and wherever the robot skipped along the path, so along-track is the local speed error and
+# does not pile up over a job.
+# How far the whole run fell behind the plan is reported once, as the run-time lag.
+# Nearest points come from pathTracker's arc-length window walk, so a pose is matched to the stroke
+# being drawn rather than to another stroke crossing it; everything after that is vectorized.
+# Poses are split by segment type: cut (laser on), travel (laser off) and corner (within CORNER_MM
+# of a vertex where the path turns more than CORNER_DEG), each reported with percentiles, and the
+# cross-track error is drawn as a heatmap over the path.
+
+DEVIATION_LOG = "deviation_%Y%m%d_%H%M%S.csv"
+CORNER_MM = 3.0
+RESYNC_MM = 3.0              # A pose this far from the tracked stroke is also looked up along the path...
+RESYNC_WINDOW_MM = 300.0     # ...this much arc length either side of it, then along all of it...
+RESYNC_MARGIN_MM = 1.5       # ...and moved there if that is this much closer (a feature cut short, or a wrong match)
+CONTINUOUS_MM = 10.0         # Consecutive poses closer than this along the path passed the arc between them
+PERCENTILES = (50, 95, 99)
+HEATMAP_PIXELS = 800         # Longer side of the heatmap's drawing area
+HEATMAP_MIN_CELL_MM = 0.5    # Coarsest detail: large jobs get bigger cells, small ones stop here
+HEATMAP_LEGEND_PX = 24
+HEATMAP_SCALE_MM = 5.0       # Cross-track error at the top of the colour scale
+SEGMENT_TYPES = ("cut", "travel", "corner")
+
+
+class DeviationLogger:
+    """Writes (capture time, x, y, yaw) rows of the robot's localizer poses; thread-safe, buffered."""
+    def __init__(self, csv_path, gcode_file=None, speed_factor=1.0, max_speed=None):
+        self.csv_path = csv_path
+        self.meta = {"gcode": gcode_file, "origin": [0.0, 0.0], "start_ts": time.time(),
+                     "speed_factor": speed_factor, "max_speed": max_speed}
+        self.file = open(csv_path, 'w', newline='')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(["ts", "x", "y", "yaw"])
+        self.lock = threading.Lock()
+        self.rows = 0
+
+    def add(self, ts, x, y, yaw):
+        with self.lock:
+            if self.file:
+                self.writer.writerow([f"{ts:.6f}", f"{x:.3f}", f"{y:.3f}", f"{yaw:.3f}"])
+                self.rows += 1
+
+    def close(self, origin=(0.0, 0.0)):
+        """origin: world position of the path's (0, 0), i.e. where the job was anchored."""
+        with self.lock:
+            if not self.file:
+                return
+            self.file.close()
+            self.file = None
+        self.meta["origin"] = [float(origin[0]), float(origin[1])]
+        self.meta["end_ts"] = time.time()
+        with open(self.csv_path + ".json", 'w') as f:
+            json.dump(self.meta, f, indent=2)
+
+
+def load_log(csv_path):
+    """(samples (n, 4) array of ts, x, y, yaw in world coordinates, metadata dict)."""
+    samples = np.loadtxt(csv_path, delimiter=",", skiprows=1, ndmin=2)
+    try:
+        with open(csv_path + ".json", 'r') as f:
+            meta = json.load(f)
+    except OSError:
+        meta = {"origin": [0.0, 0.0], "start_ts": float(samples[0, 0]) if len(samples) else 0.0}
+    return samples, meta
+
+
+def planned_times(path, speed_factor=1.0, max_speed=None):
+    """Time (s) at which the plan reaches each path point, at the programmed feeds (capped, scaled)."""
+    feed = path.feed if max_speed is None else np.minimum(path.feed, max_speed)
+    return np.concatenate(([0.0], np.cumsum(path.lengths / np.maximum(feed * speed_factor, 1e-6))))
+
+
+def analyze(path, samples, origin=(0.0, 0.0), start_ts=None, speed_factor=1.0, max_speed=None):
+    """
+    Cross-track and along-track error of every pose sample (ts, x, y, yaw; world coordinates).
+    Returns a dict of per-sample arrays: ts, x, y (path coordinates), s, cross_track, along_track,
+    segment, type (index into SEGMENT_TYPES); plus run_time_s and planned_time_s, the time the run
+    and the plan took to the last pose's path point.
+    """
+    samples = np.asarray(samples, dtype=np.float64)
+    x = samples[:, 1] - origin[0]
+    y = samples[:, 2] - origin[1]
+    ts = samples[:, 0]
+    start_ts = ts[0] if start_ts is None else start_ts
+
+    # Nearest path point of each pose, walking along the path as the robot did. The walk only looks a
+    # short window around its last match and resists going back; where the robot left out more than
+    # that, or the walk took a crossing stroke, look wider
+    tracker = PurePursuitTracker(path)
+    s = np.empty(len(samples))
+    # Off the drawing altogether, which stroke is nearest says nothing: keep the last match (and the whole-path searches out)
+    lo = path.points.min(axis=0) - RELOCALIZE_MM
+    hi = path.points.max(axis=0) + RELOCALIZE_MM
+    off_drawing = (x < lo[0]) | (x > hi[0]) | (y < lo[1]) | (y > hi[1])
+    for i in range(len(samples)):
+        if off_drawing[i]:
+            s[i] = tracker.s
+            continue
+        distance, s[i] = tracker.locate(x[i], y[i])
+        if RESYNC_MM < distance <= RELOCALIZE_MM: # Further out, locate() has already searched the whole path
+            distances, arc = segment_distances(path, path.segment_at(s[i] - RESYNC_WINDOW_MM),
+                                               path.segment_at(s[i] + RESYNC_WINDOW_MM) + 1, x[i], y[i])
+            k = int(np.argmin(distances))
+            wider, s_wider = float(distances[k]), float(arc[k])
+            if wider > RESYNC_MM:
+                wider, s_wider = tracker.grid.nearest(x[i], y[i]) # The follower itself jumped further
+            if s_wider is not None and wider < distance - RESYNC_MARGIN_MM:
+                tracker.s = s[i] = s_wider
+
+    segment = np.clip(np.searchsorted(path.cumulative, s, side='right') - 1, 0, max(path.segment_count - 1, 0))
+    along = s - path.cumulative[segment]
+    direction = path.directions[segment]
+    px = path.points[segment, 0] + direction[:, 0] * along
+    py = path.points[segment, 1] + direction[:, 1] * along
+    cross_track = direction[:, 0] * (y - py) - direction[:, 1] * (x - px)
+    # Past either end of the path the nearest point is the end point: the signed distance is its whole distance
+    ends = np.hypot(x - px, y - py)
+    cross_track = np.where(np.abs(cross_track) < ends - 1e-6, np.sign(cross_track + 1e-12) * ends, cross_track)
+
+    # Along-track against the plan re-anchored at each section entry (and after each skip): the planned
+    # time of the anchor pose's point, plus the time since that pose, gives the planned arc length
+    corners = corner_arc_lengths(path)
+    times = planned_times(path, speed_factor, max_speed)
+    planned_t = np.interp(s, path.cumulative, times)
+    stroke = np.concatenate(([0], np.cumsum(path.laser_on[1:] != path.laser_on[:-1])))[segment]
+    section = np.searchsorted(corners, s)
+    anchor = np.ones(len(s), dtype=bool)
+    anchor[1:] = (stroke[1:] != stroke[:-1]) | (section[1:] != section[:-1]) | (np.abs(np.diff(s)) > CONTINUOUS_MM)
+    anchor = np.maximum.accumulate(np.where(anchor, np.arange(len(s)), 0))
+    along_track = s - np.interp(planned_t[anchor] + ts - ts[anchor], times, path.cumulative)
+
+    kind = np.where(path.laser_on[segment], 0, 1)
+    if len(corners):
+        k = np.clip(np.searchsorted(corners, s), 1, len(corners)) # Nearest corner is k - 1 or k
+        nearest = np.minimum(np.abs(s - corners[k - 1]), np.abs(s - corners[np.minimum(k, len(corners) - 1)]))
+        kind = np.where(nearest <= CORNER_MM, 2, kind)
+    return {"ts": ts, "x": x, "y": y, "s": s, "cross_track": cross_track, "along_track": along_track,
+            "segment": segment, "type": kind, "run_time_s": float(ts[-1] - start_ts) if len(ts) else 0.0,
+            "planned_time_s": float(planned_t[-1]) if len(ts) else 0.0}
+
+
+def passed_length(s, continuous=CONTINUOUS_MM):
+    """Arc length the poses passed continuously (the union of the steps between them, jumps left out)."""
+    if len(s) < 2:
+        return 0.0
+    steps = np.abs(np.diff(s)) <= continuous
+    starts = np.minimum(s[:-1], s[1:])[steps]
+    ends = np.maximum(s[:-1], s[1:])[steps]
+    order = np.argsort(starts)
+    starts, ends = starts[order], ends[order]
+    reached = np.concatenate(([-np.inf], np.maximum.accumulate(ends)[:-1])) # Furthest end before each step
+    return float(np.clip(ends - np.maximum(starts, reached), 0.0, None).sum())
+
+
+def report(result, path, percentiles=PERCENTILES):
+    """Per segment type: samples, |cross-track| and |along-track| percentiles, cross-track bias. Returns (text, dict)."""
+    table = {}
+    for index, name in enumerate(SEGMENT_TYPES + ("all",)):
+        mask = result["type"] == index if name != "all" else np.ones(len(result["type"]), dtype=bool)
+        if not mask.any():
+            continue
+        cross = result["cross_track"][mask]
+        along = result["along_track"][mask]
+        table[name] = {"samples": int(mask.sum()),
+                       "cross_track_mm": {f"p{p}": float(v) for p, v in zip(percentiles, np.percentile(np.abs(cross), percentiles))},
+                       "cross_track_max_mm": float(np.abs(cross).max()),
+                       "cross_track_bias_mm": float(cross.mean()),
+                       "along_track_mm": {f"p{p}": float(v) for p, v in zip(percentiles, np.percentile(np.abs(along), percentiles))}}
+    covered = float(result["s"].max() / path.length) if path.length and len(result["s"]) else 0.0
+    skipped = path.length - passed_length(result["s"])
+    lines = [f"Path deviation: {len(result['ts'])} poses over {result['ts'][-1] - result['ts'][0]:.1f} s, "
+             f"{covered * 100:.1f}% of {path.length:.0f} mm reached, {skipped:.0f} mm never passed"
+             if len(result["ts"]) else "Path deviation: no poses",
+             f"Run time {result['run_time_s']:.1f} s to the last pose, plan {result['planned_time_s']:.1f} s "
+             f"(lag {result['run_time_s'] - result['planned_time_s']:+.1f} s)",
+             f"{'type':<8}{'poses':>7}  cross-track |mm| " + " / ".join(f"p{p}" for p in percentiles) +
+             "  max   bias   along-track |mm| " + " / ".join(f"p{p}" for p in percentiles)]
+    for name, row in table.items():
+        cross = " / ".join(f"{v:.2f}" for v in row["cross_track_mm"].values())
+        along = " / ".join(f"{v:.1f}" for v in row["along_track_mm"].values())
+        lines.append(f"{name:<8}{row['samples']:>7}  {cross:>22} {row['cross_track_max_mm']:5.2f} {row['cross_track_bias_mm']:+6.2f}   {along}")
+    table["coverage"] = covered
+    table["skipped_mm"] = float(skipped)
+    table["run_time_s"] = result["run_time_s"]
+    table["planned_time_s"] = result["planned_time_s"]
+    table["lag_s"] = result["run_time_s"] - result["planned_time_s"]
+    return "\n".join(lines), table
+
+
+def heatmap(result, path, image_path, pixels=HEATMAP_PIXELS, scale_mm=HEATMAP_SCALE_MM):
+    """
+    Mean |cross-track| per cell over the poses, colour-mapped (blue 0 -> red scale_mm and more),
+    with the planned cut strokes in grey underneath. Writes image_path; returns the image.
+    """
+    points = np.concatenate([path.points, np.stack([result["x"], result["y"]], axis=1)])
+    lo = points.min(axis=0) - 5.0
+    hi = points.max(axis=0) + 5.0
+    cell = max(HEATMAP_MIN_CELL_MM, float(np.max(hi - lo)) / pixels)
+    width, height = int((hi[0] - lo[0]) / cell) + 1, int((hi[1] - lo[1]) / cell) + 1
+
+    # Mean error per cell with two bincounts
+    cx = np.clip(((result["x"] - lo[0]) / cell).astype(np.int64), 0, width - 1)
+    cy = np.clip(((hi[1] - result["y"]) / cell).astype(np.int64), 0, height - 1) # Image rows grow downwards
+    keys = cy * width + cx
+    total = np.bincount(keys, weights=np.abs(result["cross_track"]), minlength=width * height)
+    count = np.bincount(keys, minlength=width * height)
+    seen = count > 0
+    mean = np.zeros(width * height)
+    mean[seen] = total[seen] / count[seen]
+    levels = np.clip(mean / scale_mm * 255.0, 0, 255).astype(np.uint8).reshape(height, width)
+
+    image = np.full((height, width, 3), 255, dtype=np.uint8)
+    pixels = np.stack([(path.points[:, 0] - lo[0]) / cell, (hi[1] - path.points[:, 1]) / cell], axis=1).astype(np.int32)
+    for i in np.flatnonzero(path.laser_on):
+        cv2.line(image, tuple(pixels[i]), tuple(pixels[i + 1]), (190, 190, 190), 1)
+    # Fatten single-cell hits so they show; where hits overlap the worse one wins
+    kernel = np.ones((3, 3), np.uint8)
+    mask = cv2.dilate(seen.reshape(height, width).astype(np.uint8), kernel) > 0
+    colored = cv2.applyColorMap(cv2.dilate(levels, kernel), cv2.COLORMAP_JET)
+    image[mask] = colored[mask]
+
+    # Legend: the colour scale and what it means, under the drawing
+    legend = np.full((HEATMAP_LEGEND_PX, width, 3), 255, dtype=np.uint8)
+    bar = min(width // 3, 200)
+    legend[4:12, 4:4 + bar] = cv2.applyColorMap(np.linspace(0, 255, bar).astype(np.uint8)[None, :], cv2.COLORMAP_JET)
+    cv2.putText(legend, f"0-{scale_mm:.0f} mm |cross-track|, {cell:.2f} mm/px", (8 + bar, 12),
+                cv2.FONT_HERSHEY_SIMPLEX, 0.35, (0, 0, 0), 1)
+    image = np.concatenate([image, legend])
+    cv2.imwrite(image_path, image)
+    return image
+
+
+def analyze_run(path, csv_path, heatmap_path=None, json_path=None):
+    """
+    Analyzes a run's log against the path it ran (after any feed limiting), writes the heatmap (and
+    the report as JSON). Returns the report text.
+    """
+    samples, meta = load_log(csv_path)
+    if not len(samples):
+        return "Path deviation: no poses logged"
+    start = time.perf_counter()
+    result = analyze(path, samples, meta.get("origin", (0.0, 0.0)), meta.get("start_ts"),
+                     meta.get("speed_factor") or 1.0, meta.get("max_speed"))
+    text, table = report(result, path)
+    text += f"\n(analyzed in {(time.perf_counter() - start) * 1000.0:.0f} ms)"
+    if heatmap_path:
+        heatmap(result, path, heatmap_path)
+        text += f"\nHeatmap written to {heatmap_path}"
+    if json_path:
+        with open(json_path, 'w') as f:
+            json.dump(table, f, indent=2)
+    return text
+
+
+def analyze_log(gcode_file, csv_path, heatmap_path=None, json_path=None):
+    """analyze_run() against the G-code file as compiled, at its programmed feeds."""
+    return analyze_run(compile_file(gcode_file), csv_path, heatmap_path, json_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Planned-versus-actual path deviation of a logged G-code run.")
+    parser.add_argument("gcode")
+    parser.add_argument("log", help="CSV written by DeviationLogger")
+    parser.add_argument("--heatmap", default=None, help="PNG to write (default: next to the log)")
+    parser.add_argument("--json", default=None, help="Also write the report table as JSON")
+    args = parser.parse_args()
+    heatmap_path = args.heatmap or args.log.rsplit(".", 1)[0] + "_heatmap.png"
+    print(analyze_log(args.gcode, args.log, heatmap_path, args.json))
+
+
+if __name__ == "__main__":
+    main()
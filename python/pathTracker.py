@@ -0,0 +1,234 @@
+import math
+import time
+
+import numpy as np
+
+# Pure-pursuit tracking over a compiled G-code path (gcodePath.GcodePath) with a uniform grid
+# index over its segments, so finding where the robot is along a job of tens of thousands of
+# segments costs about the same as along a square.
+#
+# Queries:
+#   - nearest point with an arc-length hint (every control tick): only the segments within a small
+#     window around the last position are checked, found with searchsorted on the cumulative arc
+#     length (O(log n) + the window, which does not grow with the job). Candidates pay a small
+#     penalty per mm of arc length away from the last position, more for going backwards, so the
+#     tracker stays on its stroke where the drawing crosses itself or hatches back and forth over
+#     the same line.
+#   - nearest point without a hint (start, or when the robot is far from where the window says):
+#     the grid is searched in growing blocks of cells around the robot until no closer segment
+#     can exist (amortized O(1) for a point near the path).
+#   - look-ahead point: arc length + L, again a searchsorted. L stops at the next break (a corner or
+#     a laser on/off change), so the robot goes round corners instead of cutting across them and
+#     short features are not skipped with the laser off; the follower slows down into each break.
+
+GRID_CELLS = 256          # Cells along the longer side of the path's bounding box
+MIN_CELL_MM = 2.0
+WINDOW_BACK_MM = 10.0     # Arc length searched behind the last position...
+WINDOW_AHEAD_MM = 60.0    # ...and ahead of it
+RELOCALIZE_MM = 30.0      # Further than this from the windowed nearest point: search the whole path
+ADVANCE_WEIGHT = 0.1      # Penalty (mm of distance) per mm of arc length ahead of the last position...
+BACKTRACK_WEIGHT = 0.5    # ...and per mm behind it: progress almost never really goes backwards
+OVERREACH_WEIGHT = 0.5    # ...and per mm beyond the reach of the last look-ahead (update() only)
+LOOKAHEAD_TIME_S = 0.15   # Look-ahead distance = speed * this, clamped to the two limits below
+MIN_LOOKAHEAD_MM = 4.0
+MAX_LOOKAHEAD_MM = 30.0
+CORNER_DEG = 30.0         # A vertex where the path turns more than this is a corner
+BREAK_PASSED_MM = 0.5     # A break this close ahead of the nearest point counts as reached
+
+
+def segment_distances(path, first, last, x, y):
+    """Distance from (x, y) to segments first..last-1 and the arc length of each closest point."""
+    a = path.points[first:last]
+    d = path.directions[first:last]
+    along = np.clip((x - a[:, 0]) * d[:, 0] + (y - a[:, 1]) * d[:, 1], 0.0, path.lengths[first:last])
+    dx = a[:, 0] + d[:, 0] * along - x
+    dy = a[:, 1] + d[:, 1] * along - y
+    return np.hypot(dx, dy), path.cumulative[first:last] + along
+
+
+def corner_arc_lengths(path, corner_deg=CORNER_DEG):
+    """Arc lengths of the vertices where the path turns more than corner_deg."""
+    d = path.directions
+    turn = np.degrees(np.abs(np.arctan2(d[:-1, 0] * d[1:, 1] - d[:-1, 1] * d[1:, 0],
+                                        d[:-1, 0] * d[1:, 0] + d[:-1, 1] * d[1:, 1])))
+    return path.cumulative[1:-1][turn > corner_deg]
+
+
+def break_arc_lengths(path, corner_deg=CORNER_DEG):
+    """Sorted arc lengths where the look-ahead must stop: corners and laser on/off changes."""
+    laser_changes = path.cumulative[1:-1][path.laser_on[1:] != path.laser_on[:-1]]
+    return np.unique(np.concatenate((corner_arc_lengths(path, corner_deg), laser_changes)))
+
+
+class SegmentGrid:
+    """Uniform grid over the path's bounding box; each cell lists the segments passing through it (CSR layout)."""
+    def __init__(self, path, cells=GRID_CELLS, min_cell=MIN_CELL_MM):
+        self.path = path
+        lo = path.points.min(axis=0)
+        hi = path.points.max(axis=0)
+        self.cell = max(float(np.max(hi - lo)) / cells, min_cell)
+        self.origin = lo
+        self.shape = (int((hi[0] - lo[0]) // self.cell) + 1, int((hi[1] - lo[1]) // self.cell) + 1)
+
+        # Sample every segment at half-cell steps and record the cells the samples fall in
+        n = path.segment_count
+        samples = np.maximum(np.ceil(path.lengths / (self.cell * 0.5)).astype(np.int64), 1) + 1
+        segment = np.repeat(np.arange(n), samples)
+        offsets = np.arange(len(segment)) - np.repeat(np.cumsum(samples) - samples, samples)
+        fraction = offsets / np.repeat(samples - 1, samples)
+        x = path.points[segment, 0] + (path.points[segment + 1, 0] - path.points[segment, 0]) * fraction
+        y = path.points[segment, 1] + (path.points[segment + 1, 1] - path.points[segment, 1]) * fraction
+        cx = np.clip(((x - lo[0]) // self.cell).astype(np.int64), 0, self.shape[0] - 1)
+        cy = np.clip(((y - lo[1]) // self.cell).astype(np.int64), 0, self.shape[1] - 1)
+        keys = np.unique(np.stack([cx * self.shape[1] + cy, segment], axis=1), axis=0) # Sorted by cell, then segment
+        self.cell_segments = keys[:, 1]
+        self.cell_start = np.searchsorted(keys[:, 0], np.arange(self.shape[0] * self.shape[1] + 1))
+
+    def block_segments(self, cx, cy, radius):
+        """Segment indices listed in the cells within Chebyshev distance radius of (cx, cy) (with repeats)."""
+        nx, ny = self.shape
+        i = np.arange(max(cx - radius, 0), min(cx + radius, nx - 1) + 1)
+        j = np.arange(max(cy - radius, 0), min(cy + radius, ny - 1) + 1)
+        keys = (i[:, None] * ny + j[None, :]).ravel()
+        starts = self.cell_start[keys]
+        counts = self.cell_start[keys + 1] - starts
+        total = int(counts.sum())
+        if total == 0:
+            return None
+        # Concatenated CSR ranges without a Python loop: start of each range + position inside it
+        offsets = np.repeat(starts - (np.cumsum(counts) - counts), counts) + np.arange(total)
+        return self.cell_segments[offsets]
+
+    def nearest(self, x, y, first=0, last=None):
+        """(distance, arc length) of the closest path point, optionally only among segments first..last-1."""
+        path = self.path
+        last = path.segment_count if last is None else last
+        cx = min(max(int((x - self.origin[0]) // self.cell), 0), self.shape[0] - 1)
+        cy = min(max(int((y - self.origin[1]) // self.cell), 0), self.shape[1] - 1)
+        # Outside the box, the blocks only start to reach the path this far out
+        gap = max(abs(x - min(max(x, self.origin[0]), self.origin[0] + self.shape[0] * self.cell)),
+                  abs(y - min(max(y, self.origin[1]), self.origin[1] + self.shape[1] * self.cell)))
+        radius = 1
+        while True:
+            candidates = self.block_segments(cx, cy, radius)
+            if candidates is not None:
+                candidates = candidates[(candidates >= first) & (candidates < last)]
+            covers_all = radius >= max(self.shape)
+            if candidates is not None and len(candidates):
+                a = path.points[candidates]
+                d = path.directions[candidates]
+                along = np.clip((x - a[:, 0]) * d[:, 0] + (y - a[:, 1]) * d[:, 1], 0.0, path.lengths[candidates])
+                distances = np.hypot(a[:, 0] + d[:, 0] * along - x, a[:, 1] + d[:, 1] * along - y)
+                i = int(np.argmin(distances))
+                # Segments outside the block are at least radius cells away: done if the best is closer
+                if distances[i] <= radius * self.cell + gap or covers_all:
+                    return float(distances[i]), float(path.cumulative[candidates[i]] + along[i])
+            elif covers_all:
+                return math.inf, None
+            radius *= 2 # Doubling: the repeated inner cells cost at most as much again
+
+
+class TrackPoint:
+    __slots__ = ("s", "distance", "target_x", "target_y", "segment", "lookahead", "to_break")
+
+    def __init__(self, s, distance, target_x, target_y, segment, lookahead, to_break):
+        self.s = s                # Arc length of the robot's nearest path point
+        self.distance = distance  # Cross-track error (mm)
+        self.target_x = target_x  # Look-ahead point
+        self.target_y = target_y
+        self.segment = segment    # Segment of the robot's nearest point
+        self.lookahead = lookahead
+        self.to_break = to_break  # Arc length to the next corner or laser change (inf: none left)
+
+
+class PurePursuitTracker:
+    """
+    Follows a GcodePath: locate() finds the robot's place on the path, update() also returns the
+    look-ahead point to steer toward. Progress is kept between calls, so each tick only searches a
+    small arc-length window.
+    """
+    def __init__(self, path, lookahead_time=LOOKAHEAD_TIME_S, min_lookahead=MIN_LOOKAHEAD_MM,
+                 max_lookahead=MAX_LOOKAHEAD_MM):
+        self.path = path
+        self.grid = SegmentGrid(path)
+        self.lookahead_time = lookahead_time
+        self.min_lookahead = min_lookahead
+        self.max_lookahead = max_lookahead
+        self.breaks = break_arc_lengths(path)
+        self.s = 0.0 # Arc length of the last located point; a job starts at its beginning
+        self.reach = None # Furthest plausible advance: the robot was steered at the last look-ahead point
+        self.relocalizations = 0
+
+    def locate(self, x, y):
+        """(cross-track distance, arc length) of the robot's nearest path point."""
+        path = self.path
+        if self.s is not None:
+            first = path.segment_at(self.s - WINDOW_BACK_MM)
+            last = path.segment_at(self.s + WINDOW_AHEAD_MM) + 1
+            distances, arc = segment_distances(path, first, last, x, y)
+            jump = arc - self.s
+            penalty = np.where(jump >= 0.0, ADVANCE_WEIGHT * jump, -BACKTRACK_WEIGHT * jump)
+            if self.reach is not None:
+                # A stroke passing close by further on is not where a robot steered a few mm ahead can be
+                penalty += OVERREACH_WEIGHT * np.maximum(jump - self.reach, 0.0)
+            i = int(np.argmin(distances + penalty))
+            distance, s = float(distances[i]), float(arc[i])
+            if distance <= RELOCALIZE_MM:
+                self.s = max(s, self.s - WINDOW_BACK_MM)
+                return distance, self.s
+            self.relocalizations += 1
+        distance, s = self.grid.nearest(x, y)
+        if s is not None:
+            self.s = s
+        return distance, self.s
+
+    def update(self, x, y, speed):
+        distance, s = self.locate(x, y)
+        lookahead = min(max(speed * self.lookahead_time, self.min_lookahead), self.max_lookahead)
+        k = int(np.searchsorted(self.breaks, s + BREAK_PASSED_MM))
+        to_break = float(self.breaks[k]) - s if k < len(self.breaks) else math.inf
+        lookahead = min(lookahead, to_break)
+        self.reach = lookahead + self.min_lookahead
+        target_x, target_y, _ = self.path.point_at(s + lookahead)
+        return TrackPoint(s, distance, target_x, target_y, self.path.segment_at(s), lookahead, to_break)
+
+
+def benchmark(gcode_file, queries=2000):
+    """Times windowed and global nearest-point queries against a brute-force scan of every segment."""
+    from gcodePath import compile_file
+    path = compile_file(gcode_file)
+    start = time.perf_counter()
+    tracker = PurePursuitTracker(path)
+    build_ms = (time.perf_counter() - start) * 1000.0
+    rng = np.random.default_rng(1)
+
+    # Walk along the path with noise, as the control loop sees it (a few mm per tick)
+    walk = np.arange(0.0, path.length, 2.5)[:queries]
+    points = [path.point_at(s)[:2] for s in walk]
+    noisy = [(x + rng.normal(0, 0.5), y + rng.normal(0, 0.5)) for x, y in points] # About the filtered pose noise
+    start = time.perf_counter()
+    worst = 0.0
+    for x, y in noisy:
+        distance, _ = tracker.locate(x, y)
+        worst = max(worst, distance)
+    tracked_us = (time.perf_counter() - start) / queries * 1e6
+
+    lo, hi = path.points.min(axis=0), path.points.max(axis=0)
+    random_points = rng.uniform(lo, hi, size=(200, 2))
+    start = time.perf_counter()
+    grid_results = [tracker.grid.nearest(x, y) for x, y in random_points]
+    grid_us = (time.perf_counter() - start) / len(random_points) * 1e6
+    start = time.perf_counter()
+    brute_results = [float(np.min(segment_distances(path, 0, path.segment_count, x, y)[0])) for x, y in random_points]
+    brute_us = (time.perf_counter() - start) / len(random_points) * 1e6
+    mismatches = sum(abs(g[0] - b) > 1e-6 for g, b in zip(grid_results, brute_results))
+
+    print(f"{path.segment_count} segments, {path.length:.0f} mm; grid {tracker.grid.shape[0]}x{tracker.grid.shape[1]} "
+          f"cells of {tracker.grid.cell:.2f} mm built in {build_ms:.1f} ms")
+    print(f"Tracking query: {tracked_us:.1f} us ({tracker.relocalizations} relocalizations, worst distance {worst:.2f} mm)")
+    print(f"Global query: grid {grid_us:.1f} us vs brute force {brute_us:.1f} us, {mismatches} mismatches")
+
+
+if __name__ == "__main__":
+    import sys
+    benchmark(sys.argv[1])
@@ -0,0 +1,259 @@
+import math
+import sys
+import time
+
+import numpy as np
+
+# Constant-velocity Kalman filter for localizer poses (x, y in mm, yaw in degrees), keyed on the
+# frame capture timestamps carried by the pose stream. It smooths the noisy detections, rejects
+# outliers, and predicts where the robot is *now* so a controller doesn't act on a pose that is
+# already a capture + detection + transport delay old.
+#
+# Each axis is an independent 2-state (position, velocity) filter. All robots live in one set of
+# preallocated arrays: update() works on one robot's three axes with in-place NumPy operations and
+# predict_all() extrapolates every robot at once, so neither allocates per call.
+
+MAX_ROBOTS = 8
+ACCEL_NOISE = np.array([500.0, 500.0, 90.0])   # Process noise: expected acceleration (mm/s^2, mm/s^2, deg/s^2)
+MEASUREMENT_SIGMA = np.array([3.0, 3.0, 1.5])   # Detection noise (mm, mm, deg)
+OUTLIER_GATE_SIGMA = 4.0       # Innovations beyond this many standard deviations are rejected
+MAX_CONSECUTIVE_OUTLIERS = 5   # After this many rejections in a row the robot is assumed moved: reset
+MAX_PREDICT_S = 0.5            # Don't extrapolate further than this past the last detection
+INITIAL_VELOCITY_SIGMA = np.array([500.0, 500.0, 180.0])
+YAW = 2                        # Axis index of yaw, which wraps at 360
+
+
+class PoseFilterBank:
+    def __init__(self, max_robots=MAX_ROBOTS, accel_noise=ACCEL_NOISE, measurement_sigma=MEASUREMENT_SIGMA,
+                 gate_sigma=OUTLIER_GATE_SIGMA):
+        self.index = {} # tag_id -> row
+        self.max_robots = max_robots
+        self.q = np.asarray(accel_noise, dtype=np.float64) ** 2
+        self.r = np.asarray(measurement_sigma, dtype=np.float64) ** 2
+        self.gate2 = gate_sigma ** 2
+
+        # State and covariance per robot and axis: P = [[p00, p01], [p01, p11]]
+        self.pos = np.zeros((max_robots, 3))
+        self.vel = np.zeros((max_robots, 3))
+        self.p00 = np.zeros((max_robots, 3))
+        self.p01 = np.zeros((max_robots, 3))
+        self.p11 = np.zeros((max_robots, 3))
+        self.last_ts = np.zeros(max_robots)
+        self.outliers_in_row = np.zeros(max_robots, dtype=np.int64)
+
+        # Counters
+        self.updates = 0
+        self.rejected = 0
+        self.late = 0
+        self.resets = 0
+
+        # Scratch arrays for update(), reused every call
+        self._z = np.zeros(3)
+        self._innovation = np.zeros(3)
+        self._s = np.zeros(3)
+        self._k0 = np.zeros(3)
+        self._k1 = np.zeros(3)
+        self._tmp = np.zeros(3)
+        self._predicted = np.zeros((max_robots, 3))
+        self._dt = np.zeros(max_robots)
+
+    def _row(self, tag_id):
+        row = self.index.get(tag_id)
+        if row is None:
+            if len(self.index) == self.max_robots:
+                return None
+            row = len(self.index)
+            self.index[tag_id] = row
+            self.last_ts[row] = 0.0
+        return row
+
+    def _reset(self, row, z, ts):
+        self.pos[row] = z
+        self.vel[row] = 0.0
+        self.p00[row] = self.r
+        self.p01[row] = 0.0
+        self.p11[row] = INITIAL_VELOCITY_SIGMA ** 2
+        self.last_ts[row] = ts
+        self.outliers_in_row[row] = 0
+
+    def update(self, tag_id, capture_ts, x, y, yaw):
+        """
+        Adds one detection. Returns True if it was used, False if it was late, an outlier,
+        or there is no room for another robot.
+        """
+        row = self._row(tag_id)
+        if row is None:
+            return False
+        z = self._z
+        z[0] = x
+        z[1] = y
+        z[2] = yaw % 360.0
+        if self.last_ts[row] == 0.0:
+            self._reset(row, z, capture_ts)
+            self.updates += 1
+            return True
+
+        dt = capture_ts - self.last_ts[row]
+        if dt <= 0.0:
+            self.late += 1 # Older than what we already have (out-of-order delivery)
+            return False
+
+        pos, vel = self.pos[row], self.vel[row]
+        p00, p01, p11 = self.p00[row], self.p01[row], self.p11[row]
+        tmp = self._tmp
+
+        # --- Predict to the capture time: x += v dt, P = F P F' + Q (white-acceleration model) ---
+        np.multiply(vel, dt, out=tmp)
+        pos += tmp
+        pos[YAW] %= 360.0
+        np.multiply(p11, dt, out=tmp)            # p00 += dt * (2 p01 + dt p11) + q dt^3 / 3
+        tmp += p01
+        tmp += p01
+        tmp *= dt
+        p00 += tmp
+        np.multiply(self.q, dt ** 3 / 3.0, out=tmp)
+        p00 += tmp
+        np.multiply(p11, dt, out=tmp)            # p01 += dt p11 + q dt^2 / 2
+        p01 += tmp
+        np.multiply(self.q, dt * dt / 2.0, out=tmp)
+        p01 += tmp
+        np.multiply(self.q, dt, out=tmp)         # p11 += q dt
+        p11 += tmp
+
+        # --- Innovation (yaw wrapped to -180..180) and gate ---
+        innovation = self._innovation
+        np.subtract(z, pos, out=innovation)
+        innovation[YAW] = (innovation[YAW] + 180.0) % 360.0 - 180.0
+        s = self._s
+        np.add(p00, self.r, out=s)
+        np.multiply(innovation, innovation, out=tmp)
+        tmp /= s
+        if tmp.max() > self.gate2:
+            self.rejected += 1
+            self.outliers_in_row[row] += 1
+            self.last_ts[row] = capture_ts # The prediction above stands in for this detection
+            if self.outliers_in_row[row] >= MAX_CONSECUTIVE_OUTLIERS:
+                self.resets += 1 # Consistently somewhere else: the robot was moved, start over there
+                self._reset(row, z, capture_ts)
+            return False
+        self.outliers_in_row[row] = 0
+
+        # --- Update: K = P H' / S ---
+        k0, k1 = self._k0, self._k1
+        np.divide(p00, s, out=k0)
+        np.divide(p01, s, out=k1)
+        np.multiply(k0, innovation, out=tmp)
+        pos += tmp
+        pos[YAW] %= 360.0
+        np.multiply(k1, innovation, out=tmp)
+        vel += tmp
+        np.multiply(k1, p01, out=tmp)            # p11 -= k1 p01 (uses p01 before its update)
+        p11 -= tmp
+        np.subtract(1.0, k0, out=tmp)            # p00 *= 1 - k0; p01 *= 1 - k0
+        p00 *= tmp
+        p01 *= tmp
+
+        self.last_ts[row] = capture_ts
+        self.updates += 1
+        return True
+
+    def predict(self, tag_id, now=None):
+        """Returns the (x, y, yaw) predicted for time now (wall clock), or None for an unknown tag."""
+        row = self.index.get(tag_id)
+        if row is None or self.last_ts[row] == 0.0:
+            return None
+        if now is None:
+            now = time.time()
+        dt = min(max(now - self.last_ts[row], 0.0), MAX_PREDICT_S)
+        pos, vel = self.pos[row], self.vel[row]
+        return (float(pos[0] + vel[0] * dt), float(pos[1] + vel[1] * dt), float((pos[2] + vel[2] * dt) % 360.0))
+
+    def predict_all(self, now=None):
+        """Predicted (x, y, yaw) of every robot row at time now, as a (robots, 3) array view (reused)."""
+        if now is None:
+            now = time.time()
+        n = len(self.index)
+        dt = self._dt[:n]
+        np.subtract(now, self.last_ts[:n], out=dt)
+        np.clip(dt, 0.0, MAX_PREDICT_S, out=dt)
+        out = self._predicted[:n]
+        np.multiply(self.vel[:n], dt[:, None], out=out)
+        out += self.pos[:n]
+        out[:, YAW] %= 360.0
+        return out
+
+    def last_seen(self, tag_id):
+        """Capture time (wall clock) of the newest detection of a robot, or None."""
+        row = self.index.get(tag_id)
+        return None if row is None or self.last_ts[row] == 0.0 else float(self.last_ts[row])
+
+    def velocity(self, tag_id):
+        row = self.index.get(tag_id)
+        return None if row is None else (float(self.vel[row, 0]), float(self.vel[row, 1]), float(self.vel[row, 2]))
+
+    def position_sigma(self, tag_id):
+        """Current position standard deviation (mm) of a robot, or None."""
+        row = self.index.get(tag_id)
+        return None if row is None else math.sqrt(max(self.p00[row, 0], self.p00[row, 1]))
+
+
+BENCHMARK_LATENCY_S = 0.08 # Capture-to-controller delay simulated by the benchmark
+
+
+def circle_pose(t, robot):
+    return 500 * math.cos(0.5 * t + robot), 500 * math.sin(0.5 * t + robot), math.degrees(0.5 * t + robot + math.pi / 2) % 360
+
+
+def benchmark(robots=4, seconds=20.0, fps=30.0):
+    """Feeds noisy detections of robots driving circles, with a few outliers, and reports cost and error."""
+    rng = np.random.default_rng(2)
+    bank = PoseFilterBank()
+    frames = int(seconds * fps)
+    raw_error = []
+    filtered_error = []
+    stale_error = []     # Raw pose used BENCHMARK_LATENCY_S after capture, as the sketch's controller would
+    predicted_error = [] # Filter prediction for that same moment
+    start_ts = 1000.0
+    detections = []
+    for frame in range(frames):
+        t = frame / fps
+        for robot in range(robots):
+            truth = circle_pose(t, robot)
+            noisy = [truth[0] + rng.normal(0, 3), truth[1] + rng.normal(0, 3), truth[2] + rng.normal(0, 1.5)]
+            if rng.random() < 0.01:
+                noisy[0] += 300 # Misdetection
+            detections.append((robot, start_ts + t, noisy, truth))
+
+    elapsed = 0.0
+    for robot, ts, noisy, truth in detections:
+        begin = time.perf_counter()
+        bank.update(robot, ts, noisy[0], noisy[1], noisy[2])
+        elapsed += time.perf_counter() - begin
+        if ts > start_ts + 1.0:
+            estimate = bank.predict(robot, ts)
+            filtered_error.append(math.hypot(estimate[0] - truth[0], estimate[1] - truth[1]))
+            raw_error.append(math.hypot(noisy[0] - truth[0], noisy[1] - truth[1]))
+            later = circle_pose(ts - start_ts + BENCHMARK_LATENCY_S, robot)
+            estimate = bank.predict(robot, ts + BENCHMARK_LATENCY_S)
+            predicted_error.append(math.hypot(estimate[0] - later[0], estimate[1] - later[1]))
+            stale_error.append(math.hypot(noisy[0] - later[0], noisy[1] - later[1]))
+    counters = f"Rejected {bank.rejected} outliers, {bank.late} late, {bank.resets} resets"
+
+    # Run the same detections again and check the updates leave no allocated blocks behind
+    blocks = sys.getallocatedblocks()
+    for robot, ts, noisy, truth in detections:
+        bank.update(robot, ts + seconds, noisy[0], noisy[1], noisy[2])
+    retained = sys.getallocatedblocks() - blocks
+
+    for errors in (raw_error, filtered_error, stale_error, predicted_error):
+        errors.sort()
+    print(f"{len(detections)} detections of {robots} robots: {elapsed / len(detections) * 1e6:.1f} us per update")
+    print(f"Position error p50/p95: raw {raw_error[len(raw_error) // 2]:.2f}/{raw_error[int(0.95 * len(raw_error))]:.2f} mm, "
+          f"filtered {filtered_error[len(filtered_error) // 2]:.2f}/{filtered_error[int(0.95 * len(filtered_error))]:.2f} mm")
+    print(f"{BENCHMARK_LATENCY_S * 1000:.0f} ms after capture p50/p95: raw {stale_error[len(stale_error) // 2]:.2f}/{stale_error[int(0.95 * len(stale_error))]:.2f} mm, "
+          f"predicted {predicted_error[len(predicted_error) // 2]:.2f}/{predicted_error[int(0.95 * len(predicted_error))]:.2f} mm")
+    print(f"{counters}; {retained} blocks retained after {len(detections)} more updates")
+
+
+if __name__ == "__main__":
+    benchmark()
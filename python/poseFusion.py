@@ -0,0 +1,235 @@
+import argparse
+import json
+import math
+import time
+
+import numpy as np
+
+# Fuses AprilTag detections from several cameras into one floor-frame (world) pose per tag.
+# Each camera has an extrinsic (camera -> world rotation R and translation t, in mm), so a
+# detection at p_cam becomes p_world = R @ p_cam + t. Observations of the same tag captured
+# within one fusion window are combined by inverse-variance weighting, with the variance of a
+# detection growing with its distance from the camera. Everything is done on arrays so one core
+# keeps up with 9 cameras x 30 FPS.
+#
+# Extrinsics file (JSON), one entry per camera index of multiCamLocalizer.py:
+#   {"0": {"rotation": [[1,0,0],[0,-1,0],[0,0,-1]], "translation": [0, 0, 2000]},
+#    "1": {"rvec": [3.1416, 0, 0], "translation": [1500, 0, 2000]}}
+
+FUSION_WINDOW_S = 0.02      # Detections captured within this of a group's first one count as simultaneous
+BASE_SIGMA_MM = 5.0         # Position standard deviation of a detection at REFERENCE_DISTANCE_MM
+REFERENCE_DISTANCE_MM = 1000.0
+MAX_OBSERVATIONS = 4096     # Size of the preallocated observation buffer (one flush worth)
+
+
+def rotation_from_rvec(rvec):
+    """Rodrigues vector to rotation matrix (same as cv2.Rodrigues, without needing OpenCV here)."""
+    rvec = np.asarray(rvec, dtype=np.float64).reshape(3)
+    theta = np.linalg.norm(rvec)
+    if theta < 1e-12:
+        return np.eye(3)
+    k = rvec / theta
+    K = np.array([[0, -k[2], k[1]], [k[2], 0, -k[0]], [-k[1], k[0], 0]])
+    return np.eye(3) + math.sin(theta) * K + (1 - math.cos(theta)) * (K @ K)
+
+
+def load_extrinsics(path):
+    """Returns {camera_id: (R 3x3, t 3)} from a JSON extrinsics file."""
+    with open(path, 'r') as f:
+        data = json.load(f)
+    extrinsics = {}
+    for camera_id, entry in data.items():
+        if "rotation" in entry:
+            rotation = np.asarray(entry["rotation"], dtype=np.float64).reshape(3, 3)
+        else:
+            rotation = rotation_from_rvec(entry.get("rvec", [0, 0, 0]))
+        translation = np.asarray(entry.get("translation", [0, 0, 0]), dtype=np.float64).reshape(3)
+        extrinsics[int(camera_id)] = (rotation, translation)
+    return extrinsics
+
+
+class PoseFusion:
+    """
+    Collects per-camera detections (add) and fuses them per tag and time window (flush).
+    add() matches the on_result hook of MultiCamLocalizer.
+    """
+    def __init__(self, extrinsics, window_s=FUSION_WINDOW_S, base_sigma_mm=BASE_SIGMA_MM,
+                 capacity=MAX_OBSERVATIONS):
+        camera_count = max(extrinsics) + 1 if extrinsics else 0
+        # Stacked extrinsics, indexed by camera id; cameras without an entry are marked unknown
+        self.rotations = np.tile(np.eye(3), (camera_count, 1, 1))
+        self.translations = np.zeros((camera_count, 3))
+        self.known = np.zeros(camera_count, dtype=bool)
+        for camera_id, (rotation, translation) in extrinsics.items():
+            self.rotations[camera_id] = rotation
+            self.translations[camera_id] = translation
+            self.known[camera_id] = True
+        self.window_s = window_s
+        self.base_variance = base_sigma_mm ** 2
+
+        # Preallocated observation buffer, filled by add() and emptied by flush()
+        self.capacity = capacity
+        self.count = 0
+        self.camera_ids = np.zeros(capacity, dtype=np.int32)
+        self.tag_ids = np.zeros(capacity, dtype=np.int32)
+        self.positions = np.zeros((capacity, 3))
+        self.yaws_deg = np.zeros(capacity)
+        self.timestamps = np.zeros(capacity)
+        self.unknown_cameras = set()
+        self.overflowed = 0
+
+    def add(self, camera_id, capture_ts, poses):
+        """Buffers the calibrated detections of one camera frame."""
+        if camera_id >= len(self.known) or not self.known[camera_id]:
+            if camera_id not in self.unknown_cameras:
+                self.unknown_cameras.add(camera_id)
+                print(f"Fusion: no extrinsics for camera {camera_id}, ignoring it")
+            return
+        for pose in poses:
+            if not pose.get("calibrated", True):
+                continue # Pixel-fallback poses are not in millimetres
+            if self.count == self.capacity:
+                self.overflowed += 1
+                continue
+            i = self.count
+            self.camera_ids[i] = camera_id
+            self.tag_ids[i] = pose["tag_id"]
+            self.positions[i] = (pose["x"], pose["y"], pose["z"])
+            self.yaws_deg[i] = pose["yaw"]
+            self.timestamps[i] = capture_ts
+            self.count += 1
+
+    def flush(self, before_ts=None):
+        """
+        Fuses the buffered observations captured before before_ts (all of them if None) and returns
+        a list of world poses, one per tag and window. Later observations stay buffered, so results
+        of slower cameras for the same moment can still join their group.
+        """
+        n = self.count
+        if n == 0:
+            return []
+        if before_ts is None:
+            self.count = 0
+            return self.fuse(self.camera_ids[:n], self.tag_ids[:n], self.positions[:n],
+                             self.yaws_deg[:n], self.timestamps[:n])
+
+        ready = self.timestamps[:n] < before_ts
+        if not ready.any():
+            return []
+        fused = self.fuse(self.camera_ids[:n][ready], self.tag_ids[:n][ready], self.positions[:n][ready],
+                          self.yaws_deg[:n][ready], self.timestamps[:n][ready])
+        # Move the observations that are not ready yet to the front of the buffer
+        waiting = ~ready
+        keep = int(waiting.sum())
+        for array in (self.camera_ids, self.tag_ids, self.positions, self.yaws_deg, self.timestamps):
+            array[:keep] = array[:n][waiting]
+        self.count = keep
+        return fused
+
+    def fuse(self, camera_ids, tag_ids, positions, yaws_deg, timestamps):
+        """Vectorized fusion of N observations given as arrays."""
+        # Camera frame -> world frame for every observation at once
+        rotations = self.rotations[camera_ids]
+        world = np.einsum('nij,nj->ni', rotations, positions) + self.translations[camera_ids]
+        # Yaw by rotating the tag's heading vector: a downward camera mirrors the floor, so adding the
+        # camera's own yaw would turn headings the wrong way
+        yaw = np.radians(yaws_deg)
+        heading = np.einsum('nij,nj->ni', rotations[:, :, :2], np.stack([np.cos(yaw), np.sin(yaw)], axis=1))
+        world_yaw = np.arctan2(heading[:, 1], heading[:, 0])
+
+        # Variance grows with the square of the distance from the camera (pixel error scales with depth)
+        distance = np.linalg.norm(positions, axis=1)
+        variance = self.base_variance * np.maximum(distance / REFERENCE_DISTANCE_MM, 0.1) ** 2
+        weights = 1.0 / variance
+
+        # One group per tag and window: sorted by tag then time, a group takes every capture within
+        # window_s of its first one. Bounding by the first capture, not the previous one, keeps
+        # unsynchronized cameras (a capture every few ms) from chaining a whole flush into one group
+        order = np.lexsort((timestamps, tag_ids))
+        sorted_tags = tag_ids[order]
+        sorted_ts = timestamps[order]
+        new_group = np.zeros(len(order), dtype=bool)
+        tag_starts = np.flatnonzero(np.r_[True, sorted_tags[1:] != sorted_tags[:-1]])
+        for first, end in zip(tag_starts, np.r_[tag_starts[1:], len(order)]):
+            i = first
+            while i < end: # One searchsorted per group
+                new_group[i] = True
+                i = first + int(np.searchsorted(sorted_ts[first:end], sorted_ts[i] + self.window_s, side='right'))
+        group = np.empty(len(order), dtype=np.int64)
+        group[order] = np.cumsum(new_group) - 1
+        groups = int(new_group.sum())
+        group_tags = sorted_tags[new_group]
+
+        weight_sum = np.bincount(group, weights, groups)
+        fused = np.empty((groups, 3))
+        for axis in range(3):
+            fused[:, axis] = np.bincount(group, weights * world[:, axis], groups) / weight_sum
+        # Yaw is averaged on the unit circle so 359 and 1 degrees fuse to 0, not 180
+        sin_sum = np.bincount(group, weights * np.sin(world_yaw), groups)
+        cos_sum = np.bincount(group, weights * np.cos(world_yaw), groups)
+        fused_yaw = (np.degrees(np.arctan2(sin_sum, cos_sum)) + 360.0) % 360.0
+        fused_ts = np.bincount(group, weights * timestamps, groups) / weight_sum
+        camera_count = np.bincount(group, minlength=groups)
+
+        return [{"tag_id": int(group_tags[g]), "x": float(fused[g, 0]), "y": float(fused[g, 1]),
+                 "z": float(fused[g, 2]), "yaw": float(fused_yaw[g]),
+                 "sigma_mm": float(math.sqrt(1.0 / weight_sum[g])), "cameras": int(camera_count[g]),
+                 "ts": float(fused_ts[g])} for g in range(groups)]
+
+
+def check(window_s=FUSION_WINDOW_S):
+    """
+    Sanity checks: a tag at +30 deg seen by the downward camera of the extrinsics example
+    ([[1,0,0],[0,-1,0],[0,0,-1]], which mirrors y) is at 330 deg in the world; captures from
+    unsynchronized cameras 3.7 ms apart over 100 ms are split into windows, not fused as one.
+    """
+    fusion = PoseFusion({0: (np.array([[1.0, 0, 0], [0, -1.0, 0], [0, 0, -1.0]]), np.array([0.0, 0.0, 2000.0]))},
+                        window_s=window_s)
+    fusion.add(0, 0.0, [{"tag_id": 1, "x": 0.0, "y": 0.0, "z": 2000.0, "yaw": 30.0}])
+    yaw = fusion.flush()[0]["yaw"]
+    assert abs(yaw - 330.0) < 1e-6, f"mirrored extrinsic: yaw {yaw:.1f}, expected 330.0"
+    for k in range(27):
+        fusion.add(0, k * 0.0037, [{"tag_id": 1, "x": 0.0, "y": 0.0, "z": 2000.0, "yaw": 0.0}])
+    groups = len(fusion.flush())
+    expected = math.ceil(26 * 0.0037 / (window_s + 1e-9))
+    assert groups >= expected, f"27 captures over {26 * 3.7:.0f} ms fused into {groups} groups"
+    print(f"Fusion checks passed (mirrored yaw 30 -> {yaw:.0f} deg, 27 staggered captures -> {groups} groups)")
+
+
+def benchmark(cameras=9, fps=30, seconds=10, tags=2):
+    """Times fusion of synthetic detections at the gantry's full rate, one flush per frame period."""
+    extrinsics = {i: (rotation_from_rvec([math.pi, 0, 0]), np.array([1500.0 * (i % 3), 1500.0 * (i // 3), 2000.0]))
+                  for i in range(cameras)}
+    fusion = PoseFusion(extrinsics)
+    rng = np.random.default_rng(1)
+    frames = fps * seconds
+    start_ts = time.time()
+    elapsed = 0.0
+    fused_count = 0
+    for frame in range(frames):
+        ts = start_ts + frame / fps
+        for camera_id in range(cameras):
+            poses = [{"tag_id": tag, "x": float(rng.normal(0, 300)), "y": float(rng.normal(0, 300)),
+                      "z": float(rng.normal(2000, 50)), "yaw": float(rng.uniform(0, 360)), "calibrated": True}
+                     for tag in range(tags)]
+            start = time.perf_counter()
+            fusion.add(camera_id, ts + rng.uniform(0, 0.005), poses)
+            elapsed += time.perf_counter() - start
+        start = time.perf_counter()
+        fused_count += len(fusion.flush())
+        elapsed += time.perf_counter() - start
+    observations = frames * cameras * tags
+    print(f"{observations} detections from {cameras} cameras x {fps} FPS x {seconds} s -> {fused_count} fused poses")
+    print(f"Fusion time {elapsed * 1000:.1f} ms for {seconds} s of data "
+          f"({elapsed / seconds * 100:.2f}% of one core, {observations / elapsed:.0f} detections/s)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Multi-camera pose fusion benchmark.")
+    parser.add_argument("--cameras", type=int, default=9)
+    parser.add_argument("--fps", type=int, default=30)
+    parser.add_argument("--seconds", type=int, default=10)
+    parser.add_argument("--tags", type=int, default=2)
+    args = parser.parse_args()
+    check()
+    benchmark(args.cameras, args.fps, args.seconds, args.tags)
@@ -0,0 +1,500 @@
+import csv
+import selectors
+import socket
+import struct
+import threading
+import time
+from collections import deque
+
+# Pose stream between the localizers (AprilTagTest14.py, multiCamLocalizer.py) and their consumers
+# (robotDirector, loggers). The server never blocks the detector: publish() only swaps the newest
+# message into each client's buffer and a selector thread does the sending. A client that can't keep
+# up skips to the newest poses instead of building a backlog.
+#
+# CSV format (default), one line per tag; the first five fields are the original AprilTagTest14 line:
+#   tag_id,x,y,z,yaw,seq,capture_ts[,grab_mono,detect_start_ms,detect_end_ms,pnp_end_ms,publish_ms]\n
+# Binary format, requested by a client sending "BINARY\n" after connecting, one record per frame:
+#   header '<4sIdH' (b"POS1", seq, capture_ts, tag count) + per tag '<i4f' (tag_id, x, y, z, yaw)
+#   or, with stage timing, header '<4sIdHd4f' (b"POS2", seq, capture_ts, tag count, grab_mono,
+#   detect_start_ms, detect_end_ms, pnp_end_ms, publish_ms) + the same per-tag records
+# Stage timing: grab_mono is time.monotonic() when the frame was grabbed, the other stages are
+# milliseconds after it. Monotonic clocks compare only on the same machine, so consumers on other
+# hosts should stick to capture_ts (wall clock).
+
+POSE_HOST = '127.0.0.1'
+POSE_PORT = 65432           # The port AprilTagTest14 always served on
+MAX_POSE_CLIENTS = 16
+BINARY_MAGIC = b"POS1"
+BINARY_HEADER = struct.Struct("<4sIdH")
+BINARY_TAG = struct.Struct("<i4f")
+TIMED_MAGIC = b"POS2"
+TIMED_HEADER = struct.Struct("<4sIdHd4f")
+TIMING_STAGES = ("detect_start_ms", "detect_end_ms", "pnp_end_ms", "publish_ms")
+LATENCY_WINDOW = 500        # Pose messages kept by PoseLatencyStats for the percentiles
+BINARY_REQUEST = b"BINARY\n"
+RECONNECT_DELAY_S = 2.0
+
+
+def timing_offsets(timing, publish_mono):
+    """
+    Stage stamps of one frame (monotonic: "grab", "detect_start", "detect_end", "pnp_end") ->
+    (grab_mono, detect_start_ms, detect_end_ms, pnp_end_ms, publish_ms), or None without a grab stamp.
+    """
+    grab = timing.get("grab") if timing else None
+    if grab is None:
+        return None
+    stamps = (timing.get("detect_start"), timing.get("detect_end"), timing.get("pnp_end"), publish_mono)
+    return (grab,) + tuple((stamp - grab) * 1000.0 if stamp is not None else float("nan") for stamp in stamps)
+
+
+def encode_csv(seq, capture_ts, poses, timing=None):
+    suffix = f",{timing[0]:.6f}," + ",".join(f"{t:.3f}" for t in timing[1:]) if timing else ""
+    return "".join(f"{p['tag_id']},{p['x']:.2f},{p['y']:.2f},{p['z']:.2f},{p['yaw']:.2f},{seq},{capture_ts:.6f}{suffix}\n"
+                   for p in poses).encode('utf-8')
+
+
+def encode_binary(seq, capture_ts, poses, timing=None):
+    if timing:
+        parts = [TIMED_HEADER.pack(TIMED_MAGIC, seq & 0xFFFFFFFF, capture_ts, len(poses), *timing)]
+    else:
+        parts = [BINARY_HEADER.pack(BINARY_MAGIC, seq & 0xFFFFFFFF, capture_ts, len(poses))]
+    parts.extend(BINARY_TAG.pack(int(p['tag_id']), p['x'], p['y'], p['z'], p['yaw']) for p in poses)
+    return b"".join(parts)
+
+
+def _timing_dict(values):
+    timing = {"grab_mono": values[0]}
+    timing.update(zip(TIMING_STAGES, values[1:]))
+    return timing
+
+
+def parse_csv_line(line):
+    """Parses one CSV pose line (old 5-field, 7-field or 12-field with timing). Returns a pose message or None."""
+    fields = line.split(b",")
+    if len(fields) < 5:
+        return None
+    try:
+        pose = {"tag_id": int(fields[0]), "x": float(fields[1]), "y": float(fields[2]),
+                "z": float(fields[3]), "yaw": float(fields[4])}
+        seq = int(fields[5]) if len(fields) > 5 else None
+        capture_ts = float(fields[6]) if len(fields) > 6 else None
+        timing = _timing_dict([float(f) for f in fields[7:12]]) if len(fields) >= 12 else None
+    except ValueError:
+        return None
+    return {"seq": seq, "capture_ts": capture_ts, "timing": timing, "poses": [pose]}
+
+
+class _PoseClient:
+    __slots__ = ("sock", "address", "binary", "sending", "latest", "skipped")
+
+    def __init__(self, sock, address):
+        self.sock = sock
+        self.address = address
+        self.binary = False
+        self.sending = None # memoryview of the message being written (may be partly sent)
+        self.latest = None  # Newest message waiting behind it; replaced, never queued
+        self.skipped = 0    # Messages replaced before this client could take them
+
+
+class PoseStreamServer:
+    """Non-blocking multi-client pose publisher with a latest-value buffer per client."""
+    def __init__(self, host=POSE_HOST, port=POSE_PORT):
+        self.host = host
+        self.port = port
+        self.selector = selectors.DefaultSelector()
+        self.clients = {} # socket -> _PoseClient
+        self.lock = threading.Lock()
+        self.listen_socket = None
+        self.wake_receive, self.wake_send = socket.socketpair() # publish() wakes the selector thread
+        self.wake_receive.setblocking(False)
+        self.wake_send.setblocking(False)
+        self.thread = None
+        self.running = False
+        self.seq = 0
+
+    def start(self):
+        self.listen_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listen_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listen_socket.bind((self.host, self.port))
+        self.listen_socket.listen(MAX_POSE_CLIENTS)
+        self.listen_socket.setblocking(False)
+        self.selector.register(self.listen_socket, selectors.EVENT_READ, "accept")
+        self.selector.register(self.wake_receive, selectors.EVENT_READ, "wake")
+        self.running = True
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+        self.thread.start()
+        print(f"Pose stream listening on {self.host}:{self.port}")
+
+    def client_count(self):
+        with self.lock:
+            return len(self.clients)
+
+    def publish(self, poses, capture_ts=None, timing=None):
+        """
+        Hands the poses of one frame to every client. Never blocks on a slow client.
+        timing holds the frame's monotonic stage stamps ("grab", "detect_start", "detect_end",
+        "pnp_end"); the publish stamp is taken here.
+        """
+        self.seq += 1
+        if capture_ts is None:
+            capture_ts = time.time()
+        timing = timing_offsets(timing, time.monotonic())
+        with self.lock:
+            if not self.clients:
+                return
+            csv_data = binary_data = None
+            for client in self.clients.values():
+                if client.binary:
+                    if binary_data is None:
+                        binary_data = encode_binary(self.seq, capture_ts, poses, timing)
+                    data = binary_data
+                else:
+                    if csv_data is None:
+                        csv_data = encode_csv(self.seq, capture_ts, poses, timing)
+                    data = csv_data
+                if not data:
+                    continue # No tags in this frame for the CSV format
+                if client.latest is not None:
+                    client.skipped += 1
+                client.latest = data
+        try:
+            self.wake_send.send(b"\0")
+        except (BlockingIOError, OSError):
+            pass # Wake byte already pending
+
+    def _loop(self):
+        while self.running:
+            for key, events in self.selector.select(timeout=0.5):
+                if key.data == "accept":
+                    self._accept()
+                elif key.data == "wake":
+                    try:
+                        while self.wake_receive.recv(4096):
+                            pass
+                    except (BlockingIOError, OSError):
+                        pass
+                    self._arm_writers()
+                else:
+                    client = key.data
+                    if events & selectors.EVENT_READ:
+                        self._read(client)
+                    if events & selectors.EVENT_WRITE and client.sock in self.clients:
+                        self._write(client)
+
+    def _accept(self):
+        try:
+            sock, address = self.listen_socket.accept()
+        except (BlockingIOError, OSError):
+            return
+        sock.setblocking(False)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        client = _PoseClient(sock, address)
+        with self.lock:
+            self.clients[sock] = client
+        self.selector.register(sock, selectors.EVENT_READ, client)
+        print(f"Pose client connected from {address}")
+
+    def _arm_writers(self):
+        with self.lock:
+            clients = [c for c in self.clients.values() if c.latest is not None or c.sending is not None]
+        for client in clients:
+            self.selector.modify(client.sock, selectors.EVENT_READ | selectors.EVENT_WRITE, client)
+
+    def _read(self, client):
+        try:
+            data = client.sock.recv(1024)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b""
+        if not data:
+            self._drop(client)
+            return
+        if BINARY_REQUEST.strip() in data:
+            with self.lock:
+                client.binary = True
+                # A waiting message is still CSV: drop it, the next frame goes out binary. One already
+                # being written is finished, and the client's binary parser resyncs past it
+                client.latest = None
+            print(f"Pose client {client.address} switched to binary")
+
+    def _write(self, client):
+        with self.lock:
+            if client.sending is None and client.latest is not None:
+                client.sending = memoryview(client.latest)
+                client.latest = None
+        if client.sending is not None:
+            try:
+                sent = client.sock.send(client.sending)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                self._drop(client)
+                return
+            client.sending = client.sending[sent:] if sent < len(client.sending) else None
+        with self.lock:
+            idle = client.sending is None and client.latest is None
+        if idle:
+            self.selector.modify(client.sock, selectors.EVENT_READ, client)
+
+    def _drop(self, client):
+        with self.lock:
+            self.clients.pop(client.sock, None)
+        try:
+            self.selector.unregister(client.sock)
+        except (KeyError, ValueError):
+            pass
+        client.sock.close()
+        print(f"Pose client {client.address} disconnected ({client.skipped} stale messages skipped)")
+
+    def stop(self):
+        self.running = False
+        if self.thread:
+            self.thread.join(timeout=1.0)
+        with self.lock:
+            clients = list(self.clients.values())
+        for client in clients:
+            self._drop(client)
+        if self.listen_socket:
+            self.selector.unregister(self.listen_socket)
+            self.listen_socket.close()
+            self.listen_socket = None
+        self.selector.close()
+        self.wake_receive.close()
+        self.wake_send.close()
+
+
+class PoseStreamClient:
+    """
+    Connects to a pose stream server in a background thread and calls on_pose(message) for every
+    pose message, where message = {"seq", "capture_ts", "recv_ts", "recv_mono", "timing", "poses": [{tag_id, x, y, z, yaw}, ...]}.
+    timing is None or {"grab_mono", "detect_start_ms", "detect_end_ms", "pnp_end_ms", "publish_ms"}.
+    Reconnects on its own when the localizer restarts.
+    """
+    def __init__(self, on_pose, host=POSE_HOST, port=POSE_PORT, binary=False):
+        self.on_pose = on_pose
+        self.host = host
+        self.port = port
+        self.binary = binary
+        self.running = False
+        self.connected = False
+        self.sock = None
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.sock:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+        if self.thread:
+            self.thread.join(timeout=1.0)
+
+    def _run(self):
+        while self.running:
+            try:
+                self.sock = socket.create_connection((self.host, self.port), timeout=1.0)
+            except OSError:
+                time.sleep(RECONNECT_DELAY_S)
+                continue
+            self.sock.settimeout(0.5)
+            self.connected = True
+            print(f"Connected to pose stream at {self.host}:{self.port}")
+            try:
+                if self.binary:
+                    self.sock.sendall(BINARY_REQUEST)
+                self._receive()
+            except OSError as e:
+                if self.running:
+                    print(f"Pose stream error: {e}")
+            finally:
+                self.connected = False
+                self.sock.close()
+                self.sock = None
+            if self.running:
+                time.sleep(RECONNECT_DELAY_S)
+
+    def _receive(self):
+        buffer = bytearray()
+        while self.running:
+            try:
+                chunk = self.sock.recv(65536)
+            except socket.timeout:
+                continue
+            if not chunk:
+                print("Pose stream closed by the server.")
+                return
+            recv_ts = time.time()
+            recv_mono = time.monotonic()
+            buffer += chunk
+            consumed = (self._parse_binary(buffer, recv_ts, recv_mono) if self.binary
+                        else self._parse_csv(buffer, recv_ts, recv_mono))
+            del buffer[:consumed]
+
+    def _parse_csv(self, buffer, recv_ts, recv_mono):
+        end = buffer.rfind(b"\n")
+        if end < 0:
+            return 0
+        for line in bytes(buffer[:end]).split(b"\n"):
+            message = parse_csv_line(line.strip())
+            if message:
+                message["recv_ts"] = recv_ts
+                message["recv_mono"] = recv_mono
+                self.on_pose(message)
+        return end + 1
+
+    def _parse_binary(self, buffer, recv_ts, recv_mono):
+        offset = 0
+        while len(buffer) - offset >= BINARY_HEADER.size:
+            magic = bytes(buffer[offset:offset + 4])
+            timing = None
+            if magic == BINARY_MAGIC:
+                header = BINARY_HEADER
+            elif magic == TIMED_MAGIC:
+                header = TIMED_HEADER
+                if len(buffer) - offset < header.size:
+                    break
+            else:
+                resync = min((i for i in (buffer.find(BINARY_MAGIC, offset + 1), buffer.find(TIMED_MAGIC, offset + 1)) if i >= 0),
+                             default=-1) # Lost framing: skip to the next record
+                return len(buffer) if resync < 0 else resync
+            values = header.unpack_from(buffer, offset)
+            seq, capture_ts, count = values[1:4]
+            if magic == TIMED_MAGIC:
+                timing = _timing_dict(values[4:])
+            size = header.size + count * BINARY_TAG.size
+            if len(buffer) - offset < size:
+                break
+            poses = []
+            for i in range(count):
+                tag_id, x, y, z, yaw = BINARY_TAG.unpack_from(buffer, offset + header.size + i * BINARY_TAG.size)
+                poses.append({"tag_id": tag_id, "x": x, "y": y, "z": z, "yaw": yaw})
+            offset += size
+            self.on_pose({"seq": seq, "capture_ts": capture_ts, "recv_ts": recv_ts, "recv_mono": recv_mono,
+                          "timing": timing, "poses": poses})
+        return offset
+
+
+class PoseLatencyStats:
+    """
+    Rolling per-stage latency of pose messages that carry stage timing, from grab to receipt:
+      queue      grab -> detect start (waiting for the detect thread)
+      detect     tag detection
+      pnp        pose estimation
+      publish    PnP end -> handed to the pose server
+      transport  publish -> received by the client
+      total      grab -> received
+      age        grab -> the pose was used (recorded by the consumer with record_age)
+    Optionally writes one CSV row per frame. Thread-safe: add() runs on the client thread,
+    summary() on whatever thread shows it.
+    """
+    STAGES = ("queue", "detect", "pnp", "publish", "transport", "total", "age")
+    MAX_SANE_TOTAL_MS = 10000.0 # Larger (or negative) totals mean the localizer runs on another host
+
+    def __init__(self, window=LATENCY_WINDOW, csv_path=None):
+        self.lock = threading.Lock()
+        self.samples = {stage: deque(maxlen=window) for stage in self.STAGES}
+        self.last_seq = None
+        self.frames = 0
+        self.untimed = 0
+        self.csv_file = None
+        self.csv_writer = None
+        if csv_path:
+            self.csv_file = open(csv_path, 'w', newline='')
+            self.csv_writer = csv.writer(self.csv_file)
+            self.csv_writer.writerow(["seq", "capture_ts", "recv_ts", "tags"] + [f"{stage}_ms" for stage in self.STAGES[:-1]])
+
+    def add(self, message):
+        """Records one pose message. CSV-format streams deliver a frame as several messages: only the first counts."""
+        timing = message.get("timing")
+        if timing is None:
+            self.untimed += 1
+            return None
+        if message["seq"] == self.last_seq:
+            return None
+        self.last_seq = message["seq"]
+        total = (message["recv_mono"] - timing["grab_mono"]) * 1000.0
+        if not 0.0 <= total <= self.MAX_SANE_TOTAL_MS:
+            total = transport = float("nan") # Different monotonic clocks: only the localizer-side stages mean anything
+        else:
+            transport = total - timing["publish_ms"]
+        stages = (timing["detect_start_ms"], timing["detect_end_ms"] - timing["detect_start_ms"],
+                  timing["pnp_end_ms"] - timing["detect_end_ms"], timing["publish_ms"] - timing["pnp_end_ms"],
+                  transport, total)
+        with self.lock:
+            self.frames += 1
+            for stage, value in zip(self.STAGES, stages):
+                if value == value: # Skip NaN
+                    self.samples[stage].append(value)
+            if self.csv_writer:
+                self.csv_writer.writerow([message["seq"], f"{message['capture_ts']:.6f}", f"{message['recv_ts']:.6f}",
+                                          len(message["poses"])] + [f"{value:.3f}" for value in stages])
+        return stages
+
+    def record_age(self, grab_mono, now_mono=None):
+        """Records how old a pose was (ms since its frame was grabbed) when the consumer acted on it."""
+        age = ((time.monotonic() if now_mono is None else now_mono) - grab_mono) * 1000.0
+        if 0.0 <= age <= self.MAX_SANE_TOTAL_MS:
+            with self.lock:
+                self.samples["age"].append(age)
+
+    def summary(self, percentiles=(50, 95, 99)):
+        """{stage: {"mean", "p50", "p95", ...}} over the window, for the stages that have samples."""
+        with self.lock:
+            snapshot = {stage: sorted(values) for stage, values in self.samples.items() if values}
+        result = {}
+        for stage in self.STAGES:
+            ordered = snapshot.get(stage)
+            if not ordered:
+                continue
+            stats = {"mean": sum(ordered) / len(ordered)}
+            for p in percentiles:
+                stats[f"p{p}"] = ordered[min(int(len(ordered) * p / 100), len(ordered) - 1)]
+            result[stage] = stats
+        return result
+
+    def flush(self):
+        if self.csv_file:
+            with self.lock:
+                self.csv_file.flush()
+
+    def close(self):
+        with self.lock:
+            if self.csv_file:
+                self.csv_file.close()
+                self.csv_file = None
+                self.csv_writer = None
+
+
+if __name__ == "__main__":
+    # Minimal logger: python poseStream.py [host] [port] [--binary] [--latency]
+    # --latency prints the per-stage latency percentiles every second instead of the poses
+    import sys
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    latency = PoseLatencyStats() if "--latency" in sys.argv else None
+
+    def on_pose(m):
+        if latency:
+            latency.add(m)
+            return
+        print(f"seq {m['seq']} age {(m['recv_ts'] - m['capture_ts']) * 1000 if m['capture_ts'] else 0:.1f} ms "
+              f"{[(p['tag_id'], round(p['x'], 1), round(p['y'], 1), round(p['yaw'], 1)) for p in m['poses']]}")
+
+    client = PoseStreamClient(on_pose, host=args[0] if args else POSE_HOST, port=int(args[1]) if len(args) > 1 else POSE_PORT,
+                              binary="--binary" in sys.argv)
+    client.start()
+    try:
+        while True:
+            time.sleep(1)
+            if latency:
+                summary = latency.summary()
+                print(" | ".join(f"{stage} {s['p50']:.1f}/{s['p95']:.1f}/{s['p99']:.1f}" for stage, s in summary.items())
+                      + f" ms (p50/p95/p99), {latency.frames} frames, {latency.untimed} untimed")
+    except KeyboardInterrupt:
+        client.stop()
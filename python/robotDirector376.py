@@ -4,6 +4,7 @@ from tkinter import filedialog # Import filedialog
 import serial
 import time
 import re
+import os
 import math # Import math for sqrt
 import socket
 import json
@@ -11,17 +12,34 @@ from tkinter import messagebox
 import struct
 import threading
 import queue
+from collections import deque
+from joystickProtocol import (TRANSPORT_TCP, TRANSPORT_MULTICAST, TRANSPORTS, UDP_PORT, MULTICAST_GROUP,
+                              LINK_REPORT_INTERVAL_S, LINK_STATS_WINDOW, LinkStats, LineFramer, decode_datagram,
+                              encode_datagram, format_link_summary)
+from poseStream import POSE_HOST, POSE_PORT, PoseLatencyStats, PoseStreamClient
+from poseFilter import PoseFilterBank
+from gcodePath import compile_file as compile_gcode_file
+from closedLoopFollower import ClosedLoopFollower, HEADING_OFFSET_DEG, POSE_TIMEOUT_S
+from omniKinematics import PathKinematics, max_feed as omni_max_feed
+from odometry import OdometryEstimator
+from velocityCalibration import CALIBRATION_FILE, VelocityCalibration, VelocityCalibrator, nominal_command
+from pathDeviation import DEVIATION_LOG, DeviationLogger, analyze_run as analyze_deviation
+from robotSimulator import SimulatedRobot
+from kinematicSimulator import SIM_PORT, SimulatedSerial
+
+LOCALIZATION_LATENCY_CSV = "localization_latency_%Y%m%d_%H%M%S.csv" # Per-frame stage latencies, one file per connection
+SERIAL_PORT = "/dev/ttyUSB0"    # Desktop bridge; "sim" (kinematicSimulator.SIM_PORT) runs the firmware simulator in its place
 
 class robotDirector:
 
-    def __init__(self, master): 
+    def __init__(self, master, serial_port=SERIAL_PORT):
         self.master = master
         master.title("Lyttle ReSearch Robot Director")
         master.config(bg="lightgreen")
         CE_PIN = 10 # GPIO17 (Physical pin 11)
         CSN_PIN = 9 # GPIO8 (Physical pin 24)
 
-        self.port = tk.StringVar(value="/dev/ttyUSB0") # <--- Define self.port FIRST!
+        self.port = tk.StringVar(value=serial_port) # <--- Define self.port FIRST!
         self.baud_rate = 115200 # <--- Define self.baud_rate FIRST!
 
         # NEW: Queue for commands to be sent by a dedicated sending thread
@@ -63,6 +81,34 @@ class robotDirector:
         self.y_pos = tk.DoubleVar(master, value=0.0)
         self.rotation_val = tk.DoubleVar(master, value=0.0)
         self.elevation_val = tk.DoubleVar(master, value=0.0)
+        self.localization_client = None # PoseStreamClient connected to AprilTagTest14 / multiCamLocalizer
+        self.localization_latest = None # Newest pose message, replaced by the client thread
+        self.localization_lock = threading.Lock()
+        self.localization_filter = PoseFilterBank() # Smooths every detection and predicts to the present
+        self.localization_tag = None    # Tag id of the robot shown in the display
+        self.velocity_calibration = self._load_velocity_calibration() # Command -> real velocity table, or None
+        self.velocity_calibrator = None # VelocityCalibrator while a calibration is running
+        self.odometry = self._new_odometry() # Sent commands integrated between localizer fixes
+        self.localization_update_job = None
+        self.localization_status = tk.StringVar(master, value="Localizer: not connected")
+        self.localization_latency = None # PoseLatencyStats of the current connection (also writes the CSV)
+        self.localization_latency_text = tk.StringVar(master, value="")
+        self.last_latency_report_time = 0.0
+
+        # --- Closed-loop G-code (fixed-rate control thread fed by the localizer, or the simulated robot) ---
+        self.gcode_closed_loop = tk.BooleanVar(master, value=False)
+        self.gcode_simulated = tk.BooleanVar(master, value=False)
+        self.follower = None          # ClosedLoopFollower while a closed-loop run is active
+        self.follower_speed_factor = 1.0
+        self.follower_simulated = False # The run drives the simulator (read from gcode_simulated at its start)
+        self.follower_skipped = 0     # Follower commands dropped because the serial queue was backed up
+        self.follower_monitor_job = None
+        self.follower_status = tk.StringVar(master, value="")
+        self.simulated_robot = None   # SimulatedRobot standing in for the robot and the localizer
+        self.btn_calibrate_velocity = None
+        self.deviation_log = None     # DeviationLogger of the running job's localizer poses
+        self.deviation_path = None    # The path that job runs (after feed limiting), to analyze the log against
+        self.deviation_origin = (0.0, 0.0)
 
         # --- New: Command Throttle Variable (in milliseconds) ---
         self.command_throttle_ms = tk.IntVar(master, value=30) # Default to 100ms throttle
@@ -73,7 +119,6 @@ class robotDirector:
         self.master.bind('<FocusIn>', self.focus_change_handler, add='+')
         self.master.bind('<FocusOut>', self.focus_change_handler, add='+')
         self.update_radio_status("Disconnected")
-        self.port = tk.StringVar(value="/dev/ttyUSB0")
         self.baud_rate = 115200
         self.connect_arduino_serial() # This will start serial and command sending threads
 
@@ -92,11 +137,21 @@ class robotDirector:
         self.joystick_connected = False # New flag for client connection status
         self.joystick_port = 52345
         self.joystick_host = '127.0.0.1'
-        self.joystick_buffer_size = 1024 
-        self.joystick_data_buffer = '' # Ensure this is a string
-        self.joystick_data_queue = queue.Queue() # Queue to pass data from thread to main GUI
+        self.joystick_buffer_size = 4096 # Several joystick messages per recv when the sender is fast (replay)
+        self.joystick_framer = LineFramer() # Reader-thread framing/decoding of the TCP stream
+        self.joystick_data_queue = queue.Queue() # Connection events (DISCONNECTED/ERROR_*) from the thread to the main GUI
+        self.joystick_latest_state = None # Newest accepted joystick state, replaced by the reader thread
+        self.joystick_state_lock = threading.Lock()
         self.joystick_read_thread = None # To hold the reference to the reading thread
         self.joystick_thread_running = False # Flag to control the thread's loop
+        self.joystick_transport = tk.StringVar(master, value=TRANSPORT_TCP) # TCP, UDP or Multicast
+        self.joystick_udp_port = UDP_PORT
+        self.joystick_link_stats = LinkStats() # Sequence/latency/loss tracking of the joystick stream
+        self.joystick_link_status = tk.StringVar(master, value="Link: no data")
+        self.joystick_sender_address = None # Where link reports go back to in UDP/Multicast mode
+        self.last_link_report_time = 0.0
+        self.joystick_serial_latency_ms = deque(maxlen=LINK_STATS_WINDOW) # Joystick send -> serial write, for replay load tests
+        self.joystick_commands_sent = 0 # Joystick-originated commands written to the bridge
         self._connect_to_joystick_server() # <<< ADD THIS LINE
 
         self.ROBOT_MAX_LINEAR_VELOCITY_MM_PER_SEC = 10000 # Adjust this to your robot's actual max linear speed in mm/sec
@@ -138,6 +193,22 @@ class robotDirector:
             if self.joystick_read_thread.is_alive():
                 print("[Warning] Joystick read thread did not terminate gracefully.")
 
+        # Stop the closed-loop follower, a velocity calibration and the simulated robot
+        if self.velocity_calibrator:
+            self.velocity_calibrator.stop()
+        if self.follower:
+            self.follower.stop()
+        if self.deviation_log:
+            self.deviation_log.close(self.follower.origin if self.follower else self.deviation_origin) # Analyze later with pathDeviation.py
+        if self.simulated_robot:
+            self.simulated_robot.stop()
+
+        # Stop the localization client
+        if self.localization_client:
+            self.localization_client.stop()
+        if self.localization_latency:
+            self.localization_latency.close()
+
         # Close serial port
         if self.serial_port and self.serial_port.is_open:
             print("Closing serial port...")
@@ -147,7 +218,8 @@ class robotDirector:
         if self.joystick_socket:
             print("Closing joystick socket...")
             try:
-                self.joystick_socket.shutdown(socket.SHUT_RDWR)
+                if self.joystick_socket.type == socket.SOCK_STREAM:
+                    self.joystick_socket.shutdown(socket.SHUT_RDWR)
                 self.joystick_socket.close()
             except OSError as e:
                 print(f"Error during joystick socket shutdown/close on exit: {e}")
@@ -202,15 +274,21 @@ class robotDirector:
             print("Joystick client connection already active.")
             return
 
+        if self.joystick_transport.get() != TRANSPORT_TCP:
+            self._open_joystick_datagram_socket()
+            return
+
         print(f"Attempting to connect to joystick server at {self.joystick_host}:{self.joystick_port}...")
         try:
             self.joystick_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM) # Initialize the actual socket
             self.joystick_socket.settimeout(1.0) # Set a timeout for the connection attempt
             self.joystick_socket.connect((self.joystick_host, self.joystick_port)) # Connect the socket
-            self.joystick_socket.setblocking(False) # Make the client socket non-blocking for data reception
+            self.joystick_socket.settimeout(0.5) # recv wakes up as soon as data arrives, timeout lets the thread see joystick_thread_running
 
             print(f"Successfully connected to joystick server at {self.joystick_host}:{self.joystick_port}")
-            self.joystick_data_buffer = '' # Clear buffer for new connection
+            self.joystick_framer.reset() # Clear buffer for new connection
+            self.joystick_latest_state = None
+            self.joystick_link_stats.reset()
             
             # Start the dedicated thread for receiving joystick data
             self.joystick_thread_running = True
@@ -236,10 +314,35 @@ class robotDirector:
             self._close_joystick_client_connection()
             # self.master.after(2000, self._connect_to_joystick_server) # Retry after 2 seconds - handled by _close_joystick_client_connection
 
+    def _open_joystick_datagram_socket(self):
+        """Binds a UDP socket (joining the multicast group if selected) to receive joystick datagrams."""
+        transport = self.joystick_transport.get()
+        print(f"Listening for {transport} joystick datagrams on port {self.joystick_udp_port}...")
+        try:
+            self.joystick_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.joystick_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1) # Let several listeners share a multicast port
+            self.joystick_socket.bind(('', self.joystick_udp_port))
+            if transport == TRANSPORT_MULTICAST:
+                membership = struct.pack("4s4s", socket.inet_aton(MULTICAST_GROUP), socket.inet_aton("0.0.0.0"))
+                self.joystick_socket.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+            self.joystick_socket.settimeout(0.5) # Lets the thread notice joystick_thread_running going False
+
+            self.joystick_link_stats.reset()
+            self.joystick_sender_address = None
+            self.joystick_thread_running = True
+            self.joystick_read_thread = threading.Thread(target=self._joystick_datagram_thread_target, daemon=True)
+            self.joystick_read_thread.start()
+            self.master.after(50, self._process_joystick_queue)
+            self.update_radio_status(f"Joystick {transport} Listening")
+        except OSError as e:
+            print(f"Error opening joystick {transport} socket: {e}")
+            self._close_joystick_client_connection()
+
     def _joystick_read_thread_target(self):
         """
         Target function for the joystick reading thread.
-        Continuously receives data from the joystick server and puts it into a queue.
+        Receives, frames and decodes the joystick stream and keeps only the newest accepted
+        state for the main thread, so the Tk thread never parses anything.
         """
         print("[Joystick Thread] Starting joystick data reception thread.")
         while self.joystick_thread_running and self.joystick_socket:
@@ -254,12 +357,14 @@ class robotDirector:
                     self.joystick_data_queue.put("DISCONNECTED") 
                     break # Exit loop
                 
-                # Decode and put the chunk into the queue
-                self.joystick_data_queue.put(chunk.decode('utf-8'))
-
-            except BlockingIOError:
-                # No data available, just continue loop and try again
-                time.sleep(0.01) # Small sleep to prevent busy-waiting and high CPU usage
+                # Every complete message of this read goes into the link stats; only the newest is decoded.
+                # Stale TCP messages queued behind head-of-line blocking are skipped, but the last one is kept
+                newest = self.joystick_framer.feed_newest(chunk, self.joystick_link_stats)
+                if newest is not None:
+                    self._set_latest_joystick_state(newest)
+
+            except socket.timeout:
+                continue # No data, check joystick_thread_running and wait again
             except socket.error as e:
                 print(f"[Joystick Thread] Socket error: {e}")
                 self.joystick_thread_running = False # Signal thread to stop
@@ -272,6 +377,68 @@ class robotDirector:
                 break # Exit loop
         print("[Joystick Thread] Exiting joystick data reception thread.")
 
+    def _joystick_datagram_thread_target(self):
+        """
+        Target function for the UDP/Multicast joystick thread.
+        Each datagram is one complete joystick state. Out-of-order datagrams are dropped here;
+        a late one is still the newest state there is, so it is counted as stale but applied.
+        """
+        print("[Joystick Thread] Starting joystick datagram reception thread.")
+        while self.joystick_thread_running and self.joystick_socket:
+            try:
+                data, sender = self.joystick_socket.recvfrom(2048)
+            except socket.timeout:
+                continue
+            except OSError as e:
+                if self.joystick_thread_running:
+                    print(f"[Joystick Thread] Socket error: {e}")
+                    self.joystick_data_queue.put("ERROR_SOCKET")
+                break
+            try:
+                joystick_data = decode_datagram(data)
+            except ValueError as e:
+                print(f"Robot: Received invalid joystick datagram: {e}")
+                continue
+            self.joystick_sender_address = sender
+            if isinstance(joystick_data, dict) and self.joystick_link_stats.accept(joystick_data):
+                self._set_latest_joystick_state(joystick_data)
+        print("[Joystick Thread] Exiting joystick datagram reception thread.")
+
+    def _set_latest_joystick_state(self, joystick_data):
+        """Called from the reading threads. Joystick states are absolute, so a newer one simply replaces an unapplied older one."""
+        with self.joystick_state_lock:
+            self.joystick_latest_state = joystick_data
+
+    def _take_latest_joystick_state(self):
+        with self.joystick_state_lock:
+            joystick_data = self.joystick_latest_state
+            self.joystick_latest_state = None
+        return joystick_data
+
+    def _report_joystick_link_stats(self):
+        """Shows link quality locally and sends it back to the joystick configurator about once a second."""
+        now = time.time()
+        if now - self.last_link_report_time < LINK_REPORT_INTERVAL_S:
+            return
+        self.last_link_report_time = now
+        summary = self.joystick_link_stats.summary()
+        status = f"{self.joystick_transport.get()}: {format_link_summary(summary)}"
+        latencies = sorted(self.joystick_serial_latency_ms)
+        if latencies:
+            # End-to-end: includes the command queue and the serial write, not just the network
+            status += (f" | to serial: {self.joystick_commands_sent} cmds, avg {sum(latencies) / len(latencies):.1f} ms,"
+                       f" p95 {latencies[int(0.95 * (len(latencies) - 1))]:.1f} ms")
+        self.joystick_link_status.set(status)
+        if not summary["received"] or not self.joystick_socket:
+            return
+        try:
+            if self.joystick_transport.get() == TRANSPORT_TCP:
+                self.joystick_socket.send((json.dumps(summary) + '\n').encode('utf-8'))
+            elif self.joystick_sender_address:
+                self.joystick_socket.sendto(encode_datagram(summary), self.joystick_sender_address)
+        except (BlockingIOError, OSError) as e:
+            print(f"Robot: Could not send joystick link report: {e}")
+
     def _process_joystick_queue(self):
         """
         Processes joystick data from the queue in the main Tkinter thread.
@@ -279,24 +446,20 @@ class robotDirector:
         """
         # --- NEW: Only process joystick data if "Joystick Control" is the active method ---
         if self.current_control_method != "Joystick Control":
-            # If not in joystick control mode, clear the queue to prevent backlog
-            while not self.joystick_data_queue.empty():
-                try:
-                    self.joystick_data_queue.get_nowait()
-                except queue.Empty:
-                    break # Should not happen with empty() check, but for safety
+            # If not in joystick control mode, drop the pending state so it isn't applied later
+            self._take_latest_joystick_state()
             # Reschedule itself to keep checking the queue, only if the thread is still alive
             if self.joystick_read_thread and self.joystick_read_thread.is_alive():
                 self.master.after(50, self._process_joystick_queue)
             return # Exit if not in joystick control mode
 
+        # Only connection events come through the queue; joystick states are already decoded
         while not self.joystick_data_queue.empty():
             item = self.joystick_data_queue.get_nowait() # Get item without blocking
             
             # Check for dummy item from on_closing to gracefully exit
             if item is None:
                 print("[Main Thread] Received None from joystick queue, stopping processing.")
-                # self.joystick_data_queue.task_done() # Not using task_done for simple queue
                 return
 
             if item == "DISCONNECTED" or item == "ERROR_SOCKET" or item == "ERROR_UNKNOWN":
@@ -304,96 +467,91 @@ class robotDirector:
                 self._close_joystick_client_connection() # Handle disconnection/error
                 return # Stop processing queue for now
 
-            # Append the received string chunk to the buffer
-            self.joystick_data_buffer += item 
-
-            # Process all complete messages in the buffer (messages are newline-separated JSON)
-            while '\n' in self.joystick_data_buffer:
-                message_string, self.joystick_data_buffer = self.joystick_data_buffer.split('\n', 1)
-                
-                if not message_string.strip(): # Skip empty strings from split
-                    continue
+        # Newest joystick state since the last tick; anything older was superseded in the reader thread
+        joystick_data = self._take_latest_joystick_state()
+        if joystick_data is not None:
+            try:
+                self._apply_joystick_state(joystick_data)
+            except (ValueError, TypeError) as e:
+                print(f"Robot: Data conversion error: {e} in '{joystick_data}'")
 
-                try:
-                    joystick_data = json.loads(message_string)
-
-                    # Update speed_var from joystick data if 'speed' key is present
-                    new_speed_multiplier_from_joystick = float(joystick_data.get("speed", self.speed_var.get()))
-                    
-                    # Only update speed_var if it's actually different to avoid unnecessary callbacks
-                    if abs(self.speed_var.get() - new_speed_multiplier_from_joystick) > 1e-6:
-                        self.speed_var.set(new_speed_multiplier_from_joystick) # Update Tkinter var, will trigger _update_gcode_feed_rate_from_slider
-
-                    #current_speed_factor = self.speed_var.get() # Get the *current* speed from the Tkinter variable
-                    #ron was here
-                    current_speed_factor = new_speed_multiplier_from_joystick
-
-                    temp_motion_command = {
-                        "x": float(joystick_data.get("x", 0.0)) * current_speed_factor,
-                        "y": float(joystick_data.get("y", 0.0)) * current_speed_factor,
-                        "rotation": float(joystick_data.get("r", 0.0)) * current_speed_factor,
-                        "laser_on": bool(joystick_data.get("laser", 0)),
-                        "laser_power": int(joystick_data.get("power", self.current_laser_power.get()))
-                    }
-
-                    # Only update Tkinter vars if there's a change to prevent unnecessary GUI updates
-                    if self.laser_on.get() != temp_motion_command["laser_on"]:
-                        self.laser_on.set(temp_motion_command["laser_on"])
-                    if self.current_laser_power.get() != temp_motion_command["laser_power"]:
-                        self.current_laser_power.set(temp_motion_command["laser_power"])
-                    
-                    # Store the current state in self.motion_command
-                    self.motion_command.update(temp_motion_command)
-
-                    # --- REVISED CRITICAL CHANGE: Only queue if there's a meaningful change ---
-                    # Check for changes in actual motion (X, Y, R)
-                    motion_x_changed = abs(self.motion_command["x"] - self.last_sent_motion_command["x"]) > 1e-6
-                    motion_y_changed = abs(self.motion_command["y"] - self.last_sent_motion_command["y"]) > 1e-6
-                    motion_r_changed = abs(self.motion_command["rotation"] - self.last_sent_motion_command["rotation"]) > 1e-6
-                    
-                    # Check for changes in laser state
-                    laser_on_changed = self.motion_command["laser_on"] != self.last_sent_motion_command["laser_on"]
-                    laser_power_changed = self.motion_command["laser_power"] != self.last_sent_motion_command["laser_power"]
-                    
-                    # Check for changes in speed factor.
-                    speed_factor_changed = abs(current_speed_factor - self.last_sent_motion_command.get("speed_factor", 0.0)) > 1e-6
-                    
-                    # Determine if a command needs to be queued
-                    should_queue_command = False
-                    
-                    # Rule 1: Always send if motion (X, Y, R) or laser state changes
-                    if motion_x_changed or motion_y_changed or motion_r_changed or laser_on_changed or laser_power_changed:
-                        should_queue_command = True
-                    # Rule 2: Send if speed factor changes AND there is active motion
-                    elif speed_factor_changed and (abs(self.motion_command["x"]) > 1e-6 or abs(self.motion_command["y"]) > 1e-6 or abs(self.motion_command["rotation"]) > 1e-6):
-                        should_queue_command = True
-                    # Rule 3: Send if speed factor changes to or from zero, even if robot is idle (for explicit speed context)
-                    elif speed_factor_changed and (
-                        (abs(self.last_sent_motion_command.get("speed_factor", 0.0)) < 1e-6 and abs(current_speed_factor) >= 1e-6) or # From zero to non-zero
-                        (abs(self.last_sent_motion_command.get("speed_factor", 0.0)) >= 1e-6 and abs(current_speed_factor) < 1e-6)    # From non-zero to zero
-                    ):
-                        should_queue_command = True
-                    # Rule 4: Send if speed factor changes significantly AND robot is idle AND new speed is NOT zero
-                    # This ensures the Arduino is aware of the new 'max speed' setting for future moves.
-                    elif speed_factor_changed and not (abs(self.motion_command["x"]) > 1e-6 or abs(self.motion_command["y"]) > 1e-6 or abs(self.motion_command["rotation"]) > 1e-6) and abs(current_speed_factor) >= 1e-6:
-                        should_queue_command = True
-
-                    if should_queue_command:
-                        self.command_send_queue.put(self.motion_command.copy())
-                        self.last_sent_motion_command = self.motion_command.copy()
-                        self.last_sent_motion_command["speed_factor"] = current_speed_factor # Store for comparison
-
-                except json.JSONDecodeError as e:
-                    print(f"Robot: Received invalid JSON data: {e} - '{message_string}'")
-                except ValueError as e:
-                    print(f"Robot: Data conversion error: {e} in '{message_string}'")
-                except Exception as e:
-                    print(f"Robot: Error processing joystick data: {e}")
+        self._report_joystick_link_stats()
 
         # Reschedule itself to keep checking the queue, only if the thread is still alive
         if self.joystick_read_thread and self.joystick_read_thread.is_alive():
             self.master.after(50, self._process_joystick_queue)
 
+    def _apply_joystick_state(self, joystick_data):
+        """Applies one decoded joystick state: updates speed/laser vars and queues a motion command if it changed."""
+        # Update speed_var from joystick data if 'speed' key is present
+        new_speed_multiplier_from_joystick = float(joystick_data.get("speed", self.speed_var.get()))
+
+        # Only update speed_var if it's actually different to avoid unnecessary callbacks
+        if abs(self.speed_var.get() - new_speed_multiplier_from_joystick) > 1e-6:
+            self.speed_var.set(new_speed_multiplier_from_joystick) # Update Tkinter var, will trigger _update_gcode_feed_rate_from_slider
+
+        #current_speed_factor = self.speed_var.get() # Get the *current* speed from the Tkinter variable
+        #ron was here
+        current_speed_factor = new_speed_multiplier_from_joystick
+
+        temp_motion_command = {
+            "x": float(joystick_data.get("x", 0.0)) * current_speed_factor,
+            "y": float(joystick_data.get("y", 0.0)) * current_speed_factor,
+            "rotation": float(joystick_data.get("r", 0.0)) * current_speed_factor,
+            "laser_on": bool(joystick_data.get("laser", 0)),
+            "laser_power": int(joystick_data.get("power", self.current_laser_power.get()))
+        }
+
+        # Only update Tkinter vars if there's a change to prevent unnecessary GUI updates
+        if self.laser_on.get() != temp_motion_command["laser_on"]:
+            self.laser_on.set(temp_motion_command["laser_on"])
+        if self.current_laser_power.get() != temp_motion_command["laser_power"]:
+            self.current_laser_power.set(temp_motion_command["laser_power"])
+
+        # Store the current state in self.motion_command
+        self.motion_command.update(temp_motion_command)
+
+        # --- REVISED CRITICAL CHANGE: Only queue if there's a meaningful change ---
+        # Check for changes in actual motion (X, Y, R)
+        motion_x_changed = abs(self.motion_command["x"] - self.last_sent_motion_command["x"]) > 1e-6
+        motion_y_changed = abs(self.motion_command["y"] - self.last_sent_motion_command["y"]) > 1e-6
+        motion_r_changed = abs(self.motion_command["rotation"] - self.last_sent_motion_command["rotation"]) > 1e-6
+
+        # Check for changes in laser state
+        laser_on_changed = self.motion_command["laser_on"] != self.last_sent_motion_command["laser_on"]
+        laser_power_changed = self.motion_command["laser_power"] != self.last_sent_motion_command["laser_power"]
+
+        # Check for changes in speed factor.
+        speed_factor_changed = abs(current_speed_factor - self.last_sent_motion_command.get("speed_factor", 0.0)) > 1e-6
+
+        # Determine if a command needs to be queued
+        should_queue_command = False
+
+        # Rule 1: Always send if motion (X, Y, R) or laser state changes
+        if motion_x_changed or motion_y_changed or motion_r_changed or laser_on_changed or laser_power_changed:
+            should_queue_command = True
+        # Rule 2: Send if speed factor changes AND there is active motion
+        elif speed_factor_changed and (abs(self.motion_command["x"]) > 1e-6 or abs(self.motion_command["y"]) > 1e-6 or abs(self.motion_command["rotation"]) > 1e-6):
+            should_queue_command = True
+        # Rule 3: Send if speed factor changes to or from zero, even if robot is idle (for explicit speed context)
+        elif speed_factor_changed and (
+            (abs(self.last_sent_motion_command.get("speed_factor", 0.0)) < 1e-6 and abs(current_speed_factor) >= 1e-6) or # From zero to non-zero
+            (abs(self.last_sent_motion_command.get("speed_factor", 0.0)) >= 1e-6 and abs(current_speed_factor) < 1e-6)    # From non-zero to zero
+        ):
+            should_queue_command = True
+        # Rule 4: Send if speed factor changes significantly AND robot is idle AND new speed is NOT zero
+        # This ensures the Arduino is aware of the new 'max speed' setting for future moves.
+        elif speed_factor_changed and not (abs(self.motion_command["x"]) > 1e-6 or abs(self.motion_command["y"]) > 1e-6 or abs(self.motion_command["rotation"]) > 1e-6) and abs(current_speed_factor) >= 1e-6:
+            should_queue_command = True
+
+        if should_queue_command:
+            command_to_queue = self.motion_command.copy()
+            if "ts" in joystick_data:
+                command_to_queue["source_ts"] = joystick_data["ts"] # For joystick-to-serial latency
+            self.command_send_queue.put(command_to_queue)
+            self.last_sent_motion_command = self.motion_command.copy()
+            self.last_sent_motion_command["speed_factor"] = current_speed_factor # Store for comparison
+
     # --- Modified Close Connection Method (for client) ---
     def _close_joystick_client_connection(self):
         """
@@ -406,7 +564,8 @@ class robotDirector:
         # Close the socket if it exists
         if self.joystick_socket: # Use self.joystick_socket consistently
             try:
-                self.joystick_socket.shutdown(socket.SHUT_RDWR) # Attempt graceful shutdown
+                if self.joystick_socket.type == socket.SOCK_STREAM: # Datagram sockets have no connection to shut down
+                    self.joystick_socket.shutdown(socket.SHUT_RDWR) # Attempt graceful shutdown
                 self.joystick_socket.close()
                 print("Joystick client socket closed.")
             except OSError as e:
@@ -436,8 +595,15 @@ class robotDirector:
     def create_joystick_control_area(self, parent_frame, event=None):
         ttk.Label(parent_frame, text="Joystick Control", background="lightgray").pack(padx=10, pady=10)
         # Optional: Add a connect/disconnect button here
+        transport_frame = ttk.Frame(parent_frame)
+        transport_frame.pack(pady=5)
+        ttk.Label(transport_frame, text="Transport:").pack(side=tk.LEFT, padx=5)
+        ttk.Combobox(transport_frame, textvariable=self.joystick_transport, values=TRANSPORTS,
+                     state="readonly", width=10).pack(side=tk.LEFT, padx=5)
         ttk.Button(parent_frame, text="Connect to Joystick Server", command=self._connect_to_joystick_server).pack(pady=5)
         ttk.Button(parent_frame, text="Disconnect Joystick", command=self._close_joystick_client_connection).pack(pady=5)
+        # One-way latency and loss of the joystick stream (needs synced clocks when on another machine)
+        ttk.Label(parent_frame, textvariable=self.joystick_link_status).pack(pady=5)
 
     def send_control_command(self):
         """
@@ -488,6 +654,10 @@ class robotDirector:
             )
 
             self.serial_port.write(command_string.encode('utf-8'))
+            self.odometry.command(command_data, time.time()) # Stamped when it actually went out
+            if "source_ts" in command_data:
+                self.joystick_serial_latency_ms.append((time.time() - command_data["source_ts"]) * 1000.0)
+                self.joystick_commands_sent += 1
             # Update GUI status on main thread (must use master.after for thread safety)
             self.master.after(0, lambda s=command_string.strip(): self.radio_status.set(f"Bridge Sent: {s}"))
             print(f"  [SENT VIA BRIDGE] {command_string.strip()}")
@@ -598,7 +768,11 @@ class robotDirector:
 
         try:
             # Use self.port.get() to get the current port string
-            self.serial_port = serial.Serial(self.port.get(), self.baud_rate, timeout=1)
+            if self.port.get() == SIM_PORT:
+                # The firmware simulated in real time; "Connect Localizer" picks up its poses
+                self.serial_port = SimulatedSerial().start(POSE_PORT)
+            else:
+                self.serial_port = serial.Serial(self.port.get(), self.baud_rate, timeout=1)
             print(f"Connected to Arduino on {self.port.get()} at {self.baud_rate} baud.")
             self.arduino_connected = True
             self.update_radio_status("Connected")  # Update status to indicate connection
@@ -621,7 +795,7 @@ class robotDirector:
             self.last_sent_motion_command["speed_factor"] = self.speed_var.get() # Also store initial speed factor
 
 
-        except serial.SerialException as e:
+        except (serial.SerialException, OSError) as e: # OSError: the simulator's pose port is taken
             print(f"Error connecting to Arduino on {self.port.get()}: {e}")
             self.serial_port = None
             self.arduino_connected = False
@@ -879,6 +1053,11 @@ class robotDirector:
         robot_location_init_frame.grid_columnconfigure(0, weight=1)
 
         ttk.Button(robot_location_init_frame, text="Initialize Location", command=self.initiate_localization).grid(row=0, column=0, padx=5, pady=5)
+        self.localization_button = ttk.Button(robot_location_init_frame, text="Connect Localizer", command=self.toggle_localization_client)
+        self.localization_button.grid(row=0, column=1, padx=5, pady=5)
+        ttk.Label(robot_location_init_frame, textvariable=self.localization_status).grid(row=1, column=0, columnspan=2, padx=5, pady=2, sticky="w")
+        ttk.Label(robot_location_init_frame, textvariable=self.localization_latency_text, font=("TkFixedFont", 8),
+                  justify="left").grid(row=2, column=0, columnspan=2, padx=5, pady=2, sticky="w")
 
         # --- Status Frame (NEW!) ---
         status_frame = ttk.Frame(self.master, style="TFrame")
@@ -973,6 +1152,124 @@ class robotDirector:
             print("Robot Location Initialization Failed.")
             self.update_radio_status("Failure")
 
+    # --- Localization Client (pose stream from the AprilTag localizer) ---
+    def toggle_localization_client(self):
+        """Connects to or disconnects from the localizer's pose stream."""
+        if self.localization_update_job:
+            self.master.after_cancel(self.localization_update_job)
+            self.localization_update_job = None
+        if self.localization_client:
+            self.localization_client.stop()
+            self.localization_client = None
+            self.localization_tag = None
+            with self.localization_lock:
+                self.odometry = self._new_odometry()
+            self.localization_latency.close()
+            self.localization_latency = None
+            self.localization_button.config(text="Connect Localizer")
+            self.localization_status.set("Localizer: not connected")
+            return
+        latency_csv = time.strftime(LOCALIZATION_LATENCY_CSV)
+        self.localization_latency = PoseLatencyStats(csv_path=latency_csv)
+        self.localization_latency_text.set("")
+        print(f"Logging localization latency to {latency_csv}")
+        # Binary records: no text parsing, and the whole frame's tags arrive together
+        self.localization_client = PoseStreamClient(self._on_localization_pose, host=POSE_HOST, port=POSE_PORT, binary=True)
+        self.localization_client.start()
+        self.localization_button.config(text="Disconnect Localizer")
+        self.localization_status.set(f"Localizer: connecting to {POSE_HOST}:{POSE_PORT}...")
+        self.localization_update_job = self.master.after(50, self._process_localization_updates)
+
+    def _on_localization_pose(self, message):
+        """
+        Called in the client thread. Every detection goes through the pose filter, keyed on its
+        capture time; only the newest message is kept for the Tk thread's status line.
+        """
+        capture_ts = message["capture_ts"] or message["recv_ts"] # Old CSV localizers send no capture time
+        latency = self.localization_latency
+        if latency:
+            latency.add(message) # Stage breakdown from the localizer's stamps plus our receive time
+        with self.localization_lock:
+            for pose in message["poses"]:
+                self.localization_filter.update(pose["tag_id"], capture_ts, pose["x"], pose["y"], pose["yaw"])
+            self.localization_latest = message
+            tag_id = self.localization_tag
+            odometry = self.odometry # Replaced under this lock when the localizer reconnects
+        for pose in message["poses"]:
+            if tag_id is None or pose["tag_id"] == tag_id: # Raw detections: the odometry does its own smoothing
+                odometry.fix(pose["x"], pose["y"], pose["yaw"], capture_ts)
+                calibrator = self.velocity_calibrator
+                if calibrator:
+                    calibrator.add_pose(capture_ts, pose["x"], pose["y"], pose["yaw"])
+                deviation_log = self.deviation_log
+                if deviation_log:
+                    deviation_log.add(capture_ts, pose["x"], pose["y"], pose["yaw"])
+                break
+
+    def get_predicted_pose(self, tag_id=None, now=None):
+        """
+        (x, y, yaw) of a robot now, or None. Safe to call from any thread. The robot we drive comes from
+        the odometry while it has fixes (commands integrated since the last frame); otherwise, and for
+        the simulator, which takes its commands directly, the filter's extrapolation.
+        """
+        if (tag_id is None or tag_id == self.localization_tag) and not self.simulated_robot:
+            pose = self.odometry.pose(now)
+            if pose:
+                return pose
+        with self.localization_lock:
+            return self.localization_filter.predict(self.localization_tag if tag_id is None else tag_id, now)
+
+    def _process_localization_updates(self):
+        """Applies the newest localizer pose to the position display. Runs every 50 ms on the Tk thread."""
+        if not self.localization_client and not self.simulated_robot:
+            self.localization_update_job = None
+            return
+        with self.localization_lock:
+            message = self.localization_latest
+            self.localization_latest = None
+        if message and message["poses"] and self.localization_tag is None:
+            self.localization_tag = message["poses"][0]["tag_id"] # One tag per robot; follow the first one seen
+        if message and message["timing"] and self.localization_latency:
+            self.localization_latency.record_age(message["timing"]["grab_mono"]) # How old the pose is when we use it
+        predicted = self.get_predicted_pose()
+        if predicted:
+            # Show where the robot is now, not where it was when the frame was captured
+            x, y, yaw = predicted
+            self.x_pos.set(round(x, 2))
+            self.y_pos.set(round(y, 2))
+            self.rotation_val.set(round(yaw, 2))
+        if message and message["poses"] and predicted:
+            age_ms = (time.time() - message["capture_ts"]) * 1000.0 if message["capture_ts"] else 0.0
+            pose_filter = self.localization_filter
+            self.localization_status.set(f"Localizer: tag {self.localization_tag} X {x:.1f} Y {y:.1f} Yaw {yaw:.1f} "
+                                         f"(seq {message['seq']}, {age_ms:.0f} ms old, "
+                                         f"{pose_filter.rejected} outliers rejected)")
+        elif self.localization_client and not self.localization_client.connected:
+            self.localization_status.set("Localizer: waiting for pose stream...")
+        self._report_localization_latency()
+        self.localization_update_job = self.master.after(50, self._process_localization_updates)
+
+    def _report_localization_latency(self):
+        """Shows the rolling per-stage latency percentiles, once per LINK_REPORT_INTERVAL_S."""
+        now = time.perf_counter()
+        if now - self.last_latency_report_time < LINK_REPORT_INTERVAL_S or not self.localization_latency:
+            return
+        self.last_latency_report_time = now
+        latency = self.localization_latency
+        latency.flush()
+        summary = latency.summary()
+        if not summary:
+            if latency.untimed:
+                self.localization_latency_text.set("Latency: localizer sends no stage timing")
+            return
+        # One line per stage: p50 / p95 / p99 over the last frames
+        lines = [f"Latency ms  p50 /  p95 /  p99  ({latency.frames} frames)"]
+        for stage, stats in summary.items():
+            lines.append(f"{stage:<10}{stats['p50']:6.1f} /{stats['p95']:6.1f} /{stats['p99']:6.1f}")
+        if self.odometry.fixes:
+            lines.append(self.odometry.stats_line())
+        self.localization_latency_text.set("\n".join(lines))
+
     def read_keyboard(self, event):
         # --- NEW: Check if an Entry widget has focus ---
         focused_widget = self.master.focus_get()
@@ -1048,6 +1345,9 @@ class robotDirector:
         if not self.gcode_file_path.get():
             self.update_gcode_status("Error: No G-code file selected to start.")
             return
+        if self.gcode_closed_loop.get():
+            self._start_closed_loop_gcode()
+            return
 
         # To ensure a fresh start and reset all internal G-code state variables,
         # we re-load the file. This will re-populate self.gcode_queue and reset
@@ -1063,6 +1363,18 @@ class robotDirector:
             self.btn_stop_gcode.config(state=tk.DISABLED)
             return
 
+        # Log where the robot really goes, if the localizer can see it: G-code (0, 0) is where it starts
+        pose = self.get_predicted_pose()
+        if pose:
+            try:
+                path = compile_gcode_file(self.gcode_file_path.get())
+            except (OSError, ValueError) as e:
+                print(f"No path deviation log: {e}")
+                path = None
+            if path and path.segment_count:
+                max_speed = self.speed_var.get() * self.ROBOT_MAX_LINEAR_VELOCITY_MM_PER_SEC
+                self._start_deviation_log(PathKinematics(path).limited_path(), pose[:2], max_speed=max_speed)
+
         # Now, activate processing and begin the loop
         self.gcode_processing_active = True
         self.btn_start_gcode.config(state=tk.DISABLED) # Disable start button
@@ -1074,6 +1386,10 @@ class robotDirector:
     def stop_gcode_execution(self):
         """Stops G-code processing and sends a stop command to the robot."""
         self.gcode_processing_active = False
+        if self.follower:
+            self.follower.stop() # Sends the zero command itself
+            self._finish_closed_loop_gcode()
+        self._finish_deviation_log()
         self.motion_command["x"] = 0.0 # Stop robot movement
         self.motion_command["y"] = 0.0
         self.motion_command["rotation"] = 0.0
@@ -1084,6 +1400,225 @@ class robotDirector:
         self.update_gcode_status("G-code processing stopped by user.")
         print("[DEBUG GCODE] G-code processing stopped by user.")
 
+    # --- Closed-loop G-code execution ---
+    def _start_closed_loop_gcode(self):
+        """Compiles the G-code file and runs it in a ClosedLoopFollower, on the robot or the simulator."""
+        try:
+            path = compile_gcode_file(self.gcode_file_path.get())
+        except (OSError, ValueError) as e:
+            self.update_gcode_status(f"Error compiling G-code: {e}")
+            return
+        if path.segment_count == 0:
+            self.update_gcode_status("Error: no moves in the G-code file.")
+            return
+
+        simulated = self.gcode_simulated.get() # Read here: Tk variables stay on the Tk thread
+        if simulated:
+            if self.simulated_robot:
+                self.simulated_robot.stop()
+            with self.localization_lock:
+                self.localization_filter = PoseFilterBank() # Forget the real robot's track
+            self.simulated_robot = SimulatedRobot(on_pose=self._on_localization_pose).start()
+            self.localization_tag = self.simulated_robot.tag_id
+            if not self.localization_update_job:
+                self.localization_update_job = self.master.after(50, self._process_localization_updates)
+        else:
+            if not self.arduino_connected:
+                self.update_gcode_status("Error: closed loop needs the serial bridge connected.")
+                return
+            if self._follower_pose() is None:
+                self.update_gcode_status("Error: closed loop needs a current localizer pose (connect the localizer).")
+                return
+
+        self.follower_speed_factor = self.speed_var.get()
+        self.follower_simulated = simulated
+        self.follower_skipped = 0
+        # Check the job against the firmware's wheel limits at the heading it starts at, and slow the
+        # segments that would saturate a wheel. The follower's mm/s reach the wheels unscaled, so the
+        # speed slider plays no part in it
+        pose = None if simulated else self._follower_pose()
+        kinematics = PathKinematics(path, heading_deg=(pose[2] if pose else 0.0) - HEADING_OFFSET_DEG)
+        print(f"[GCODE KINEMATICS] {kinematics.summary()}")
+        path = kinematics.limited_path()
+        # The path is anchored at the robot: G-code (0, 0) is wherever the robot stands at the start
+        self.follower = ClosedLoopFollower(path, self._follower_pose, self._send_follower_command, anchor=True)
+        # The follower's mm/s reach the wheels unscaled (the firmware ignores the S field), on the robot as in the simulator
+        self._start_deviation_log(path, speed_factor=1.0, max_speed=self.follower.max_speed)
+        self.follower.start()
+        self.gcode_processing_active = True
+        self.btn_start_gcode.config(state=tk.DISABLED)
+        self.btn_stop_gcode.config(state=tk.NORMAL)
+        self.update_gcode_status(f"Closed loop: {path.segment_count} segments, {path.length:.0f} mm"
+                                 f"{' (simulated robot)' if self.simulated_robot else ''}")
+        self.follower_monitor_job = self.master.after(250, self._monitor_closed_loop_gcode)
+
+    def _follower_pose(self):
+        """Pose predicted for now, or None if the localizer hasn't seen the robot lately. Control thread."""
+        with self.localization_lock:
+            tag_id = self.localization_tag
+            last_seen = self.localization_filter.last_seen(tag_id) if tag_id is not None else None
+            if last_seen is None or time.time() - last_seen > POSE_TIMEOUT_S:
+                return None
+        return self.get_predicted_pose(tag_id)
+
+    def _send_follower_command(self, vx, vy, omega, laser_on, laser_power):
+        """Follower output (robot-frame mm/s, deg/s) to the simulator or the serial bridge. Control thread."""
+        if self.follower_simulated:
+            self.simulated_robot.command(vx, vy, omega, laser_on, laser_power)
+            return
+        if self.command_send_queue.qsize() >= 2:
+            self.follower_skipped += 1 # The bridge is behind: the next iteration sends a fresher command anyway
+            return
+        x, y, rotation = self._velocity_command(vx, vy, omega) # m/s and rev/s, like the open-loop G-code moves
+        self.command_send_queue.put({
+            "x": x,
+            "y": y,
+            "rotation": rotation,
+            "laser_on": laser_on,
+            "laser_power": laser_power,
+            "speed_factor": self.follower_speed_factor,
+        })
+
+    # --- Velocity calibration ---
+    def _load_velocity_calibration(self):
+        if not os.path.exists(CALIBRATION_FILE):
+            return None
+        try:
+            calibration = VelocityCalibration.load(CALIBRATION_FILE)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Could not load {CALIBRATION_FILE}: {e}")
+            return None
+        print(calibration.summary())
+        return calibration
+
+    def _new_odometry(self):
+        calibration = self.velocity_calibration
+        return OdometryEstimator(calibration.velocity_model) if calibration else OdometryEstimator()
+
+    def _velocity_command(self, vx, vy, omega):
+        """Robot-frame velocity wanted (mm/s, mm/s, deg/s) -> serial command (m/s, m/s, rev/s), calibrated if we can."""
+        calibration = self.velocity_calibration
+        return calibration.command_for(vx, vy, omega) if calibration else nominal_command(vx, vy, omega)
+
+    def toggle_velocity_calibration(self):
+        """Drives the calibration runs with the localizer watching, or stops them."""
+        if self.velocity_calibrator:
+            self.velocity_calibrator.stop()
+            return
+        if self.follower or self.gcode_processing_active:
+            self.follower_status.set("Calibration: stop the G-code run first.")
+            return
+        if not self.arduino_connected:
+            self.follower_status.set("Calibration: needs the serial bridge connected.")
+            return
+        if self._follower_pose() is None:
+            self.follower_status.set("Calibration: needs a current localizer pose (connect the localizer).")
+            return
+        speed_factor = self.speed_var.get()
+
+        def send(command):
+            command["speed_factor"] = speed_factor
+            self.command_send_queue.put(command)
+
+        self.velocity_calibrator = VelocityCalibrator(send)
+        threading.Thread(target=self.velocity_calibrator.run, daemon=True).start()
+        if self.btn_calibrate_velocity:
+            self.btn_calibrate_velocity.config(text="Stop Calibration")
+        self.master.after(500, self._monitor_velocity_calibration)
+
+    def _monitor_velocity_calibration(self):
+        calibrator = self.velocity_calibrator
+        if not calibrator:
+            return
+        if calibrator.running:
+            self.follower_status.set(f"Calibration: {calibrator.completed} of {len(calibrator.tests)} runs measured")
+            self.master.after(500, self._monitor_velocity_calibration)
+            return
+        self.velocity_calibrator = None
+        if self.btn_calibrate_velocity:
+            self.btn_calibrate_velocity.config(text="Calibrate Velocity")
+        if calibrator.result is None:
+            self.follower_status.set(f"Calibration failed: {calibrator.error}")
+            return
+        calibrator.result.save(CALIBRATION_FILE)
+        self.velocity_calibration = calibrator.result
+        # Only the model changes: the estimator keeps its fixes, and commands already integrated keep their velocities
+        self.odometry.velocity_model = calibrator.result.velocity_model
+        self.follower_status.set(f"{calibrator.result.summary()} (saved to {CALIBRATION_FILE})")
+        print(self.follower_status.get())
+
+    def _monitor_closed_loop_gcode(self):
+        """Shows the follower's loop rate, jitter and tracking error; cleans up when it is done. Tk thread."""
+        self.follower_monitor_job = None
+        follower = self.follower
+        if not follower:
+            return
+        self.follower_status.set(follower.stats_line() + (f", {self.follower_skipped} commands skipped"
+                                                          if self.follower_skipped else ""))
+        if follower.running:
+            self.follower_monitor_job = self.master.after(250, self._monitor_closed_loop_gcode)
+            return
+        print(self.follower_status.get())
+        self._finish_closed_loop_gcode()
+
+    def _finish_closed_loop_gcode(self):
+        follower = self.follower
+        self.follower = None
+        self.gcode_processing_active = False
+        if self.follower_monitor_job:
+            self.master.after_cancel(self.follower_monitor_job)
+            self.follower_monitor_job = None
+        self._finish_deviation_log(follower.origin) # Where the follower anchored the path
+        if follower.finished:
+            self.update_gcode_status(f"Closed-loop G-code {follower.result_line()}.")
+        elif follower.abort_reason:
+            self.update_gcode_status(f"Closed-loop G-code aborted: {follower.abort_reason}")
+        else:
+            self.update_gcode_status(f"Closed-loop G-code stopped at {follower.progress() * 100:.1f}%.")
+        self.btn_start_gcode.config(state=tk.NORMAL)
+        self.btn_stop_gcode.config(state=tk.DISABLED)
+        if self.simulated_robot:
+            self._stop_simulated_robot()
+
+    def _stop_simulated_robot(self):
+        """Stops the simulator and forgets its track, so the next run sees only the real robot."""
+        self.simulated_robot.stop()
+        self.simulated_robot = None
+        self.follower_simulated = False
+        self.localization_tag = None
+        with self.localization_lock:
+            self.localization_filter = PoseFilterBank()
+            self.localization_latest = None
+            self.odometry = self._new_odometry()
+
+    # --- Path deviation (planned versus localized path of a run) ---
+    def _start_deviation_log(self, path, origin=(0.0, 0.0), speed_factor=1.0, max_speed=None):
+        if not self.localization_client and not self.simulated_robot:
+            return # Nothing to log
+        csv_path = time.strftime(DEVIATION_LOG)
+        self.deviation_path = path
+        self.deviation_origin = origin
+        self.deviation_log = DeviationLogger(csv_path, self.gcode_file_path.get(), speed_factor, max_speed)
+        print(f"Logging the run's poses to {csv_path}")
+
+    def _finish_deviation_log(self, origin=None):
+        """Closes the run's pose log and analyzes it in the background (a long job takes a second or so)."""
+        deviation_log, path = self.deviation_log, self.deviation_path
+        if not deviation_log:
+            return
+        self.deviation_log = None
+        self.deviation_path = None
+        deviation_log.close(self.deviation_origin if origin is None else origin)
+        heatmap_path = deviation_log.csv_path.rsplit(".", 1)[0] + "_heatmap.png"
+
+        def analyze():
+            try:
+                print(analyze_deviation(path, deviation_log.csv_path, heatmap_path))
+            except (OSError, ValueError) as e:
+                print(f"Path deviation analysis failed: {e}")
+
+        threading.Thread(target=analyze, daemon=True).start()
+
     def select_gcode_file(self):
         """
         Opens a file dialog to select a G-code (.nc, .gcode, .txt) file.
@@ -1311,6 +1846,17 @@ class robotDirector:
                 current_feed_rate_mps = effective_max_speed_mps
                 print(f"[DEBUG GCODE] G-code feed rate capped by GUI slider to {current_feed_rate_mps:.4f} m/s")
 
+            # Limit to what the wheels can do in this direction: past it a wheel saturates, the robot moves
+            # slower than planned for the planned time and falls short
+            feasible_mps = omni_max_feed(dx_mm, dy_mm) * MM_TO_M_SCALE
+            if self.velocity_calibration and total_distance_m >= 1e-6:
+                # The limit is on the command; the calibration says how fast that command really goes
+                unit_x, unit_y, _ = self._velocity_command(dx_mm / (total_distance_m * 1000.0), dy_mm / (total_distance_m * 1000.0), 0.0)
+                feasible_mps /= math.hypot(unit_x, unit_y) * 1000.0
+            if current_feed_rate_mps > feasible_mps:
+                current_feed_rate_mps = feasible_mps
+                print(f"[DEBUG GCODE] G-code feed rate capped by wheel limits to {current_feed_rate_mps:.4f} m/s")
+
             # Handle very small distances (effectively no movement)
             if total_distance_m < 1e-6: # Treat very small distances as no movement (e.g., less than 1 micrometer)
                 #print("[DEBUG GCODE] G0/G1: Very small movement (distance < 1e-6 m). Skipping actual move.")
@@ -1332,9 +1878,11 @@ class robotDirector:
             # Calculate the time this segment should take based on distance and actual speed
             segment_duration_s = total_distance_m / current_feed_rate_mps
             
-            # Calculate the component velocities (m/s) that the robot should execute
-            self.motion_command["x"] = dx_m / segment_duration_s
-            self.motion_command["y"] = dy_m / segment_duration_s
+            # Calculate the component velocities (m/s) that the robot should execute, through the
+            # velocity calibration so the robot really covers the segment in segment_duration_s
+            command_x, command_y, _ = self._velocity_command(dx_mm / segment_duration_s, dy_mm / segment_duration_s, 0.0)
+            self.motion_command["x"] = command_x
+            self.motion_command["y"] = command_y
             self.motion_command["rotation"] = 0.0 # Linear G0/G1 moves have no rotation
 
             #print(f"[DEBUG GCODE] Moving dx={dx_m:.4f}m, dy={dy_m:.4f}m at {current_feed_rate_mps:.4f} m/s for {segment_duration_s:.4f}s.")
@@ -1593,6 +2141,17 @@ class robotDirector:
         self.btn_stop_gcode.grid(row=row_counter, column=1, padx=5, pady=5, sticky="ew")
         row_counter += 1
 
+        # Closed loop: a control thread steers the robot onto the path using the localizer's poses
+        ttk.Checkbutton(parent_frame, text="Closed loop (camera)", variable=self.gcode_closed_loop).grid(row=row_counter, column=0, padx=5, pady=2, sticky="w")
+        ttk.Checkbutton(parent_frame, text="Simulated robot", variable=self.gcode_simulated).grid(row=row_counter, column=1, padx=5, pady=2, sticky="w")
+        row_counter += 1
+        self.btn_calibrate_velocity = ttk.Button(parent_frame, text="Stop Calibration" if self.velocity_calibrator else "Calibrate Velocity",
+                                                 command=self.toggle_velocity_calibration)
+        self.btn_calibrate_velocity.grid(row=row_counter, column=0, columnspan=2, padx=5, pady=2, sticky="ew")
+        row_counter += 1
+        ttk.Label(parent_frame, textvariable=self.follower_status, wraplength=400).grid(row=row_counter, column=0, columnspan=2, padx=5, pady=2, sticky="w")
+        row_counter += 1
+
     def create_svg_bmp_director(self, parent_frame, event=None):
         ttk.Label(parent_frame, text="SVG/BMP Director (Not Implemented Yet)", background="lightgray").pack(padx=10,
                                                                                                          pady=10)
@@ -1602,8 +2161,9 @@ class robotDirector:
                                                                                                            pady=10)
 
 if __name__ == '__main__':
+    import sys
     root = tk.Tk()
-    gui = robotDirector(root)
+    gui = robotDirector(root, *sys.argv[1:2]) # Optional serial port, e.g. "sim"
     root.mainloop()
 
 
@@ -0,0 +1,134 @@
+import math
+import random
+import threading
+import time
+from collections import deque
+
+from closedLoopFollower import HEADING_OFFSET_DEG
+
+# Simulated three-wheel robot for trying closed-loop control without hardware. It takes the same
+# robot-frame velocity commands the follower sends (mm/s, deg/s), responds with a first-order lag
+# like the stepper ramp, and "films" itself: at the camera rate it takes a noisy pose and delivers
+# it after the localizer's delay as a pose message shaped like PoseStreamClient's, stage timing
+# included, so it can go straight into robotDirector._on_localization_pose.
+
+SIM_TAG_ID = 1
+PHYSICS_HZ = 200.0
+CAMERA_FPS = 30.0
+DETECTION_DELAY_S = 0.06      # Capture -> pose message, as measured on the real localizer
+RESPONSE_TIME_S = 0.08        # Velocity time constant of the drive
+POSE_NOISE = (1.0, 1.0, 0.3)  # Detection noise (mm, mm, deg)
+MAX_SPEED_MM_PER_SEC = 400.0
+MAX_TURN_DEG_PER_SEC = 180.0
+
+
+def pose_message(seq, capture_ts, grab_mono, tag_id, x, y, yaw, rng, noise=POSE_NOISE, detection_delay=DETECTION_DELAY_S):
+    """
+    A noisy detection of the true pose (x, y, yaw) as a PoseStreamClient message, without the receive
+    stamps. Shared with kinematicSimulator so both simulators emit the same format.
+    """
+    delay_ms = detection_delay * 1000.0
+    return {"seq": seq, "capture_ts": capture_ts,
+            "timing": {"grab_mono": grab_mono, "detect_start_ms": 0.0, "detect_end_ms": delay_ms * 0.7,
+                       "pnp_end_ms": delay_ms * 0.9, "publish_ms": delay_ms},
+            "poses": [{"tag_id": tag_id, "x": x + rng.gauss(0, noise[0]), "y": y + rng.gauss(0, noise[1]), "z": 0.0,
+                       "yaw": (yaw + rng.gauss(0, noise[2])) % 360.0}]}
+
+
+class SimulatedRobot:
+    def __init__(self, x=0.0, y=0.0, yaw=0.0, tag_id=SIM_TAG_ID, on_pose=None, camera_fps=CAMERA_FPS,
+                 detection_delay=DETECTION_DELAY_S, response_time=RESPONSE_TIME_S, noise=POSE_NOISE, seed=None):
+        self.tag_id = tag_id
+        self.on_pose = on_pose
+        self.camera_period = 1.0 / camera_fps
+        self.detection_delay = detection_delay
+        self.response_time = response_time
+        self.noise = noise
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+        self.x, self.y, self.yaw = float(x), float(y), float(yaw) # Truth (world frame)
+        self.vx = self.vy = self.omega = 0.0                       # Actual robot-frame velocities
+        self.command_vx = self.command_vy = self.command_omega = 0.0
+        self.laser_on = False
+        self.laser_power = 0
+        self.commands = 0
+        self.laser_distance = 0.0 # mm travelled with the laser on
+
+        self.seq = 0
+        self.in_flight = deque() # (deliver_at, message): detections still "being processed"
+        self.running = False
+        self.thread = None
+
+    def command(self, vx, vy, omega, laser_on=False, laser_power=0):
+        """Robot-frame velocity command (mm/s, mm/s, deg/s), as ClosedLoopFollower sends it."""
+        with self.lock:
+            self.command_vx = max(-MAX_SPEED_MM_PER_SEC, min(MAX_SPEED_MM_PER_SEC, vx))
+            self.command_vy = max(-MAX_SPEED_MM_PER_SEC, min(MAX_SPEED_MM_PER_SEC, vy))
+            self.command_omega = max(-MAX_TURN_DEG_PER_SEC, min(MAX_TURN_DEG_PER_SEC, omega))
+            self.laser_on = laser_on
+            self.laser_power = laser_power
+            self.commands += 1
+
+    def truth(self):
+        with self.lock:
+            return self.x, self.y, self.yaw
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+        if self.thread:
+            self.thread.join(timeout=1.0)
+            self.thread = None
+
+    def step(self, dt):
+        """Advances the physics by dt seconds."""
+        with self.lock:
+            blend = 1.0 - math.exp(-dt / self.response_time)
+            self.vx += (self.command_vx - self.vx) * blend
+            self.vy += (self.command_vy - self.vy) * blend
+            self.omega += (self.command_omega - self.omega) * blend
+            angle = math.radians(self.yaw - HEADING_OFFSET_DEG)
+            cos_a, sin_a = math.cos(angle), math.sin(angle)
+            world_vx = cos_a * self.vx - sin_a * self.vy # Inverse of the follower's world -> robot rotation
+            world_vy = sin_a * self.vx + cos_a * self.vy
+            self.x += world_vx * dt
+            self.y += world_vy * dt
+            self.yaw = (self.yaw + self.omega * dt) % 360.0
+            if self.laser_on:
+                self.laser_distance += math.hypot(world_vx, world_vy) * dt
+
+    def _capture(self, capture_ts, capture_mono):
+        """Takes a noisy detection now; it is delivered detection_delay later."""
+        x, y, yaw = self.truth()
+        self.seq += 1
+        message = pose_message(self.seq, capture_ts, capture_mono, self.tag_id, x, y, yaw, self.random,
+                               self.noise, self.detection_delay)
+        self.in_flight.append((capture_mono + self.detection_delay, message))
+
+    def _deliver(self, now_mono):
+        while self.in_flight and self.in_flight[0][0] <= now_mono:
+            _, message = self.in_flight.popleft()
+            message["recv_ts"] = time.time()
+            message["recv_mono"] = now_mono
+            if self.on_pose:
+                self.on_pose(message)
+
+    def _run(self):
+        period = 1.0 / PHYSICS_HZ
+        last = time.monotonic()
+        next_capture = last
+        while self.running:
+            time.sleep(period)
+            now = time.monotonic()
+            self.step(now - last)
+            last = now
+            if now >= next_capture:
+                self._capture(time.time(), now)
+                next_capture += self.camera_period
+            self._deliver(now)
@@ -0,0 +1,135 @@
+import time
+
+import cv2
+import numpy as np
+
+# Region-of-interest AprilTag tracking for the localizer.
+# Between frames the robot moves a few pixels, so instead of searching the whole frame
+# the detector only looks at a padded box around where each tag was (pushed forward by its
+# velocity). Crops and full-frame searches are downscaled by a decimation factor chosen from
+# the tag's apparent size, and corners are refined back on the full-resolution image.
+
+ROI_PAD_FRACTION = 0.5      # Padding around the last corners, as a fraction of the tag's side length
+ROI_VELOCITY_GAIN = 2.0     # Extra padding per pixel of expected motion since the last detection
+ROI_MIN_PAD_PX = 16
+MIN_TAG_SIDE_PX = 24        # Decimate only as far as keeps the tag at least this many pixels across
+MAX_DECIMATE = 4
+FULL_FRAME_DECIMATE = 2     # Decimation for the search after the tag is lost (before its size is known)
+FULL_RES_EVERY_N_LOST = 5   # Every Nth lost frame searches the full frame at full resolution (small/far tags)
+REACQUIRE_INTERVAL = 15     # Decimated full-frame search every N frames to pick up new tags
+TRACK_TIMEOUT_S = 0.5       # A track not seen for this long is dropped
+SUBPIX_WINDOW = (3, 3)
+SUBPIX_CRITERIA = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 20, 0.01)
+
+
+class TrackedDetection:
+    """Detection in full-frame pixel coordinates, with the attributes estimate_tag_poses uses."""
+    __slots__ = ("tag_id", "corners", "center")
+
+    def __init__(self, tag_id, corners, center):
+        self.tag_id = tag_id
+        self.corners = corners
+        self.center = center
+
+
+def decimation_for_side(side_px):
+    """Largest decimation that keeps a tag of this side length above MIN_TAG_SIDE_PX."""
+    return int(max(1, min(MAX_DECIMATE, side_px // MIN_TAG_SIDE_PX)))
+
+
+class TagRoiTracker:
+    def __init__(self, detector):
+        self.detector = detector
+        self.tracks = {} # tag_id -> {'corners', 'center', 'velocity' (px/s), 'time'}
+        self.frame_count = 0
+        self.lost_count = 0
+        # Counters for the statistics line
+        self.roi_searches = 0
+        self.full_searches = 0
+        self.pixels_searched = 0
+
+    def _detect_region(self, gray, x0, y0, x1, y1, decimate):
+        """Runs the detector on gray[y0:y1, x0:x1] downscaled by decimate; returns full-frame detections."""
+        region = gray[y0:y1, x0:x1]
+        if decimate > 1:
+            region = cv2.resize(region, ((x1 - x0) // decimate, (y1 - y0) // decimate), interpolation=cv2.INTER_AREA)
+        self.pixels_searched += region.shape[0] * region.shape[1]
+        detections = []
+        for r in self.detector.detect(np.ascontiguousarray(region)):
+            corners = r.corners.astype(np.float32) * decimate + np.array([x0, y0], dtype=np.float32)
+            if decimate > 1:
+                # Decimated corners are only accurate to ~decimate pixels; refine on the full image for solvePnP
+                corners = cv2.cornerSubPix(gray, corners.reshape(-1, 1, 2), SUBPIX_WINDOW, (-1, -1),
+                                           SUBPIX_CRITERIA).reshape(-1, 2)
+            detections.append(TrackedDetection(r.tag_id, corners, corners.mean(axis=0)))
+        return detections
+
+    def _full_frame(self, gray):
+        height, width = gray.shape[:2]
+        if self.tracks:
+            decimate = min(decimation_for_side(self._side(t['corners'])) for t in self.tracks.values())
+        elif self.lost_count % FULL_RES_EVERY_N_LOST == FULL_RES_EVERY_N_LOST - 1:
+            decimate = 1
+        else:
+            decimate = FULL_FRAME_DECIMATE
+        self.full_searches += 1
+        return self._detect_region(gray, 0, 0, width, height, decimate)
+
+    @staticmethod
+    def _side(corners):
+        return float(np.linalg.norm(corners[1] - corners[0]))
+
+    def detect(self, gray, now=None):
+        """Returns the detections in this grayscale frame, searching around known tags first."""
+        if now is None:
+            now = time.perf_counter()
+        self.frame_count += 1
+        height, width = gray.shape[:2]
+
+        # Drop tracks that haven't been seen for a while
+        for tag_id in [t for t, track in self.tracks.items() if now - track['time'] > TRACK_TIMEOUT_S]:
+            del self.tracks[tag_id]
+
+        found = {}
+        for tag_id, track in list(self.tracks.items()):
+            dt = now - track['time']
+            shift = track['velocity'] * dt # Expected motion since the tag was last seen
+            predicted = track['corners'] + shift
+            side = self._side(track['corners'])
+            pad = max(ROI_MIN_PAD_PX, ROI_PAD_FRACTION * side + ROI_VELOCITY_GAIN * float(np.abs(shift).max()))
+            x0 = int(max(0, predicted[:, 0].min() - pad))
+            y0 = int(max(0, predicted[:, 1].min() - pad))
+            x1 = int(min(width, predicted[:, 0].max() + pad))
+            y1 = int(min(height, predicted[:, 1].max() + pad))
+            if x1 - x0 < MIN_TAG_SIDE_PX or y1 - y0 < MIN_TAG_SIDE_PX:
+                continue # Predicted off-frame
+            self.roi_searches += 1
+            for detection in self._detect_region(gray, x0, y0, x1, y1, decimation_for_side(side)):
+                found[detection.tag_id] = detection
+
+        # Lost something, nothing tracked yet, or time for a periodic look for new tags
+        if len(found) < len(self.tracks) or not self.tracks or self.frame_count % REACQUIRE_INTERVAL == 0:
+            for detection in self._full_frame(gray):
+                found.setdefault(detection.tag_id, detection)
+
+        if found:
+            self.lost_count = 0
+        else:
+            self.lost_count += 1
+
+        for tag_id, detection in found.items():
+            track = self.tracks.get(tag_id)
+            velocity = np.zeros(2, dtype=np.float32)
+            if track is not None and now > track['time']:
+                velocity = (detection.center - track['center']) / (now - track['time'])
+            self.tracks[tag_id] = {'corners': detection.corners, 'center': detection.center,
+                                   'velocity': velocity, 'time': now}
+        return list(found.values())
+
+    def stats_line(self):
+        """One-line summary of how the searches went since the last call."""
+        frames = max(1, self.frame_count)
+        line = (f"Tracker: {len(self.tracks)} tracked, {self.roi_searches / frames:.2f} ROI and "
+                f"{self.full_searches / frames:.2f} full searches/frame, {self.pixels_searched / frames / 1000:.0f} kpx/frame")
+        self.frame_count = self.roi_searches = self.full_searches = self.pixels_searched = 0
+        return line
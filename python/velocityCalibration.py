@@ -0,0 +1,284 @@
+import argparse
+import json
+import math
+import threading
+import time
+
+import numpy as np
+
+from closedLoopFollower import HEADING_OFFSET_DEG
+
+# Velocity calibration: what the robot really does for a given command. The planners assume a
+# command of x m/s moves the robot x * 1000 mm/s and r rev/s turns it r * 360 deg/s, but the
+# firmware's SCALE_FACTOR, its 2 * 3.1459, wheel slip and motor differences all get in between,
+# and open-loop segments overshoot or fall short.
+#
+# VelocityCalibrator drives a fixed set of constant commands (several directions, each followed by
+# its opposite so the robot ends where it started, at a few speeds, plus turns both ways), fits the
+# velocity the localizer actually saw in each run by least squares over the steady part of the
+# run, and then fits per direction a complex gain c (actual = c * commanded, so a gain and a crab
+# angle) and per turning direction a rotation gain. The result, a VelocityCalibration, is saved as
+# JSON; the director applies it to every velocity it commands (command_for) and the odometry uses
+# it as its velocity model.
+
+CALIBRATION_FILE = "velocity_calibration.json"
+TEST_DIRECTIONS_DEG = (0, 45, 90, 135)       # Each is run followed by its opposite
+TEST_SPEEDS_MM_PER_SEC = (30.0, 60.0, 120.0)
+TEST_TURNS_DEG_PER_SEC = (45.0, 90.0)        # Each run both ways
+RUN_S = 1.5                 # Constant command per test
+FIT_SKIP_S = 0.3            # Start of each run left out of the fit: command latency and spin-up
+SETTLE_S = 0.6              # Stopped between runs; also lets the last poses of a run arrive
+COMMAND_REFRESH_S = 0.1     # The command is re-sent this often during a run
+MIN_SAMPLES = 8             # Fewer poses than this in a run's fit window: the run is discarded
+
+
+def nominal_command(vx, vy, omega):
+    """Robot-frame velocity (mm/s, mm/s, deg/s) -> command (m/s, m/s, rev/s) as the planners send it uncalibrated."""
+    return vx / 1000.0, vy / 1000.0, omega / 360.0
+
+
+def measured_velocity(samples, heading_offset=HEADING_OFFSET_DEG):
+    """
+    Least-squares robot-frame velocity (mm/s, mm/s, deg/s) over pose samples [(ts, x, y, yaw)]:
+    the slope of each coordinate against time, rotated into the robot frame at the mean heading.
+    """
+    data = np.asarray(samples, dtype=np.float64)
+    t = data[:, 0] - data[0, 0]
+    yaw = np.degrees(np.unwrap(np.radians(data[:, 3])))
+    design = np.stack([t, np.ones_like(t)], axis=1)
+    slopes, _, _, _ = np.linalg.lstsq(design, np.stack([data[:, 1], data[:, 2], yaw], axis=1), rcond=None)
+    world_vx, world_vy, omega = slopes[0]
+    angle = math.radians(float(np.mean(yaw)) - heading_offset)
+    cos_a, sin_a = math.cos(angle), math.sin(angle)
+    return cos_a * world_vx + sin_a * world_vy, -sin_a * world_vx + cos_a * world_vy, float(omega)
+
+
+class VelocityCalibration:
+    """
+    Correction table: per command direction (degrees, robot frame) a gain and a crab angle, and a
+    rotation gain for each turning direction. Directions in between are interpolated.
+    """
+    def __init__(self, directions_deg, gains, angles_deg, turn_gain_ccw=1.0, turn_gain_cw=1.0, info=None):
+        order = np.argsort(np.asarray(directions_deg, dtype=np.float64) % 360.0)
+        self.directions_deg = (np.asarray(directions_deg, dtype=np.float64) % 360.0)[order]
+        self.gains = np.asarray(gains, dtype=np.float64)[order]
+        self.angles_deg = np.asarray(angles_deg, dtype=np.float64)[order]
+        self.turn_gain_ccw = float(turn_gain_ccw)
+        self.turn_gain_cw = float(turn_gain_cw)
+        self.info = info or {}
+
+    def _gain(self, direction_deg):
+        """Interpolated (gain, crab angle in deg) for a command direction."""
+        d = direction_deg % 360.0
+        return (float(np.interp(d, self.directions_deg, self.gains, period=360.0)),
+                float(np.interp(d, self.directions_deg, self.angles_deg, period=360.0)))
+
+    def velocity_model(self, x, y, r):
+        """Command (m/s, m/s, rev/s) -> the robot-frame velocity it produces (mm/s, mm/s, deg/s). For OdometryEstimator."""
+        vx, vy, omega = float(x) * 1000.0, float(y) * 1000.0, float(r) * 360.0
+        speed = math.hypot(vx, vy)
+        if speed > 1e-9:
+            gain, angle = self._gain(math.degrees(math.atan2(vy, vx)))
+            heading = math.atan2(vy, vx) + math.radians(angle)
+            vx, vy = gain * speed * math.cos(heading), gain * speed * math.sin(heading)
+        return vx, vy, omega * (self.turn_gain_ccw if omega >= 0 else self.turn_gain_cw)
+
+    def command_for(self, vx, vy, omega):
+        """Robot-frame velocity wanted (mm/s, mm/s, deg/s) -> the command (m/s, m/s, rev/s) that produces it."""
+        x = y = 0.0
+        speed = math.hypot(vx, vy)
+        if speed > 1e-9:
+            wanted = math.atan2(vy, vx)
+            direction = wanted
+            for _ in range(2): # The crab angle depends on the command direction, which depends on the crab angle
+                gain, angle = self._gain(math.degrees(direction))
+                direction = wanted - math.radians(angle)
+            command_speed = speed / max(gain, 1e-6) / 1000.0
+            x, y = command_speed * math.cos(direction), command_speed * math.sin(direction)
+        turn_gain = self.turn_gain_ccw if omega >= 0 else self.turn_gain_cw
+        return x, y, omega / max(turn_gain, 1e-6) / 360.0
+
+    def summary(self):
+        parts = [f"{d:.0f} deg x{g:.3f} {a:+.1f} deg" for d, g, a in zip(self.directions_deg, self.gains, self.angles_deg)]
+        return (f"Velocity calibration: {', '.join(parts)}; turn x{self.turn_gain_ccw:.3f} CCW, "
+                f"x{self.turn_gain_cw:.3f} CW")
+
+    def save(self, path=CALIBRATION_FILE):
+        table = {"directions_deg": self.directions_deg.tolist(), "gains": self.gains.tolist(),
+                 "angles_deg": self.angles_deg.tolist(), "turn_gain_ccw": self.turn_gain_ccw,
+                 "turn_gain_cw": self.turn_gain_cw, "info": self.info}
+        with open(path, 'w') as f:
+            json.dump(table, f, indent=2)
+
+    @classmethod
+    def load(cls, path=CALIBRATION_FILE):
+        with open(path, 'r') as f:
+            table = json.load(f)
+        return cls(table["directions_deg"], table["gains"], table["angles_deg"], table["turn_gain_ccw"],
+                   table["turn_gain_cw"], table.get("info"))
+
+
+def default_tests(directions=TEST_DIRECTIONS_DEG, speeds=TEST_SPEEDS_MM_PER_SEC, turns=TEST_TURNS_DEG_PER_SEC):
+    """Robot-frame velocities (mm/s, mm/s, deg/s) to run, out-and-back pairs so the robot stays put."""
+    tests = []
+    for speed in speeds:
+        for direction in directions:
+            for d in (direction, direction + 180.0):
+                tests.append((speed * math.cos(math.radians(d)), speed * math.sin(math.radians(d)), 0.0))
+    for turn in turns:
+        tests.append((0.0, 0.0, turn))
+        tests.append((0.0, 0.0, -turn))
+    return tests
+
+
+def fit_calibration(runs):
+    """
+    runs: [(commanded (vx, vy, omega), measured (vx, vy, omega))] in nominal mm/s, deg/s.
+    Returns a VelocityCalibration plus the fit residuals.
+    """
+    translations = {}
+    turns = {1: [], -1: []}
+    for commanded, measured in runs:
+        if abs(commanded[2]) > 1e-9:
+            turns[1 if commanded[2] > 0 else -1].append((commanded[2], measured[2]))
+        else:
+            direction = round(math.degrees(math.atan2(commanded[1], commanded[0])) % 360.0, 3)
+            translations.setdefault(direction, []).append((complex(commanded[0], commanded[1]), complex(measured[0], measured[1])))
+
+    directions, gains, angles, residuals = [], [], [], []
+    for direction, pairs in sorted(translations.items()):
+        n = np.array([p[0] for p in pairs])
+        a = np.array([p[1] for p in pairs])
+        c = np.sum(np.conj(n) * a) / np.sum(np.abs(n) ** 2) # Least squares a = c * n through the origin
+        directions.append(direction)
+        gains.append(abs(c))
+        angles.append(math.degrees(np.angle(c)))
+        residuals.append(float(np.sqrt(np.mean(np.abs(a - c * n) ** 2))))
+    turn_gains = {}
+    for sign, pairs in turns.items():
+        if pairs:
+            n = np.array([p[0] for p in pairs])
+            a = np.array([p[1] for p in pairs])
+            turn_gains[sign] = float(np.sum(n * a) / np.sum(n * n))
+    info = {"runs": len(runs), "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "residual_mm_per_sec": dict(zip([f"{d:.0f}" for d in directions], residuals))}
+    calibration = VelocityCalibration(directions, gains, angles, turn_gains.get(1, 1.0),
+                                      turn_gains.get(-1, turn_gains.get(1, 1.0)), info)
+    return calibration, residuals
+
+
+class VelocityCalibrator:
+    """
+    Runs the tests. send(command) takes a command dict like the director's ("x", "y" m/s,
+    "rotation" rev/s, "laser_on", "laser_power"); add_pose() is fed the robot's raw localizer
+    poses (capture time, mm, deg) from any thread while run() is going.
+    """
+    def __init__(self, send, tests=None, run_s=RUN_S, settle_s=SETTLE_S, log=print):
+        self.send = send
+        self.tests = default_tests() if tests is None else tests
+        self.run_s = run_s
+        self.settle_s = settle_s
+        self.log = log
+        self.samples = []
+        self.lock = threading.Lock()
+        self.running = False
+        self.completed = 0
+        self.result = None
+        self.error = None
+
+    def add_pose(self, ts, x, y, yaw):
+        if self.running:
+            with self.lock:
+                self.samples.append((ts, x, y, yaw))
+
+    def stop(self):
+        self.running = False
+
+    def _command(self, vx, vy, omega):
+        x, y, r = nominal_command(vx, vy, omega)
+        self.send({"x": x, "y": y, "rotation": r, "laser_on": False, "laser_power": 0})
+
+    def _window(self, start, end):
+        with self.lock:
+            window = [s for s in self.samples if start <= s[0] <= end]
+            self.samples = [s for s in self.samples if s[0] > end]
+        return window
+
+    def run(self):
+        """Drives every test and fits the table. Blocking; returns the VelocityCalibration or None if stopped or short of data."""
+        self.running = True
+        runs = []
+        try:
+            for vx, vy, omega in self.tests:
+                if not self.running:
+                    break
+                start = time.time()
+                while self.running and time.time() - start < self.run_s:
+                    self._command(vx, vy, omega)
+                    time.sleep(COMMAND_REFRESH_S)
+                end = time.time()
+                self._command(0.0, 0.0, 0.0)
+                time.sleep(self.settle_s)
+                window = self._window(start + FIT_SKIP_S, end)
+                if len(window) < MIN_SAMPLES:
+                    self.log(f"Calibration run ({vx:.0f}, {vy:.0f}, {omega:.0f}): only {len(window)} poses, skipped")
+                    continue
+                measured = measured_velocity(window)
+                runs.append(((vx, vy, omega), measured))
+                self.completed += 1
+                self.log(f"Calibration run ({vx:.0f}, {vy:.0f}, {omega:.0f}) -> "
+                         f"({measured[0]:.1f}, {measured[1]:.1f}, {measured[2]:.1f})")
+        finally:
+            self._command(0.0, 0.0, 0.0)
+            completed = self.running
+            self.running = False
+        if not completed or not runs:
+            self.error = "stopped" if not completed else "no usable runs (is the localizer seeing the robot?)"
+            return None
+        self.result, _ = fit_calibration(runs)
+        return self.result
+
+
+def main():
+    # Runs the calibration on the simulated robot, which is driven through the firmware's kinematics
+    # (omniKinematics) with an extra mismatch, and checks the fitted table undoes both
+    from omniKinematics import body_velocity
+    from robotSimulator import SimulatedRobot
+    parser = argparse.ArgumentParser(description="Velocity calibration against the simulated robot.")
+    parser.add_argument("--mismatch", type=float, default=1.1, help="Extra speed factor of the simulated drive")
+    parser.add_argument("--crab", type=float, default=3.0, help="Extra crab angle of the simulated drive (deg)")
+    parser.add_argument("--speeds", type=float, nargs="+", default=[60.0])
+    parser.add_argument("--output", default=CALIBRATION_FILE)
+    args = parser.parse_args()
+
+    robot = SimulatedRobot()
+    crab = math.radians(args.crab)
+
+    def send(command):
+        vx, vy, omega = (float(v) for v in body_velocity(command["x"], command["y"], command["rotation"]))
+        vx, vy = (args.mismatch * (vx * math.cos(crab) - vy * math.sin(crab)),
+                  args.mismatch * (vx * math.sin(crab) + vy * math.cos(crab)))
+        robot.command(vx, vy, omega)
+
+    calibrator = VelocityCalibrator(send, default_tests(speeds=args.speeds))
+    robot.on_pose = lambda message: [calibrator.add_pose(message["capture_ts"], p["x"], p["y"], p["yaw"])
+                                     for p in message["poses"]]
+    robot.start()
+    print(f"Running {len(calibrator.tests)} calibration runs (about {len(calibrator.tests) * (RUN_S + SETTLE_S):.0f} s)")
+    calibration = calibrator.run()
+    robot.stop()
+    if calibration is None:
+        print(f"Calibration failed: {calibrator.error}")
+        return
+    print(calibration.summary())
+    calibration.save(args.output)
+    print(f"Saved to {args.output}")
+
+    # What the table commands for 100 mm/s along X, and what the simulated drive then does
+    x, y, r = calibration.command_for(100.0, 0.0, 0.0)
+    send({"x": x, "y": y, "rotation": r})
+    print(f"For 100 mm/s along X: command ({x:.4f}, {y:.4f}) m/s, robot does ({robot.command_vx:.1f}, {robot.command_vy:.1f}) mm/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+import argparse
+import glob
+import itertools
+import json
+import math
+import os
+import platform
+import time
+
+import cv2
+import numpy as np
+
+import AprilTagTest14 as localizer
+from frameRecorder import RecordingReader, is_recording
+from poseStream import PoseStreamClient, PoseStreamServer
+
+# Reproducible localizer benchmark: replays a video file, an image sequence or a frameRecorder.py
+# recording (AprilTagTest14.py --record) through the detection
+# pipeline as fast as it can and reports FPS, the time of every stage (decode, grayscale, detect,
+# PnP, publish), the detection rate and the pose jitter, for every combination of the requested
+# detector settings. Results go to JSON; --baseline compares against an earlier run.
+#
+#   python visionBenchmark.py ../vids/3WheelsBothNoSoda.mp4 --frames 300
+#   python visionBenchmark.py "../pics/bot*.jpg" --nthreads 1 4 --quad-decimate 1 2 --refine-edges 0 1
+#   python visionBenchmark.py ../vids/3WheelsBothNoSoda.mp4 --output new.json --baseline old.json
+
+DEFAULT_SOURCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "vids", "3WheelsBothNoSoda.mp4")
+DEFAULT_OUTPUT = "vision_benchmark.json"
+DEFAULT_FRAMES = 300
+WARMUP_RUNS = 5            # Untimed detector runs on the first frame before each configuration
+STAGES = ("decode", "gray", "detect", "pnp", "publish")
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+REGRESSION_THRESHOLD = 0.05 # FPS drop against the baseline that gets flagged
+
+
+class FrameSource:
+    """Frames of a video file, a recording, an image directory or an image glob, decoded one at a time."""
+    def __init__(self, path):
+        self.path = path
+        self.capture = None
+        self.images = None
+        if is_recording(path):
+            self.capture = RecordingReader(path) # Same read()/release() as a VideoCapture
+        elif os.path.isdir(path):
+            self.images = sorted(p for p in glob.glob(os.path.join(path, "*")) if p.lower().endswith(IMAGE_EXTENSIONS))
+        elif any(c in path for c in "*?[") or path.lower().endswith(IMAGE_EXTENSIONS):
+            self.images = sorted(glob.glob(path))
+        else:
+            self.capture = cv2.VideoCapture(path)
+            if not self.capture.isOpened():
+                raise IOError(f"Could not open {path}")
+        if self.images is not None and not self.images:
+            raise IOError(f"No images match {path}")
+        self.index = 0
+
+    def read(self):
+        if self.capture is not None:
+            return self.capture.read()
+        if self.index >= len(self.images):
+            return False, None
+        frame = cv2.imread(self.images[self.index])
+        self.index += 1
+        return frame is not None, frame
+
+    def release(self):
+        if self.capture is not None:
+            self.capture.release()
+
+
+def start_publisher():
+    """Pose server on a free port with one binary client draining it, so publish() does real work."""
+    server = PoseStreamServer(port=0)
+    server.start()
+    port = server.listen_socket.getsockname()[1]
+    client = PoseStreamClient(lambda message: None, port=port, binary=True)
+    client.start()
+    deadline = time.perf_counter() + 3.0
+    while server.client_count() == 0 and time.perf_counter() < deadline:
+        time.sleep(0.01)
+    return server, client
+
+
+def stage_summary(times_ms):
+    if not times_ms:
+        return {"mean_ms": 0.0, "p50_ms": 0.0, "p95_ms": 0.0}
+    ordered = sorted(times_ms)
+    return {"mean_ms": round(sum(ordered) / len(ordered), 3), "p50_ms": round(ordered[len(ordered) // 2], 3),
+            "p95_ms": round(ordered[int(0.95 * (len(ordered) - 1))], 3)}
+
+
+def pose_jitter(track):
+    """
+    Jitter of one tag's poses, track = [(frame_index, x, y, yaw), ...].
+    std: spread over the whole run (the jitter itself when the tag doesn't move).
+    step_rms: RMS second difference between consecutive frames, which ignores steady motion.
+    """
+    data = np.array(track, dtype=np.float64)
+    result = {"frames": len(track), "std_x": float(np.std(data[:, 1])), "std_y": float(np.std(data[:, 2])),
+              "std_yaw_deg": float(np.degrees(np.std(np.unwrap(np.radians(data[:, 3])))))}
+    consecutive = np.diff(data[:, 0]) == 1
+    runs = consecutive[1:] & consecutive[:-1] # Three frames in a row
+    if runs.any():
+        second = data[2:, 1:3] - 2 * data[1:-1, 1:3] + data[:-2, 1:3]
+        result["step_rms"] = float(math.sqrt(np.mean(np.sum(second[runs] ** 2, axis=1))))
+    return {k: round(v, 3) if isinstance(v, float) else v for k, v in result.items()}
+
+
+def run_config(path, settings, max_frames, publish):
+    """Replays the source once with one set of detector settings. Returns the result dictionary."""
+    localizer.initialize_apriltag_detector(**settings)
+    source = FrameSource(path)
+    ret, frame = source.read()
+    if ret:
+        for _ in range(WARMUP_RUNS): # The first detector calls allocate their buffers
+            localizer.estimate_tag_poses(frame)
+    source.release()
+
+    source = FrameSource(path)
+    server = client = None
+    if publish:
+        server, client = start_publisher()
+        localizer.pose_server = server
+    times = {stage: [] for stage in STAGES}
+    tracks = {}
+    frames = detected_frames = detections = 0
+    size = None
+    start = None
+    try:
+        while frames < max_frames:
+            t0 = time.perf_counter()
+            ret, frame = source.read()
+            if not ret:
+                break
+            t1 = time.perf_counter()
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            t2 = time.perf_counter()
+            results = localizer.detect_tags(gray)
+            t3 = time.perf_counter()
+            poses = localizer.poses_from_detections(results, frame)
+            t4 = time.perf_counter()
+            localizer.send_tag_poses(poses, time.time())
+            t5 = time.perf_counter()
+
+            frames += 1
+            if start is None:
+                start = t0
+            size = (frame.shape[1], frame.shape[0])
+            for stage, duration in zip(STAGES, (t1 - t0, t2 - t1, t3 - t2, t4 - t3, t5 - t4)):
+                times[stage].append(duration * 1000.0)
+            if poses:
+                detected_frames += 1
+                detections += len(poses)
+            for pose in poses:
+                tracks.setdefault(int(pose["tag_id"]), []).append((frames, float(pose["x"]), float(pose["y"]), float(pose["yaw"])))
+        elapsed = time.perf_counter() - start if start is not None else 0.0
+    finally:
+        source.release()
+        if server:
+            localizer.pose_server = None
+            client.stop()
+            server.stop()
+
+    return {
+        "settings": settings,
+        "frames": frames,
+        "resolution": size,
+        "fps": round(frames / elapsed, 2) if elapsed else 0.0,
+        "stages": {stage: stage_summary(times[stage]) for stage in STAGES},
+        "detection_rate": round(detected_frames / frames, 4) if frames else 0.0,
+        "tags_per_frame": round(detections / frames, 3) if frames else 0.0,
+        "jitter": {str(tag_id): pose_jitter(track) for tag_id, track in sorted(tracks.items()) if len(track) >= 3},
+        "units": "mm" if localizer.calibration_cache is not None else "px",
+    }
+
+
+def print_result(result):
+    settings = ", ".join(f"{k}={v}" for k, v in result["settings"].items())
+    stages = " | ".join(f"{stage} {result['stages'][stage]['mean_ms']:.2f}" for stage in STAGES)
+    print(f"[{settings}] {result['fps']:.1f} FPS over {result['frames']} frames, "
+          f"detected in {result['detection_rate'] * 100:.1f}% ({result['tags_per_frame']:.2f} tags/frame)")
+    print(f"    stage means (ms): {stages}")
+    for tag_id, jitter in result["jitter"].items():
+        print(f"    tag {tag_id}: std x/y {jitter['std_x']:.2f}/{jitter['std_y']:.2f} {result['units']}, "
+              f"yaw {jitter['std_yaw_deg']:.2f} deg, step rms {jitter.get('step_rms', float('nan')):.2f} {result['units']}")
+
+
+def compare_with_baseline(results, source, baseline_path):
+    with open(baseline_path, 'r') as f:
+        baseline = json.load(f)
+    if os.path.abspath(baseline.get("source", "")) != os.path.abspath(source):
+        print(f"Note: {baseline_path} was recorded on {baseline.get('source')}, not {source}")
+    previous = {json.dumps(r["settings"], sort_keys=True): r for r in baseline.get("results", [])}
+    print(f"Against {baseline_path}:")
+    for result in results:
+        old = previous.get(json.dumps(result["settings"], sort_keys=True))
+        if not old or not old["fps"] or not result["frames"]:
+            continue
+        change = result["fps"] / old["fps"] - 1.0
+        flag = "  <-- REGRESSION" if change < -REGRESSION_THRESHOLD else ""
+        print(f"    {result['settings']}: {old['fps']:.1f} -> {result['fps']:.1f} FPS ({change * 100:+.1f}%), "
+              f"detection {old['detection_rate'] * 100:.1f}% -> {result['detection_rate'] * 100:.1f}%{flag}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay footage through the AprilTag localizer and time every stage.")
+    parser.add_argument("source", nargs="?", default=DEFAULT_SOURCE, help="Video file, recording, image directory or image glob")
+    parser.add_argument("--frames", type=int, default=DEFAULT_FRAMES, help="Frames timed per configuration")
+    parser.add_argument("--nthreads", type=int, nargs="+", default=[4])
+    parser.add_argument("--quad-decimate", type=float, nargs="+", default=[1.0])
+    parser.add_argument("--refine-edges", type=int, nargs="+", default=[1])
+    parser.add_argument("--calibration", default=localizer.CALIBRATION_FILE)
+    parser.add_argument("--no-publish", action="store_true", help="Leave the pose stream out of the timing")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT, help="JSON results file")
+    parser.add_argument("--baseline", default=None, help="Earlier results file to compare against")
+    args = parser.parse_args()
+
+    if os.path.exists(args.calibration):
+        localizer.load_camera_calibration(args.calibration)
+    else:
+        print("No calibration file: poses are in pixels and nothing is published.")
+
+    results = []
+    for nthreads, quad_decimate, refine_edges in itertools.product(args.nthreads, args.quad_decimate, args.refine_edges):
+        settings = {"nthreads": nthreads, "quad_decimate": quad_decimate, "refine_edges": refine_edges}
+        result = run_config(args.source, settings, args.frames, not args.no_publish)
+        print_result(result)
+        results.append(result)
+
+    report = {
+        "source": args.source,
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "machine": {"platform": platform.platform(), "python": platform.python_version(),
+                    "opencv": cv2.__version__, "cpus": os.cpu_count()},
+        "calibrated": localizer.calibration_cache is not None,
+        "results": results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+    if args.baseline:
+        compare_with_baseline(results, args.source, args.baseline)
+
+
+if __name__ == "__main__":
+    main()